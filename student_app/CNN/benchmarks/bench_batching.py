@@ -0,0 +1,75 @@
+"""Throughput of the micro-batched classification path.
+
+Runs `concurrency` client threads against one MicroBatcher and reports
+images/sec for every combination of batch size and wait window:
+
+    python benchmarks/bench_batching.py --batch-sizes 1 4 8 16 --wait-ms 0 5 20 --cam none
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+
+from common import make_images
+
+import inference
+from micro_batcher import MicroBatcher
+
+
+def run_setting(model, paths, max_batch_size, max_wait_ms, concurrency, requests_per_client, cam):
+    batcher = MicroBatcher(lambda batch: inference.classify_images(batch, model=model, cam=cam),
+                           max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    def client(offset):
+        for i in range(requests_per_client):
+            batcher.submit(paths[(offset + i) % len(paths)]).result()
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    stats = batcher.stats()
+    return {
+        'max_batch_size': max_batch_size,
+        'max_wait_ms': max_wait_ms,
+        'concurrency': concurrency,
+        'cam': cam,
+        'images': stats['images'],
+        'mean_batch_size': round(stats['mean_batch_size'], 2),
+        'images_per_sec': round(stats['images'] / elapsed, 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-batching throughput benchmark')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--wait-ms', type=float, nargs='+', default=[0.0, 5.0, 20.0])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests-per-client', type=int, default=4)
+    parser.add_argument('--cam', choices=inference.CAM_METHODS + ('none',), default='smoothgradcampp')
+    parser.add_argument('--output', default=None, help='Optional JSON file for the results')
+    args = parser.parse_args()
+    cam = None if args.cam == 'none' else args.cam
+
+    model = inference.load_model()
+    model.eval()
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        paths = make_images(root, args.concurrency)
+        inference.classify_images(paths[:1], model=model, cam=cam)  # warm-up
+        for max_batch_size in args.batch_sizes:
+            for max_wait_ms in args.wait_ms:
+                result = run_setting(model, paths, max_batch_size, max_wait_ms,
+                                     args.concurrency, args.requests_per_client, cam)
+                results.append(result)
+                print(f"batch={max_batch_size:<3} wait={max_wait_ms:>5.1f}ms  "
+                      f"mean batch={result['mean_batch_size']:<5} {result['images_per_sec']:>7.2f} img/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,137 @@
+"""Scaling of distributed (DDP over gloo) training with the number of processes.
+
+For every process count, the processes are started on this machine the way
+torchrun would start them, and each one runs modelRN.train_model on its
+DistributedSampler shard of the same dataset from the same initial weights
+(see distributed.py). Reported are the global training images/sec (summed
+over the ranks, first epoch skipped as warm-up), the speedup over the first
+count and the scaling efficiency (speedup / processes). Each process gets
+cores // processes intra-op threads, so on one machine the speedup is bounded
+by how much better ResNet18 runs on several small thread pools than on one.
+
+    python benchmarks/bench_distributed.py --processes 1 2 4 8 --epochs 3
+    python benchmarks/bench_distributed.py --data-dir callsifi_images --output ddp.json
+
+Without --data-dir the dataset is random tensors kept in memory, which
+measures compute and gradient all-reduce without JPEG decoding.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import tempfile
+
+import torch
+import torch.multiprocessing as mp
+import torch.optim as optim
+from torch.utils.data import TensorDataset, random_split
+from torchvision.datasets import ImageFolder
+
+import common  # noqa: F401  (puts the CNN modules on sys.path)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import modelRN
+from data_loading import loader_options
+from distributed import cleanup, init_distributed, make_distributed_loader, wrap_model
+from inference import build_model, class_names
+from preprocessing import load_image
+from telemetry import MetricsWriter, configure_logging
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_dataset(data_dir, images):
+    if data_dir:
+        return ImageFolder(root=data_dir, transform=modelRN.data_transforms['val'], loader=load_image)
+    generator = torch.Generator().manual_seed(0)
+    return TensorDataset(torch.randn(images, 3, 224, 224, generator=generator),
+                         torch.randint(len(class_names), (images,), generator=generator))
+
+
+def worker(rank, world_size, port, args, initial_state, result_path):
+    # The environment torchrun would set up for each process
+    os.environ.update({'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(port), 'RANK': str(rank),
+                       'LOCAL_RANK': str(rank), 'WORLD_SIZE': str(world_size),
+                       'LOCAL_WORLD_SIZE': str(world_size)})
+    init_distributed()
+    configure_logging('warning')
+
+    dataset = make_dataset(args.data_dir, args.images)
+    train_size = int(0.8 * len(dataset))
+    train_dataset, val_dataset = random_split(dataset, [train_size, len(dataset) - train_size],
+                                              generator=torch.Generator().manual_seed(0))
+    options = loader_options(num_workers=args.workers)
+    train_loader = make_distributed_loader(train_dataset, batch_size=args.batch_size, shuffle=True, options=options)
+    val_loader = make_distributed_loader(val_dataset, batch_size=args.batch_size, shuffle=False, options=options)
+
+    model = build_model()
+    model.load_state_dict(initial_state)
+    model = wrap_model(model.to(modelRN.device))
+    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    metrics = MetricsWriter()
+    modelRN.train_model(model, optimizer, num_epochs=args.epochs, train_loader=train_loader, val_loader=val_loader,
+                        metrics=metrics)
+    cleanup()
+
+    if rank == 0:
+        train = [record for record in metrics.records if record['phase'] == 'train']
+        # The first epoch includes one-time warm-up (allocator, oneDNN kernels), so skip it when there are more
+        timed = train[1:] or train
+        with open(result_path, 'w') as f:
+            json.dump({
+                'processes': world_size,
+                'threads_per_process': torch.get_num_threads(),
+                'train_images_per_sec': sum(r['images_per_sec'] for r in timed) / len(timed),
+                'step_time_ms': sum(r['step_time_ms'] for r in timed) / len(timed),
+                'data_wait_fraction': sum(r['data_wait_fraction'] for r in timed) / len(timed),
+                'final_train_loss': train[-1]['loss'],
+            }, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Training throughput of DDP with 1, 2, 4 and 8 processes')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--data-dir', default=None, help='ImageFolder directory (default: random in-memory tensors)')
+    parser.add_argument('--images', type=int, default=256, help='Size of the random dataset')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=16, help='Per-process batch size')
+    parser.add_argument('--workers', type=int, default=0, help='DataLoader workers per process')
+    parser.add_argument('--output', default=None, help='Optional JSON file for the results')
+    args = parser.parse_args()
+    if args.data_dir:
+        args.data_dir = os.path.abspath(args.data_dir)
+
+    torch.manual_seed(0)
+    initial_state = {name: tensor.clone() for name, tensor in build_model().state_dict().items()}
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        # train_model writes its loss plot to ./GRAPH; keep it out of the working tree
+        previous_dir = os.getcwd()
+        os.chdir(root)
+        try:
+            for processes in args.processes:
+                result_path = os.path.join(root, f'result_{processes}.json')
+                mp.spawn(worker, args=(processes, free_port(), args, initial_state, result_path), nprocs=processes)
+                with open(result_path) as f:
+                    results.append(json.load(f))
+        finally:
+            os.chdir(previous_dir)
+
+    baseline = results[0]
+    print(f"{'processes':>9}{'threads':>9}{'img/s':>9}{'speedup':>9}{'efficiency':>12}{'step ms':>9}")
+    for result in results:
+        result['speedup_vs_first'] = result['train_images_per_sec'] / baseline['train_images_per_sec']
+        result['scaling_efficiency'] = result['speedup_vs_first'] * baseline['processes'] / result['processes']
+        print(f"{result['processes']:>9}{result['threads_per_process']:>9}{result['train_images_per_sec']:>9.1f}"
+              f"{result['speedup_vs_first']:>8.2f}x{result['scaling_efficiency'] * 100:>11.0f}%"
+              f"{result['step_time_ms']:>9.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
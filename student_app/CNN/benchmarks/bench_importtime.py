@@ -0,0 +1,64 @@
+"""Import-time budget of the classification entry point.
+
+Runs `python -X importtime -c "import inference"` in a fresh interpreter,
+reports the total and the heaviest direct imports, and fails when the
+total exceeds the budget or when a module that should stay lazy was loaded:
+
+    python benchmarks/bench_importtime.py --budget-ms 3000 --output importtime.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from common import CNN_DIR
+
+# Only needed once an overlay is requested, or only by training
+LAZY_MODULES = ('torchcam', 'matplotlib', 'overlay', 'modelRN')
+
+
+def measure(module='inference'):
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=CNN_DIR, check=True, capture_output=True, text=True)
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        # Nesting is shown by two spaces of indentation per level after the separator
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append({'module': name.strip(), 'self_us': int(self_us), 'cumulative_us': int(cumulative_us),
+                        'depth': depth})
+    return imports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import-time budget check')
+    parser.add_argument('--module', default='inference')
+    parser.add_argument('--budget-ms', type=float, default=None, help='Fail when the total import time is higher')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--output', default=None, help='Optional JSON file for the results')
+    args = parser.parse_args()
+
+    imports = measure(args.module)
+    top_level = [entry for entry in imports if entry['depth'] == 0]
+    total_ms = sum(entry['cumulative_us'] for entry in top_level) / 1000
+    direct = [entry for entry in imports if entry['depth'] == 1]
+    loaded = {entry['module'].split('.')[0] for entry in imports}
+    lazy_loaded = sorted(set(LAZY_MODULES) & loaded - {args.module})
+
+    print(f"import {args.module}: {total_ms:.0f} ms")
+    for entry in sorted(direct, key=lambda e: e['cumulative_us'], reverse=True)[:args.top]:
+        print(f"  {entry['cumulative_us'] / 1000:>8.1f} ms  {entry['module']}")
+    if lazy_loaded:
+        print(f"Modules that should be imported lazily were loaded: {', '.join(lazy_loaded)}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'module': args.module, 'total_ms': round(total_ms, 1), 'lazy_loaded': lazy_loaded,
+                       'budget_ms': args.budget_ms, 'imports': direct}, f, indent=2)
+
+    over_budget = args.budget_ms is not None and total_ms > args.budget_ms
+    if over_budget:
+        print(f"Over budget: {total_ms:.0f} ms > {args.budget_ms:.0f} ms")
+    sys.exit(1 if over_budget or lazy_loaded else 0)
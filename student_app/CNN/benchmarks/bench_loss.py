@@ -0,0 +1,104 @@
+"""custom_loss cost per training step: the old per-sample loop vs the vectorized mask.
+
+legacy:     the original custom_loss, a Python loop over labels and feature dicts
+            with its DEBUG prints (sent to /dev/null so the terminal is not timed)
+vectorized: modelRN.custom_loss on a boolean feature tensor
+
+Both are fed the same random logits, labels and features. Their values
+differ: the legacy penalty was a constant count of the label's missing
+features, the current one weights every class's missing features by its
+predicted probability so it has a gradient. The vectorized loss must match
+reference_custom_loss, a plain loop over the current definition.
+
+    python benchmarks/bench_loss.py --batch-sizes 16 32 64 128 256
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+
+import torch
+import torch.nn as nn
+
+import common  # noqa: F401  (puts the CNN directory on sys.path)
+
+from modelRN import class_names, classification_features, custom_loss, feature_names
+
+
+def legacy_custom_loss(outputs, labels, features):
+    base_loss = nn.CrossEntropyLoss()(outputs, labels)
+    penalty = 0.0
+
+    if features is None or len(features) != len(labels):
+        return base_loss
+
+    for i, label in enumerate(labels):
+        class_name = class_names[label.item()]
+        required_features = classification_features.get(class_name, {})
+
+        print(f"DEBUG: Required features for {class_name}: {required_features}")
+        print(f"DEBUG: Provided features: {features[i]}")
+
+        for feature_name in required_features:
+            if required_features.get(feature_name) and not features[i].get(feature_name):
+                print(f"DEBUG: Missing feature '{feature_name}'")
+                penalty += 0.5
+
+    print(f"DEBUG: Computed custom loss - Base: {base_loss.item():.4f}, Penalty: {penalty:.4f}")
+    return base_loss + penalty
+
+
+# The current custom_loss written out per image and class, to check the vectorized version against
+def reference_custom_loss(outputs, labels, features):
+    base_loss = nn.CrossEntropyLoss()(outputs, labels)
+    probabilities = torch.softmax(outputs.float(), dim=1)
+    penalty = 0.0
+    for i in range(len(labels)):
+        for c, class_name in enumerate(class_names):
+            required_features = classification_features.get(class_name, {})
+            missing = sum(1 for name in feature_names if required_features.get(name) and not features[i][name])
+            penalty = penalty + probabilities[i, c] * missing
+    return base_loss + penalty / len(labels) * 0.5
+
+
+def time_per_step(function, args, repeats):
+    function(*args)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(*args)
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the legacy and vectorized custom_loss')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[16, 32, 64, 128, 256])
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(0)
+    results = []
+    print(f"{'batch':>6}{'legacy ms':>12}{'vectorized ms':>15}{'speedup':>9}")
+    for batch_size in args.batch_sizes:
+        outputs = torch.randn(batch_size, len(class_names), generator=generator)
+        labels = torch.randint(len(class_names), (batch_size,), generator=generator)
+        feature_tensor = torch.rand(batch_size, len(feature_names), generator=generator) < 0.5
+        feature_dicts = [{name: bool(flag) for name, flag in zip(feature_names, row)} for row in feature_tensor]
+
+        expected = reference_custom_loss(outputs, labels, feature_dicts)
+        actual = custom_loss(outputs, labels, feature_tensor)
+        if abs(float(expected) - float(actual)) > 1e-4:
+            raise SystemExit(f"Loss mismatch at batch {batch_size}: reference {float(expected)}, "
+                             f"vectorized {float(actual)}")
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            legacy = time_per_step(legacy_custom_loss, (outputs, labels, feature_dicts), args.repeats)
+        vectorized = time_per_step(custom_loss, (outputs, labels, feature_tensor), args.repeats)
+
+        results.append({'batch_size': batch_size, 'legacy_ms': legacy * 1000, 'vectorized_ms': vectorized * 1000,
+                        'speedup': legacy / vectorized})
+        print(f"{batch_size:>6}{legacy * 1000:>12.3f}{vectorized * 1000:>15.3f}{legacy / vectorized:>8.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
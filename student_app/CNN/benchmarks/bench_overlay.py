@@ -0,0 +1,91 @@
+"""Per-request cost of writing the Grad-CAM overlay.
+
+Compares the old matplotlib rendering (16x12 inch figure plus a legend
+figure per request) with the NumPy/PIL compositing in overlay.py, reporting
+mean time per request and RSS growth over the run:
+
+    python benchmarks/bench_overlay.py --requests 1000
+    python benchmarks/bench_overlay.py --requests 100 --no-close   # figures leaked like before
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from common import current_rss_mb
+
+from overlay import write_overlay
+
+
+def matplotlib_overlay(image, activation_map, graph_path, heatmap_path, close=True):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from torchcam.utils import overlay_mask
+
+    activation_map = (activation_map - activation_map.min()) / (activation_map.max() - activation_map.min())
+    activation_map = np.where(activation_map > 0.5, activation_map, 0)
+    result = overlay_mask(image, Image.fromarray(np.uint8(activation_map * 255), mode='L'), alpha=0.7)
+
+    plt.figure(figsize=(16, 12))
+    plt.imshow(result)
+    plt.axis('off')
+    plt.savefig(graph_path, bbox_inches='tight')
+
+    plt.figure(figsize=(6, 1))
+    plt.imshow(np.linspace(0, 1, 256).reshape(1, 256), cmap='jet', aspect='auto')
+    plt.gca().set_yticks([])
+    plt.gca().set_xticks([0, 128, 255])
+    plt.gca().set_xticklabels(['Low', 'Medium', 'High'])
+    plt.title("Heatmap Legend", fontsize=8)
+    plt.savefig(heatmap_path)
+    if close:
+        plt.close('all')
+
+
+def run(method, image, activation_map, root, requests, close):
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    for i in range(requests):
+        graph_path = os.path.join(root, f'{method}_{i % 10}_graph.png')
+        if method == 'matplotlib':
+            heatmap_path = os.path.join(root, f'{method}_{i % 10}_heatmap.png')
+            matplotlib_overlay(image, activation_map, graph_path, heatmap_path, close=close)
+        else:
+            write_overlay(image, activation_map, graph_path, alpha=0.7, threshold=0.5)
+    elapsed = time.perf_counter() - start
+    return {
+        'method': method,
+        'requests': requests,
+        'ms_per_request': round(elapsed / requests * 1000, 2),
+        'rss_growth_mb': round(current_rss_mb() - rss_before, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Overlay rendering benchmark')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--methods', nargs='+', default=['array', 'matplotlib'], choices=['array', 'matplotlib'])
+    parser.add_argument('--no-close', action='store_true', help='Do not close matplotlib figures, as the old code did')
+    parser.add_argument('--output', default=None, help='Optional JSON file for the results')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, size=(850, 1100, 3), dtype=np.uint8))
+    activation_map = rng.random((7, 7)).astype(np.float32)
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        for method in args.methods:
+            result = run(method, image, activation_map, root, args.requests, close=not args.no_close)
+            results.append(result)
+            print(f"{method:<11} {result['ms_per_request']:>8.2f} ms/request  "
+                  f"RSS growth {result['rss_growth_mb']:>7.1f} MB over {args.requests} requests")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
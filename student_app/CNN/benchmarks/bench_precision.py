@@ -0,0 +1,117 @@
+"""Training throughput and accuracy: fp32 vs bf16 autocast and gradient accumulation.
+
+Every configuration trains modelRN.train_model from the same initial weights
+on the same train/val split (fixed seed) and reports the mean training
+images/sec, step time and the best validation accuracy. A configuration is
+'precision:accumulation_steps', e.g. bf16:4 is bfloat16 autocast with an
+effective batch of 4 x --batch-size.
+
+    python benchmarks/bench_precision.py --data-dir callsifi_images --epochs 3
+    python benchmarks/bench_precision.py --configs fp32:1 bf16:1 bf16:4 fp32:4
+
+Images get the eval transform (no random augmentation) so every configuration
+sees identical inputs. Without --data-dir, random images in 11 class folders
+are generated; that measures throughput only, the accuracies are meaningless.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+
+import torch
+import torch.optim as optim
+from torch.utils.data import random_split
+from torchvision.datasets import ImageFolder
+
+from common import make_images
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import modelRN
+from data_loading import loader_options, make_loader
+from inference import build_model
+from preprocessing import load_image
+from telemetry import MetricsWriter, configure_logging
+
+
+def synthetic_image_folder(root, images_per_class, num_classes=11):
+    paths = make_images(root, images_per_class * num_classes, size=(800, 600))
+    for i, path in enumerate(paths):
+        class_dir = os.path.join(root, 'images', f'class_{i % num_classes:02d}')
+        os.makedirs(class_dir, exist_ok=True)
+        shutil.move(path, class_dir)
+    return os.path.join(root, 'images')
+
+
+def run(config, dataset, initial_state, epochs, batch_size, workers):
+    precision, accumulation_steps = config.split(':')
+    generator = torch.Generator().manual_seed(0)
+    train_size = int(0.8 * len(dataset))
+    train_dataset, val_dataset = random_split(dataset, [train_size, len(dataset) - train_size], generator=generator)
+    options = loader_options(num_workers=workers)
+    torch.manual_seed(0)
+    train_loader = make_loader(train_dataset, batch_size=batch_size, shuffle=True, options=options)
+    val_loader = make_loader(val_dataset, batch_size=batch_size, shuffle=False, options=options)
+
+    model = build_model()
+    model.load_state_dict(initial_state)
+    model = model.to(modelRN.device)
+    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    metrics = MetricsWriter()
+    modelRN.train_model(model, optimizer, num_epochs=epochs, train_loader=train_loader, val_loader=val_loader,
+                        metrics=metrics, precision=precision, accumulation_steps=int(accumulation_steps))
+
+    train = [record for record in metrics.records if record['phase'] == 'train']
+    val = [record for record in metrics.records if record['phase'] == 'val']
+    # The first epoch includes one-time warm-up (allocator, oneDNN kernels), so skip it when there are more
+    timed = train[1:] or train
+    return {
+        'config': config,
+        'precision': precision,
+        'accumulation_steps': int(accumulation_steps),
+        'effective_batch': batch_size * int(accumulation_steps),
+        'train_images_per_sec': sum(r['images_per_sec'] for r in timed) / len(timed),
+        'step_time_ms': sum(r['step_time_ms'] for r in timed) / len(timed),
+        'best_val_accuracy': max(r['accuracy'] for r in val),
+        'final_train_loss': train[-1]['loss'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare fp32, bf16 autocast and gradient accumulation training')
+    parser.add_argument('--data-dir', default=None, help='ImageFolder directory (default: generated images)')
+    parser.add_argument('--images-per-class', type=int, default=8, help='Size of the generated dataset')
+    parser.add_argument('--configs', nargs='+', default=['fp32:1', 'bf16:1', 'bf16:4'])
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help='Optional JSON file for the results')
+    args = parser.parse_args()
+
+    configure_logging('warning')
+    torch.manual_seed(0)
+    initial_state = {name: tensor.clone() for name, tensor in build_model().state_dict().items()}
+    with tempfile.TemporaryDirectory() as root:
+        data_dir = os.path.abspath(args.data_dir) if args.data_dir else synthetic_image_folder(root, args.images_per_class)
+        dataset = ImageFolder(root=data_dir, transform=modelRN.data_transforms['val'], loader=load_image)
+        # train_model writes its loss plot to ./GRAPH; keep it out of the working tree
+        previous_dir = os.getcwd()
+        os.chdir(root)
+        try:
+            results = [run(config, dataset, initial_state, args.epochs, args.batch_size, args.workers)
+                       for config in args.configs]
+        finally:
+            os.chdir(previous_dir)
+
+    baseline = results[0]
+    print(f"{'config':<10}{'eff. batch':>11}{'img/s':>9}{'speedup':>9}{'step ms':>9}{'best val acc':>14}")
+    for result in results:
+        result['speedup_vs_first'] = result['train_images_per_sec'] / baseline['train_images_per_sec']
+        print(f"{result['config']:<10}{result['effective_batch']:>11}{result['train_images_per_sec']:>9.1f}"
+              f"{result['speedup_vs_first']:>8.2f}x{result['step_time_ms']:>9.1f}{result['best_val_accuracy']:>14.4f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,67 @@
+"""Decode + transform cost per image for typical scan sizes.
+
+legacy: full PIL decode, then Resize/ToTensor/Normalize per image and a stack
+draft:  preprocessing.load_image (JPEG draft decode) and images_to_tensor
+
+    python benchmarks/bench_preprocess.py --sizes 1100x850 2200x1700 3300x2550
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from common import make_images
+
+from preprocessing import images_to_tensor, load_image
+
+legacy_transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+])
+
+
+def legacy(paths):
+    return torch.stack([legacy_transform(Image.open(path).convert('RGB')) for path in paths])
+
+
+def draft(paths):
+    return images_to_tensor([load_image(path) for path in paths])
+
+
+def time_per_image(function, paths, repeats):
+    function(paths)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(paths)
+    return (time.perf_counter() - start) / (repeats * len(paths)) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Preprocessing benchmark')
+    parser.add_argument('--sizes', nargs='+', default=['1100x850', '2200x1700', '3300x2550'])
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default=None, help='Optional JSON file for the results')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        width, height = map(int, size.split('x'))
+        with tempfile.TemporaryDirectory() as root:
+            paths = make_images(root, args.batch_size, size=(width, height))
+            legacy_ms = time_per_image(legacy, paths, args.repeats)
+            draft_ms = time_per_image(draft, paths, args.repeats)
+            drift = float((legacy(paths[:1]) - draft(paths[:1])).abs().mean())
+        results.append({'size': size, 'legacy_ms': round(legacy_ms, 2), 'draft_ms': round(draft_ms, 2),
+                        'mean_abs_input_diff': round(drift, 4)})
+        print(f"{size:>10}: legacy {legacy_ms:7.2f} ms/image  draft {draft_ms:7.2f} ms/image  "
+              f"({legacy_ms / draft_ms:.1f}x), mean input difference {drift:.4f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,86 @@
+"""Cold-start cost of loading the classifier.
+
+Each sample runs in a fresh interpreter, timing imports plus model load:
+
+- legacy: resnet18(weights=ResNet18_Weights.DEFAULT), then torch.load and
+  load_state_dict of the trained weights over it (the old load_model)
+- mmap: inference.load_model, architecture on the meta device and the saved
+  state_dict memory-mapped in with assign=True
+
+    python benchmarks/bench_startup.py --repeats 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import CNN_DIR
+
+LEGACY = '''
+import time; start = time.perf_counter()
+import torch, torch.nn as nn
+from torchvision import models
+from torchvision.models import ResNet18_Weights
+import_done = time.perf_counter()
+model = models.resnet18(weights=ResNet18_Weights.DEFAULT)
+model.fc = nn.Sequential(nn.Dropout(0.5), nn.Linear(model.fc.in_features, 11))
+model.load_state_dict(torch.load({weights!r}, map_location='cpu', weights_only=True))
+model.eval()
+print(import_done - start, time.perf_counter() - import_done)
+'''
+
+MMAP = '''
+import time; start = time.perf_counter()
+import contextlib, io, sys
+sys.path.insert(0, {cnn_dir!r})
+with contextlib.redirect_stdout(io.StringIO()):
+    import inference
+import_done = time.perf_counter()
+inference.model_save_path = {weights!r}
+with contextlib.redirect_stdout(io.StringIO()):
+    model = inference.load_model()
+model.eval()
+print(import_done - start, time.perf_counter() - import_done)
+'''
+
+
+def sample(code):
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    import_time, load_time = map(float, output.split()[-2:])
+    return import_time, load_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Model cold-start benchmark')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--weights', default=None, help='Trained weights to load (default: a freshly built model)')
+    parser.add_argument('--output', default=None, help='Optional JSON file for the results')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        weights = args.weights
+        if weights is None:
+            import torch
+            sys.path.insert(0, CNN_DIR)
+            import inference
+            weights = os.path.join(root, 'ecg_classifier_model.pth')
+            torch.save(inference.build_model().state_dict(), weights)
+
+        results = []
+        for name, template in (('legacy', LEGACY), ('mmap', MMAP)):
+            code = template.format(weights=os.path.abspath(weights), cnn_dir=CNN_DIR)
+            samples = [sample(code) for _ in range(args.repeats)]
+            result = {
+                'path': name,
+                'import_s': round(statistics.median(s[0] for s in samples), 3),
+                'load_s': round(statistics.median(s[1] for s in samples), 3),
+            }
+            results.append(result)
+            print(f"{name:<7} imports {result['import_s']:.3f}s  model load {result['load_s']:.3f}s (median of {args.repeats})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
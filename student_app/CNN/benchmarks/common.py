@@ -0,0 +1,36 @@
+"""Helpers shared by the benchmark scripts."""
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+# Benchmarks import the CNN modules as siblings, the same way the scripts there do
+CNN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if CNN_DIR not in sys.path:
+    sys.path.insert(0, CNN_DIR)
+
+
+# Write synthetic scans into <root>/uploads, with <root>/graphs next to it for the overlays
+def make_images(root, count, size=(1100, 850), seed=0):
+    uploads = os.path.join(root, 'uploads')
+    os.makedirs(uploads, exist_ok=True)
+    os.makedirs(os.path.join(root, 'graphs'), exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+        path = os.path.join(uploads, f'bench_{i}.jpg')
+        Image.fromarray(pixels).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+# Resident set size of this process in MB (Linux /proc, psutil elsewhere)
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
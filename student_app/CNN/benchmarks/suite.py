@@ -0,0 +1,369 @@
+"""Reproducible benchmark suite of the inference and training hot paths, with a regression check.
+
+`run` times every case offline on synthetic data (random scans, random weights,
+a generated answers database) and writes one JSON file per commit, by default
+benchmarks/results/<commit>.json:
+
+    cold_start                  fresh interpreter: import inference + load_model (memory-mapped weights)
+    classify_warm               classify_image of one scan with a loaded model, cam=None
+    classify_gradcam            classify_image with the single-pass Grad-CAM overlay
+    classify_smoothgradcampp    classify_image with the default SmoothGrad-CAM++ overlay
+    overlay                     write_overlay of a 7x7 map on a full-resolution scan
+    preprocess                  load_image + images_to_tensor of one scan
+    train_step_bs<N>            one optimizer step of train_model (features, forward, loss, backward)
+    custom_loss_bs<N>           custom_loss on a batch of logits and feature flags
+    rate_images_train           analyzer rate_images.train_or_update_model on a generated database
+                                (skipped when scikit-learn is not installed)
+
+Every timed case reports median_ms, p90_ms, min_ms and its sample count.
+`compare` prints the median change of every case two result files share and
+exits with status 1 when any case got slower by more than --threshold percent:
+
+    python benchmarks/suite.py run --repeats 10
+    python benchmarks/suite.py run --only classify_warm preprocess --output /tmp/new.json
+    python benchmarks/suite.py compare benchmarks/results/1a2b3c4.json benchmarks/results/5d6e7f8.json --threshold 10
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from common import CNN_DIR, make_images
+
+from bench_startup import MMAP, sample
+
+ANALYZER_DIR = os.path.join(os.path.dirname(CNN_DIR), 'analyzer')
+RESULTS_DIR = os.path.join(CNN_DIR, 'benchmarks', 'results')
+DEFAULT_BATCH_SIZES = (4, 8, 16)
+
+
+def summarize(samples_s, **extra):
+    samples_ms = sorted(sample_s * 1000 for sample_s in samples_s)
+    result = {
+        'median_ms': round(statistics.median(samples_ms), 3),
+        'p90_ms': round(float(np.percentile(samples_ms, 90)), 3),
+        'min_ms': round(samples_ms[0], 3),
+        'samples': len(samples_ms),
+    }
+    result.update(extra)
+    return result
+
+
+def time_calls(function, repeats, warmup=1):
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=CNN_DIR, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=CNN_DIR, check=True,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(dirty)
+
+
+def environment():
+    commit, dirty = git_commit()
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'threads': torch.get_num_threads(),
+    }
+
+
+def bench_cold_start(weights, repeats):
+    code = MMAP.format(weights=weights, cnn_dir=CNN_DIR)
+    samples = [sample(code) for _ in range(repeats)]
+    return summarize([import_s + load_s for import_s, load_s in samples],
+                     import_ms=round(statistics.median(s[0] for s in samples) * 1000, 3),
+                     load_ms=round(statistics.median(s[1] for s in samples) * 1000, 3))
+
+
+def bench_classify(model, image_path, cam, repeats):
+    from inference import classify_image
+    return summarize(time_calls(lambda: classify_image(image_path, model=model, cam=cam), repeats))
+
+
+def bench_overlay(root, repeats):
+    from overlay import write_overlay
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, size=(850, 1100, 3), dtype=np.uint8))
+    activation_map = rng.random((7, 7)).astype(np.float32)
+    graph_path = os.path.join(root, 'graphs', 'overlay_graph.png')
+    return summarize(time_calls(lambda: write_overlay(image, activation_map, graph_path, alpha=0.7, threshold=0.5),
+                                repeats))
+
+
+def bench_preprocess(image_path, repeats):
+    from preprocessing import images_to_tensor, load_image
+    return summarize(time_calls(lambda: images_to_tensor([load_image(image_path)]), repeats))
+
+
+def bench_train_step(root, batch_size, repeats):
+    """step_time_ms of train_model's training phase, one single-batch epoch per sample after one warm-up epoch."""
+    from torch.utils.data import DataLoader, TensorDataset
+
+    import modelRN
+    from inference import build_model, class_names
+    from telemetry import MetricsWriter
+
+    generator = torch.Generator().manual_seed(batch_size)
+    train_set = TensorDataset(torch.randn(batch_size, 3, 224, 224, generator=generator),
+                              torch.randint(len(class_names), (batch_size,), generator=generator))
+    val_set = TensorDataset(torch.randn(1, 3, 224, 224, generator=generator), torch.zeros(1, dtype=torch.long))
+    model = build_model().to(modelRN.device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    metrics = MetricsWriter()
+    # train_model saves its loss plot under ./GRAPH
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        modelRN.train_model(model, optimizer, num_epochs=repeats + 1,
+                            train_loader=DataLoader(train_set, batch_size=batch_size),
+                            val_loader=DataLoader(val_set, batch_size=1), metrics=metrics)
+    finally:
+        os.chdir(cwd)
+        modelRN.plt.close('all')
+    step_times = [record['step_time_ms'] / 1000 for record in metrics.records if record.get('phase') == 'train']
+    return summarize(step_times[1:], batch_size=batch_size)
+
+
+def bench_custom_loss(batch_size, repeats):
+    from inference import class_names
+    from modelRN import custom_loss, feature_names
+
+    generator = torch.Generator().manual_seed(batch_size)
+    outputs = torch.randn(batch_size, len(class_names), generator=generator)
+    labels = torch.randint(len(class_names), (batch_size,), generator=generator)
+    features = torch.rand(batch_size, len(feature_names), generator=generator) < 0.5
+    # Microseconds per call: time blocks of calls so timer overhead does not dominate
+    calls = 100
+    samples = time_calls(lambda: [custom_loss(outputs, labels, features) for _ in range(calls)], repeats)
+    return summarize([sample_s / calls for sample_s in samples], batch_size=batch_size)
+
+
+def make_answers_db(path, users=200, answers=5000, images=500, seed=0):
+    """A database with the users/answers/imageClassification columns rate_images reads, filled at random."""
+    rng = np.random.default_rng(seed)
+    classification_sets = ['STEMI', 'HIGH RISK', 'LOW RISK']
+    sub_sets = ['Anterior', 'Inferior', 'Lateral', 'Septal', 'Avrste', 'DeWinters', 'Wellens', 'LOW RISK']
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY, age INTEGER, gender TEXT, avgDegree REAL,
+                            academicInstitution TEXT, totalEntries INTEGER, totalExams INTEGER, totalTrainTime INTEGER);
+        CREATE TABLE answers (id INTEGER PRIMARY KEY, userId INTEGER, photoName TEXT, classificationSetSrc TEXT,
+                              classificationSubSetSrc TEXT, classificationSetDes TEXT, classificationSubSetDes TEXT,
+                              answerSubmitTime INTEGER, helpActivated INTEGER);
+        CREATE TABLE imageClassification (photoName TEXT PRIMARY KEY, classificationSet TEXT,
+                                          classificationSubSet TEXT, rate INTEGER);
+    """)
+    conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+        (i, int(rng.integers(20, 70)), str(rng.choice(['male', 'female'])), float(rng.uniform(50, 100)),
+         f'institution_{rng.integers(10)}', int(rng.integers(1, 500)), int(rng.integers(0, 50)),
+         int(rng.integers(0, 100000)))
+        for i in range(1, users + 1)])
+    conn.executemany("INSERT INTO imageClassification VALUES (?, ?, ?, ?)", [
+        (f'ecg_{i}.jpg', str(rng.choice(classification_sets)), str(rng.choice(sub_sets)),
+         int(rng.integers(1, 11)) if rng.random() < 0.9 else None)
+        for i in range(images)])
+    conn.executemany("INSERT INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+        (i, int(rng.integers(1, users + 1)), f'ecg_{rng.integers(images)}.jpg', str(rng.choice(classification_sets)),
+         str(rng.choice(sub_sets)), str(rng.choice(classification_sets)), str(rng.choice(sub_sets)),
+         int(rng.integers(2, 120)), int(rng.integers(0, 2)))
+        for i in range(answers)])
+    conn.commit()
+    conn.close()
+
+
+def import_rate_images(root):
+    """analyzer/rate_images.py with its database, model, graphs and logs redirected into `root`."""
+    if ANALYZER_DIR not in sys.path:
+        sys.path.append(ANALYZER_DIR)
+    import config
+    # rate_images reads the log paths and sets up file logging when it is imported
+    config.TRACE_LOG = os.path.join(root, 'trace.log')
+    config.ERROR_LOG = os.path.join(root, 'error.log')
+    import rate_images
+    rate_images.TRACE_LOG, rate_images.ERROR_LOG = config.TRACE_LOG, config.ERROR_LOG
+    rate_images.DB_PATH = os.path.join(root, 'database.db')
+    rate_images.MODEL_PATH = os.path.join(root, 'rate_model.pkl')
+    rate_images.BASE_DIR = root
+    return rate_images
+
+
+def bench_rate_images(root, repeats, answers):
+    if importlib.util.find_spec('sklearn') is None:
+        return {'skipped': 'scikit-learn is not installed'}
+    root_logger = logging.getLogger()
+    root_handlers, root_level = list(root_logger.handlers), root_logger.level
+    rate_images = import_rate_images(root)
+    make_answers_db(rate_images.DB_PATH, answers=answers)
+    try:
+        # The warm-up run trains from scratch; the timed ones load and update the saved model, as the server does
+        samples = time_calls(rate_images.train_or_update_model, repeats)
+    finally:
+        # Close the trace log basicConfig opened in `root`, so the temporary directory can be removed
+        for handler in root_logger.handlers[len(root_handlers):]:
+            root_logger.removeHandler(handler)
+            handler.close()
+        root_logger.setLevel(root_level)
+    return summarize(samples, answers=answers)
+
+
+def case_names(batch_sizes):
+    return (['cold_start', 'classify_warm', 'classify_gradcam', 'classify_smoothgradcampp', 'overlay', 'preprocess']
+            + [f'train_step_bs{batch_size}' for batch_size in batch_sizes]
+            + [f'custom_loss_bs{batch_size}' for batch_size in batch_sizes]
+            + ['rate_images_train'])
+
+
+def run_suite(only=None, repeats=10, cold_repeats=3, batch_sizes=DEFAULT_BATCH_SIZES, answers=5000, seed=0):
+    torch.manual_seed(seed)
+    selected = case_names(batch_sizes) if not only else only
+    unknown = sorted(set(selected) - set(case_names(batch_sizes)))
+    if unknown:
+        raise ValueError(f"Unknown cases {unknown}, expected some of {case_names(batch_sizes)}")
+
+    # modelRN and load_model announce themselves on stdout; keep the suite's output to its own lines
+    with contextlib.redirect_stdout(io.StringIO()):
+        import modelRN  # noqa: F401
+        from inference import build_model, device
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        image_path = make_images(root, 1)[0]
+        weights = os.path.join(root, 'ecg_classifier_model.pth')
+        model = build_model()
+        torch.save(model.state_dict(), weights)
+        model = model.to(device).eval()
+
+        cases = {
+            'cold_start': lambda: bench_cold_start(weights, cold_repeats),
+            'classify_warm': lambda: bench_classify(model, image_path, None, repeats),
+            'classify_gradcam': lambda: bench_classify(model, image_path, 'gradcam', repeats),
+            'classify_smoothgradcampp': lambda: bench_classify(model, image_path, 'smoothgradcampp', repeats),
+            'overlay': lambda: bench_overlay(root, repeats),
+            'preprocess': lambda: bench_preprocess(image_path, repeats),
+            'rate_images_train': lambda: bench_rate_images(root, repeats, answers),
+        }
+        for batch_size in batch_sizes:
+            cases[f'train_step_bs{batch_size}'] = lambda batch_size=batch_size: bench_train_step(root, batch_size,
+                                                                                                repeats)
+            cases[f'custom_loss_bs{batch_size}'] = lambda batch_size=batch_size: bench_custom_loss(batch_size,
+                                                                                                  repeats)
+
+        for name in selected:
+            results[name] = cases[name]()
+            if 'skipped' in results[name]:
+                print(f"{name:<26} skipped: {results[name]['skipped']}")
+            else:
+                print(f"{name:<26} {results[name]['median_ms']:>10.3f} ms median "
+                      f"({results[name]['p90_ms']:.3f} p90, n={results[name]['samples']})")
+    return results
+
+
+def compare(baseline, current, threshold):
+    """Lines of the comparison table and the names of the cases slower by more than `threshold` percent."""
+    lines = [f"{'case':<26}{'baseline ms':>13}{'current ms':>13}{'change':>9}"]
+    regressions = []
+    for name in sorted(set(baseline['results']) | set(current['results'])):
+        old = baseline['results'].get(name, {}).get('median_ms')
+        new = current['results'].get(name, {}).get('median_ms')
+        if old is None or new is None:
+            lines.append(f"{name:<26}{'-' if old is None else f'{old:.3f}':>13}{'-' if new is None else f'{new:.3f}':>13}"
+                         f"{'n/a':>9}")
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        lines.append(f"{name:<26}{old:>13.3f}{new:>13.3f}{change:>+8.1f}%{flag}")
+    return lines, regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark suite of the inference and training hot paths')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the suite and write the results as JSON')
+    run_parser.add_argument('--only', nargs='+', default=None, help='Run only these cases')
+    run_parser.add_argument('--repeats', type=int, default=10, help='Timed samples per case, after a warm-up')
+    run_parser.add_argument('--cold-repeats', type=int, default=3, help='Fresh interpreters for cold_start')
+    run_parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(DEFAULT_BATCH_SIZES))
+    run_parser.add_argument('--answers', type=int, default=5000, help='Answers in the generated rate_images database')
+    run_parser.add_argument('--threads', type=int, default=None, help='torch.set_num_threads for the in-process cases')
+    run_parser.add_argument('--output', default=None,
+                            help='Results file (default: benchmarks/results/<commit>.json)')
+
+    compare_parser = commands.add_parser('compare', help='Compare two result files; exit 1 on a regression')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help='Percent slowdown of a median that counts as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        report = {'environment': environment(),
+                  'config': {'repeats': args.repeats, 'cold_repeats': args.cold_repeats,
+                             'batch_sizes': args.batch_sizes, 'answers': args.answers}}
+        report['results'] = run_suite(args.only, args.repeats, args.cold_repeats, args.batch_sizes, args.answers)
+        output = args.output
+        if output is None:
+            commit = report['environment']['commit'] or 'unversioned'
+            dirty = '-dirty' if report['environment']['dirty'] else ''
+            output = os.path.join(RESULTS_DIR, f'{commit}{dirty}.json')
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Results written to {output}")
+    else:
+        baseline, current = load_results(args.baseline), load_results(args.current)
+        for key in ('torch', 'processor', 'cpu_count', 'threads'):
+            if baseline['environment'].get(key) != current['environment'].get(key):
+                print(f"Note: {key} differs ({baseline['environment'].get(key)} vs {current['environment'].get(key)}), "
+                      f"timings may not be comparable")
+        lines, regressions = compare(baseline, current, args.threshold)
+        print('\n'.join(lines))
+        if regressions:
+            print(f"{len(regressions)} case(s) slower by more than {args.threshold:g}%: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"No case slower by more than {args.threshold:g}%")
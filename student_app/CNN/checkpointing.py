@@ -0,0 +1,137 @@
+"""Per-epoch training checkpoints written by a background thread.
+
+CheckpointWriter.save_epoch snapshots everything needed to continue a run:
+model and optimizer state, stage ('unlabeled' pretraining or 'labeled'
+training), epoch, RNG states, the train/val/test split and whatever the
+training loop adds (best accuracy, loss histories). The snapshot is a CPU copy
+taken on the training thread, which is quick. The writer thread then does the
+slow part (torch.save to a temporary file, rename), so an epoch never waits on
+disk unless the writer falls two checkpoints behind. Only the newest
+`keep_last` epoch checkpoints are kept; save_best writes best_model.pth
+(weights only, loadable like ecg_classifier_model.pth) the same way.
+
+    python modelRN.py --checkpoint-dir checkpoints --keep-checkpoints 3
+    python modelRN.py --resume                 # newest checkpoint in --checkpoint-dir
+    python modelRN.py --resume checkpoints/checkpoint_labeled_007.pth
+"""
+import os
+import queue
+import random
+import re
+import threading
+
+import torch
+
+from telemetry import logger
+
+STAGES = ('unlabeled', 'labeled')
+BEST_MODEL_FILE = 'best_model.pth'
+_CHECKPOINT_PATTERN = re.compile(r'^checkpoint_(unlabeled|labeled)_(\d+)\.pth$')
+
+
+def snapshot(value):
+    """Deep copy of a (nested) state dict with every tensor detached and copied to the CPU."""
+    if torch.is_tensor(value):
+        return value.detach().to('cpu', copy=True)
+    if isinstance(value, dict):
+        return {key: snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(snapshot(item) for item in value)
+    return value
+
+
+def rng_state():
+    state = {'torch': torch.get_rng_state(), 'python': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    random.setstate(state['python'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def _order(file_name):
+    stage, epoch = _CHECKPOINT_PATTERN.match(file_name).groups()
+    return STAGES.index(stage), int(epoch)
+
+
+def list_checkpoints(directory):
+    """Epoch checkpoints in `directory`, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory) if _CHECKPOINT_PATTERN.match(name)), key=_order)
+    return [os.path.join(directory, name) for name in names]
+
+
+def latest_checkpoint(directory):
+    checkpoints = list_checkpoints(directory)
+    return checkpoints[-1] if checkpoints else None
+
+
+def load_checkpoint(path):
+    # Only tensors and plain Python containers are stored, so the safe loader suffices
+    return torch.load(path, map_location='cpu', weights_only=True)
+
+
+class CheckpointWriter:
+    def __init__(self, directory='checkpoints', keep_last=3):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+        self.queue = queue.Queue(maxsize=2)
+        self.thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            file_name, state = item
+            try:
+                path = os.path.join(self.directory, file_name)
+                torch.save(state, path + '.tmp')
+                os.replace(path + '.tmp', path)
+                if _CHECKPOINT_PATTERN.match(file_name):
+                    self._prune()
+                logger.debug(f"Checkpoint written to {path}")
+            except Exception as error:  # Reported to the training thread on the next call
+                self.error = error
+
+    def _prune(self):
+        for path in list_checkpoints(self.directory)[:-self.keep_last or None]:
+            os.remove(path)
+
+    def _submit(self, file_name, state):
+        if self.error is not None:
+            raise RuntimeError(f"Writing a checkpoint to {self.directory} failed") from self.error
+        self.queue.put((file_name, state))
+
+    def save_epoch(self, stage, epoch, model, optimizer, split=None, **extra):
+        """Queue the checkpoint of a finished epoch (1-based) of `stage`."""
+        state = snapshot({
+            'stage': stage,
+            'epoch': epoch,
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'split': split,
+            **extra,
+        })
+        state['rng'] = rng_state()
+        self._submit(f'checkpoint_{stage}_{epoch:03d}.pth', state)
+
+    def save_best(self, state_dict):
+        """Queue best_model.pth; pass a snapshot, or a state dict nothing will modify."""
+        self._submit(BEST_MODEL_FILE, state_dict)
+
+    def close(self):
+        """Wait for the queued checkpoints to be written."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"Writing a checkpoint to {self.directory} failed") from self.error
@@ -1,12 +1,10 @@
-from torchvision.models import resnet18, ResNet18_Weights
+from torchvision.models import resnet18
 import torch
 import torch.nn as nn
-from torchvision import transforms
-from PIL import Image
 import json
-import matplotlib.pyplot as plt
 from torchcam.methods import SmoothGradCAMpp
-from torchcam.utils import overlay_mask
+from overlay import write_overlay
+from preprocessing import images_to_tensor, load_image
 import numpy as np
 import os
 import sys
@@ -18,15 +16,17 @@ model_path = os.path.join(current_dir,'..','CNN', 'ecg_classifier_model.pth')
 class_names = ['Avrste', 'DeWinters', 'Hyperacute', 'LossOfBalance', 'TInversion', 'Wellens', 'LOW RISK', 'Anterior', 'Inferior', 'Lateral', 'Septal']
 
 def load_model():
-    # Define the model structure
-    model = resnet18(weights=ResNet18_Weights.DEFAULT)
-    num_ftrs = model.fc.in_features
-    model.fc = nn.Sequential(
-        nn.Dropout(0.5),
-        nn.Linear(num_ftrs, len(class_names))
-    )
-    # Load state dict
-    model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu'), weights_only=True))
+    # Build the architecture on the meta device; every weight comes from the saved state
+    with torch.device('meta'):
+        model = resnet18(weights=None)
+        num_ftrs = model.fc.in_features
+        model.fc = nn.Sequential(
+            nn.Dropout(0.5),
+            nn.Linear(num_ftrs, len(class_names))
+        )
+    # Load state dict, memory-mapped instead of read into a copy
+    model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu'), weights_only=True, mmap=True),
+                          assign=True)
     model.eval()
     return model
 
@@ -34,14 +34,8 @@ def classify_image(image_path):
     # Load the model
     model = load_model()
 
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-    ])
-
-    # Open the image and apply transformations
-    image = Image.open(image_path).convert('RGB')
-    input_tensor = transform(image).unsqueeze(0)
+    # Open the image and apply the same preprocessing as training, normalization included
+    input_tensor = images_to_tensor([load_image(image_path)])
 
     # Initialize Grad-CAM for explanation
     cam_extractor = SmoothGradCAMpp(model, target_layer='layer4')
@@ -61,31 +55,9 @@ def classify_image(image_path):
     if len(activation_map.shape) == 3:
         activation_map = np.mean(activation_map, axis=0)
 
-    # Normalize the heatmap
-    activation_map = (activation_map - activation_map.min()) / (activation_map.max() - activation_map.min())
-
-    # Overlay heatmap on the original image
-    result = overlay_mask(image, Image.fromarray(np.uint8(activation_map * 255), mode='L'), alpha=0.5)
-
-    # Save the result as a graph
+    # Overlay the heatmap on the original image at its own resolution; the legend is public/heatmap.png
     graph_path = image_path.replace('uploads', 'graphs').replace('.jpg', '_graph.png')
-    plt.figure(figsize=(10, 8))  # שינוי גודל התמונה
-
-    plt.subplot(1, 2, 1)  # הוספת subplot עבור התמונה עם מפת החום
-    plt.imshow(result)
-    plt.title(f'{predicted_class} ({confidence_percent:.2f}%)')
-    plt.axis('off')
-
-    # הוספת מקרא ויזואלי בצד
-    plt.subplot(1, 2, 2)  # הוספת subplot עבור המקרא
-    plt.imshow(np.linspace(0, 1, 100).reshape(1, 100), cmap='jet', aspect='auto')
-    plt.gca().set_yticks([])
-    plt.gca().set_xticks([0, 50, 100])
-    plt.gca().set_xticklabels(['Low', 'Medium', 'High'])
-    plt.title("Heatmap Legend")
-
-    plt.tight_layout()
-    plt.savefig(graph_path)
+    write_overlay(load_image(image_path, draft_size=None), activation_map, graph_path, alpha=0.5)
 
     # Return the classification and graph URL
     return {
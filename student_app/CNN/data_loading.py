@@ -0,0 +1,196 @@
+"""DataLoader setup, batch-level augmentation and data-wait instrumentation for training.
+
+loader_options builds the DataLoader keyword arguments: worker processes
+(so decode and augmentation leave the training thread), persistent workers,
+prefetch factor and pinned memory when training on a GPU.
+
+With batch augmentation the datasets only decode and resize, returning uint8
+tensors (build_uint8_transform); BatchAugment then runs the flips, color
+jitter and affine warp for the whole batch at once on the training device,
+and normalize_batch prepares evaluation batches the same way.
+
+LoaderTimer wraps a loader and splits each epoch into time spent waiting on
+the next batch and time spent computing; if the wait share is high, add
+workers (or use the dataset cache), if it is near zero, workers are idle.
+"""
+import math
+import os
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+from preprocessing import MEAN, STD
+from telemetry import logger
+
+
+def default_num_workers():
+    # Leave one core for the training loop itself
+    return min(4, max(0, (os.cpu_count() or 1) - 1))
+
+
+def loader_options(num_workers=None, prefetch_factor=2, pin_memory=None, persistent_workers=True):
+    """Keyword arguments for DataLoader; worker-only options are dropped when num_workers is 0."""
+    if num_workers is None:
+        num_workers = default_num_workers()
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    options = {'num_workers': num_workers, 'pin_memory': pin_memory}
+    if num_workers > 0:
+        options['persistent_workers'] = persistent_workers
+        options['prefetch_factor'] = prefetch_factor
+    return options
+
+
+def make_loader(dataset, batch_size, shuffle, options=None):
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **(options or loader_options()))
+
+
+def add_loader_arguments(parser):
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f'DataLoader worker processes (default {default_num_workers()} on this machine)')
+    parser.add_argument('--prefetch-factor', type=int, default=2, help='Batches prefetched per worker')
+    parser.add_argument('--no-pin-memory', action='store_true', help='Do not pin host memory for GPU copies')
+    parser.add_argument('--batch-augment', action='store_true',
+                        help='Augment whole batches on the training device instead of per PIL image')
+
+
+def loader_options_from_args(args):
+    return loader_options(num_workers=args.workers, prefetch_factor=args.prefetch_factor,
+                          pin_memory=False if args.no_pin_memory else None)
+
+
+def normalize_batch(batch):
+    """uint8 (or [0, 1] float) NCHW batch -> float batch normalized like the eval transform."""
+    if batch.dtype == torch.uint8:
+        batch = batch.float().div_(255)
+    mean = torch.tensor(MEAN, device=batch.device).view(1, 3, 1, 1)
+    std = torch.tensor(STD, device=batch.device).view(1, 3, 1, 1)
+    return (batch - mean) / std
+
+
+def _grayscale(batch):
+    return (0.299 * batch[:, 0:1] + 0.587 * batch[:, 1:2] + 0.114 * batch[:, 2:3])
+
+
+class BatchAugment(nn.Module):
+    """Tensor version of build_train_transform, applied to a whole batch with per-sample randomness.
+
+    Horizontal flip, brightness/contrast/saturation/hue jitter, then rotation,
+    shear and scale in a single affine resample. RandomPerspective has no
+    counterpart here.
+    """
+
+    def __init__(self, degrees=15.0, shear=10.0, scale=(0.8, 1.2), brightness=0.3, contrast=0.3, saturation=0.3,
+                 hue=0.2):
+        super().__init__()
+        self.degrees = degrees
+        self.shear = shear
+        self.scale = scale
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+
+    @staticmethod
+    def _uniform(n, low, high, device):
+        return torch.empty(n, device=device).uniform_(low, high)
+
+    def color_jitter(self, batch):
+        n, device = batch.size(0), batch.device
+        factor = self._uniform(n, 1 - self.brightness, 1 + self.brightness, device).view(n, 1, 1, 1)
+        batch = (batch * factor).clamp_(0, 1)
+        factor = self._uniform(n, 1 - self.contrast, 1 + self.contrast, device).view(n, 1, 1, 1)
+        mean = _grayscale(batch).mean(dim=(1, 2, 3), keepdim=True)
+        batch = ((batch - mean) * factor + mean).clamp_(0, 1)
+        factor = self._uniform(n, 1 - self.saturation, 1 + self.saturation, device).view(n, 1, 1, 1)
+        gray = _grayscale(batch)
+        batch = ((batch - gray) * factor + gray).clamp_(0, 1)
+        if self.hue:
+            # Hue shift as a rotation of the chroma plane in YIQ space
+            angle = self._uniform(n, -self.hue, self.hue, device) * 2 * math.pi
+            rgb_to_yiq = torch.tensor([[0.299, 0.587, 0.114], [0.596, -0.274, -0.322], [0.211, -0.523, 0.312]],
+                                      device=device)
+            yiq_to_rgb = torch.linalg.inv(rgb_to_yiq)
+            cos, sin = angle.cos(), angle.sin()
+            rotation = torch.zeros(n, 3, 3, device=device)
+            rotation[:, 0, 0] = 1
+            rotation[:, 1, 1] = cos
+            rotation[:, 1, 2] = -sin
+            rotation[:, 2, 1] = sin
+            rotation[:, 2, 2] = cos
+            matrix = yiq_to_rgb @ rotation @ rgb_to_yiq
+            batch = torch.einsum('nij,njhw->nihw', matrix, batch).clamp_(0, 1)
+        return batch
+
+    def affine(self, batch):
+        n, device = batch.size(0), batch.device
+        angle = self._uniform(n, -self.degrees, self.degrees, device).deg2rad()
+        shear = self._uniform(n, -self.shear, self.shear, device).deg2rad()
+        scale = self._uniform(n, self.scale[0], self.scale[1], device)
+        cos, sin, tan = angle.cos(), angle.sin(), shear.tan()
+        # Forward map: rotation @ x-shear, scaled
+        forward = torch.stack([
+            torch.stack([cos, cos * tan - sin], dim=1),
+            torch.stack([sin, sin * tan + cos], dim=1),
+        ], dim=1) * scale.view(n, 1, 1)
+        # affine_grid samples output pixels from the input, so it needs the inverse map
+        theta = torch.cat([torch.linalg.inv(forward), torch.zeros(n, 2, 1, device=device)], dim=2)
+        grid = F.affine_grid(theta, list(batch.shape), align_corners=False)
+        return F.grid_sample(batch, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+
+    def forward(self, batch):
+        if batch.dtype == torch.uint8:
+            batch = batch.float().div_(255)
+        flip = torch.rand(batch.size(0), device=batch.device) < 0.5
+        batch = torch.where(flip.view(-1, 1, 1, 1), batch.flip(3), batch)
+        batch = self.color_jitter(batch)
+        batch = self.affine(batch)
+        return normalize_batch(batch)
+
+
+class LoaderTimer:
+    """Iterates a loader and records how long the training loop waited for each batch."""
+
+    def __init__(self, loader, device=None):
+        self.loader = loader
+        self.device = device
+        self.data_wait = 0.0
+        self.batches = 0
+        self.start = None
+        self.end = None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self.data_wait = 0.0
+        self.batches = 0
+        self.start = time.perf_counter()
+        self.end = None
+        iterator = iter(self.loader)
+        while True:
+            before = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            self.data_wait += time.perf_counter() - before
+            self.batches += 1
+            yield batch
+        self.end = time.perf_counter()
+
+    def summary(self):
+        if self.device is not None and self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        total = (self.end or time.perf_counter()) - self.start
+        return {'data_wait_s': self.data_wait, 'compute_s': total - self.data_wait, 'total_s': total,
+                'data_wait_fraction': self.data_wait / total if total else 0.0, 'batches': self.batches}
+
+    def report(self, label):
+        summary = self.summary()
+        logger.info(f"{label} - data wait {summary['data_wait_s']:.2f}s "
+                    f"({summary['data_wait_fraction'] * 100:.1f}%), compute {summary['compute_s']:.2f}s")
+        return summary
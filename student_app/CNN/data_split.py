@@ -0,0 +1,95 @@
+"""Persisted train/val/test split of the labeled images.
+
+The split is stored as {relative image path: 'train' | 'val' | 'test'} in a
+JSON file (data_split.json next to callsifi_images by default), so the
+held-out test images stay held out across training runs, sweeps and
+evaluations. The first run shuffles all images with a fixed seed into
+70/15/15%. Images added later are assigned by a hash of their path in the
+same proportions, so no existing image ever changes sides. Entries of
+removed images are kept, and an image that comes back returns to its old
+split.
+
+    python data_split.py --data-dir callsifi_images      # create/update and print the split sizes
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+
+SPLIT_NAMES = ('train', 'val', 'test')
+SPLIT_FRACTIONS = (0.7, 0.15, 0.15)
+DEFAULT_SPLIT_PATH = 'data_split.json'
+
+
+def relative_paths(dataset, root):
+    """Image paths of an ImageFolder or CachedImageDataset relative to `root`, with '/' separators."""
+    # CachedImageDataset already stores paths relative to its source directory; ImageFolder joins them to root
+    already_relative = hasattr(dataset, 'cache_dir')
+    return [(path if already_relative else os.path.relpath(path, root)).replace(os.sep, '/')
+            for path, _ in dataset.samples]
+
+
+def _hash_bucket(rel_path):
+    fraction = int(hashlib.sha256(rel_path.encode()).hexdigest()[:8], 16) / 0x100000000
+    train_fraction, val_fraction, _ = SPLIT_FRACTIONS
+    if fraction < train_fraction:
+        return 'train'
+    return 'val' if fraction < train_fraction + val_fraction else 'test'
+
+
+def load_assignments(path=DEFAULT_SPLIT_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)['assignments']
+
+
+def update_split(rel_paths, path=DEFAULT_SPLIT_PATH, seed=0):
+    """Assign every path in `rel_paths` to a split, persisting new assignments; returns {path: split name}."""
+    assignments = load_assignments(path)
+    new_paths = [rel_path for rel_path in rel_paths if rel_path not in assignments]
+    if not new_paths:
+        return assignments
+    if not assignments:
+        # First split: exact proportions, like the random_split it replaces
+        shuffled = sorted(new_paths)
+        random.Random(seed).shuffle(shuffled)
+        train_size = int(SPLIT_FRACTIONS[0] * len(shuffled))
+        val_size = int(SPLIT_FRACTIONS[1] * len(shuffled))
+        for i, rel_path in enumerate(shuffled):
+            assignments[rel_path] = 'train' if i < train_size else 'val' if i < train_size + val_size else 'test'
+    else:
+        for rel_path in new_paths:
+            assignments[rel_path] = _hash_bucket(rel_path)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'seed': seed, 'fractions': SPLIT_FRACTIONS, 'assignments': dict(sorted(assignments.items()))},
+                  f, indent=1)
+    os.replace(path + '.tmp', path)
+    return assignments
+
+
+def split_indices(rel_paths, path=DEFAULT_SPLIT_PATH, seed=0):
+    """Dataset indices per split, in the checkpoint format {'size', 'train', 'val', 'test'}."""
+    assignments = update_split(rel_paths, path, seed)
+    split = {'size': len(rel_paths)}
+    for name in SPLIT_NAMES:
+        split[name] = [i for i, rel_path in enumerate(rel_paths) if assignments[rel_path] == name]
+    return split
+
+
+if __name__ == '__main__':
+    from dataset_cache import list_images
+
+    parser = argparse.ArgumentParser(description='Create or update the persisted train/val/test split')
+    parser.add_argument('--data-dir', default='callsifi_images')
+    parser.add_argument('--split-path', default=DEFAULT_SPLIT_PATH)
+    args = parser.parse_args()
+
+    samples, _ = list_images(args.data_dir, labeled=True)
+    split = split_indices([rel_path.replace(os.sep, '/') for rel_path, _ in samples], args.split_path)
+    print(json.dumps({name: len(split[name]) for name in SPLIT_NAMES}))
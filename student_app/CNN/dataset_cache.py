@@ -0,0 +1,178 @@
+"""Pre-decoded, memory-mapped image cache for training.
+
+build_cache decodes every image of a directory once (JPEG draft decode,
+resize to 224x224) and stores the uint8 pixels in .npy shards plus an
+index.json. CachedImageDataset reads samples straight from the memory-mapped
+shards, so an epoch only pays for the random augmentations, never for JPEG
+decoding.
+
+Labeled directories use the ImageFolder layout (one sub-folder per class,
+classes indexed in sorted order, exactly like ImageFolder); unlabeled
+directories are flat and get label -1. Re-running build_cache only decodes
+files that are new or changed since the last run and appends them as a new
+shard; removed files are dropped from the index, and the cache is rewritten
+once more than half of the stored images are stale.
+
+    python dataset_cache.py --source callsifi_images --cache dataset_cache/callsifi_images
+    python dataset_cache.py --source unlabeled_images --cache dataset_cache/unlabeled_images --unlabeled
+"""
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import IMAGE_SIZE, MEAN, STD, load_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif', '.tiff', '.webp')
+INDEX_FILE = 'index.json'
+
+
+def list_images(source_dir, labeled=True):
+    """(relative path, label) pairs and the class list, ordered like ImageFolder."""
+    if not labeled:
+        files = sorted(f for f in os.listdir(source_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        return [(f, -1) for f in files], []
+    classes = sorted(entry.name for entry in os.scandir(source_dir) if entry.is_dir())
+    samples = []
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(source_dir, class_name)
+        for root, _, files in sorted(os.walk(class_dir, followlinks=True)):
+            for f in sorted(files):
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    samples.append((os.path.relpath(os.path.join(root, f), source_dir), label))
+    return samples, classes
+
+
+def load_index(cache_dir):
+    path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def build_cache(source_dir, cache_dir, labeled=True, image_size=IMAGE_SIZE):
+    """Create or incrementally update the cache of `source_dir`; returns the index."""
+    samples, classes = list_images(source_dir, labeled)
+    index = load_index(cache_dir)
+    if index is not None and (index['image_size'] != image_size or index['classes'] != classes
+                              or index['labeled'] != labeled):
+        print(f"DEBUG: Cache settings or classes changed, rebuilding {cache_dir}")
+        index = None
+    if index is None:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        index = {'image_size': image_size, 'labeled': labeled, 'classes': classes, 'shards': [], 'entries': []}
+    os.makedirs(cache_dir, exist_ok=True)
+
+    cached = {entry['path']: entry for entry in index['entries']}
+    entries = []
+    pending = []
+    for rel_path, label in samples:
+        stat = os.stat(os.path.join(source_dir, rel_path))
+        entry = cached.get(rel_path)
+        if entry is not None and entry['mtime_ns'] == stat.st_mtime_ns and entry['bytes'] == stat.st_size:
+            entry['label'] = label
+            entries.append(entry)
+        else:
+            pending.append({'path': rel_path, 'label': label, 'mtime_ns': stat.st_mtime_ns, 'bytes': stat.st_size})
+
+    stored = sum(shard['count'] for shard in index['shards'])
+    if stored and len(entries) < stored / 2:
+        # Mostly stale: start over rather than keep dead pixels on disk
+        print(f"DEBUG: More than half of {cache_dir} is stale, rebuilding it")
+        shutil.rmtree(cache_dir)
+        os.makedirs(cache_dir)
+        index['shards'] = []
+        pending = entries + pending
+        entries = []
+
+    if pending:
+        shard_number = len(index['shards'])
+        shard_file = f'shard_{shard_number:04d}.npy'
+        pixels = np.lib.format.open_memmap(os.path.join(cache_dir, shard_file), mode='w+', dtype=np.uint8,
+                                           shape=(len(pending), image_size, image_size, 3))
+        for offset, entry in enumerate(pending):
+            image = load_image(os.path.join(source_dir, entry['path']), draft_size=image_size)
+            # Same bilinear resize as resize_for_model, so cached pixels match the uncached pipeline
+            pixels[offset] = np.asarray(image.resize((image_size, image_size), Image.BILINEAR))
+            entry['shard'] = shard_number
+            entry['offset'] = offset
+        pixels.flush()
+        del pixels
+        index['shards'].append({'file': shard_file, 'count': len(pending)})
+        entries.extend(pending)
+        print(f"DEBUG: Cached {len(pending)} new images from {source_dir} into {shard_file}")
+
+    # Keep the ImageFolder order so indices and random splits match the uncached dataset
+    order = {rel_path: i for i, (rel_path, _) in enumerate(samples)}
+    index['entries'] = sorted(entries, key=lambda entry: order[entry['path']])
+    tmp_path = os.path.join(cache_dir, INDEX_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(cache_dir, INDEX_FILE))
+    return index
+
+
+class CachedImageDataset:
+    """Dataset over a cache written by build_cache, with the attributes of ImageFolder.
+
+    `transform` receives a PIL image backed by the memory-mapped pixels (use the
+    augmentations without the initial Resize); without one, samples come back
+    as normalized float tensors.
+    """
+
+    def __init__(self, cache_dir, transform=None):
+        index = load_index(cache_dir)
+        if index is None:
+            raise FileNotFoundError(f"No dataset cache in {cache_dir}; run build_cache first")
+        self.cache_dir = cache_dir
+        self.transform = transform
+        self.shard_files = [shard['file'] for shard in index['shards']]
+        self.entries = [(entry['shard'], entry['offset']) for entry in index['entries']]
+        self.classes = index['classes']
+        self.class_to_idx = {name: i for i, name in enumerate(self.classes)}
+        self.samples = [(entry['path'], entry['label']) for entry in index['entries']]
+        self.targets = [label for _, label in self.samples]
+        self._shards = None
+
+    def _open_shards(self):
+        # Opened lazily in every DataLoader worker; memmaps are never pickled
+        if self._shards is None:
+            self._shards = [np.load(os.path.join(self.cache_dir, f), mmap_mode='r') for f in self.shard_files]
+        return self._shards
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+    def __len__(self):
+        return len(self.entries)
+
+    def pixels(self, index):
+        shard, offset = self.entries[index]
+        return self._open_shards()[shard][offset]
+
+    def __getitem__(self, index):
+        pixels = self.pixels(index)
+        if self.transform is not None:
+            sample = self.transform(Image.fromarray(pixels))
+        else:
+            import torch
+            sample = torch.from_numpy(np.array(pixels)).permute(2, 0, 1).float().div_(255)
+            sample = (sample - torch.tensor(MEAN).view(3, 1, 1)) / torch.tensor(STD).view(3, 1, 1)
+        return sample, self.targets[index]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or update a memory-mapped dataset cache')
+    parser.add_argument('--source', required=True, help='Image directory (ImageFolder layout unless --unlabeled)')
+    parser.add_argument('--cache', required=True, help='Directory for the shards and index.json')
+    parser.add_argument('--unlabeled', action='store_true', help='Flat directory of unlabeled images')
+    args = parser.parse_args()
+
+    index = build_cache(args.source, args.cache, labeled=not args.unlabeled)
+    print(f"DEBUG: {len(index['entries'])} images cached in {len(index['shards'])} shards at {args.cache}")
@@ -0,0 +1,130 @@
+"""Multi-process data-parallel training with torch.distributed (gloo, CPU).
+
+modelRN.py switches to distributed training when it is started by torchrun
+(WORLD_SIZE > 1 in the environment):
+
+    # 4 processes on this box
+    torchrun --nproc_per_node 4 modelRN.py
+    # 2 boxes on the LAN, 4 processes each (run on both, --node_rank 0 and 1)
+    torchrun --nnodes 2 --nproc_per_node 4 --node_rank 0 --master_addr 10.0.0.5 --master_port 29500 modelRN.py
+
+Every process trains a DistributedDataParallel replica on its own
+DistributedSampler shard and gradients are averaged by gloo all-reduce.
+Epoch metrics (loss, correct predictions, image counts, timings) are reduced
+over all ranks before they are logged, and only rank 0 writes metrics,
+checkpoints, plots and the final weights. Each process gets an equal share of
+this box's cores for its intra-op threads. DistributedSampler pads every
+shard to the same length, so up to world_size - 1 images count twice per
+epoch. Resuming reads the checkpoint on every rank, so with several machines
+the --checkpoint-dir must be shared (or copied) between them.
+
+Outside torchrun all helpers fall back to single-process behaviour.
+"""
+import contextlib
+import os
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+
+def requested():
+    return int(os.environ.get('WORLD_SIZE', '1')) > 1
+
+
+def is_initialized():
+    return dist.is_available() and dist.is_initialized()
+
+
+def init_distributed(backend='gloo'):
+    """Join the process group started by torchrun; returns (rank, world_size), (0, 1) when not distributed."""
+    if not requested():
+        return 0, 1
+    if not is_initialized():
+        dist.init_process_group(backend=backend)
+        # Split this machine's cores between the processes running on it
+        local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', dist.get_world_size()))
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    return dist.get_rank(), dist.get_world_size()
+
+
+def cleanup():
+    if is_initialized():
+        dist.destroy_process_group()
+
+
+def get_rank():
+    return dist.get_rank() if is_initialized() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_initialized() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def wrap_model(model):
+    """DistributedDataParallel replica when distributed, the model itself otherwise."""
+    return DistributedDataParallel(model) if is_initialized() else model
+
+
+def unwrap(model):
+    """The plain model inside a DDP wrapper, e.g. for state_dict() without the 'module.' prefix."""
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def gradient_sync(model, sync):
+    """Context for a backward pass; skips DDP's gradient all-reduce on accumulation batches that do not step."""
+    if sync or not isinstance(model, DistributedDataParallel):
+        return contextlib.nullcontext()
+    return model.no_sync()
+
+
+def barrier():
+    if is_initialized():
+        dist.barrier()
+
+
+def broadcast_object(obj):
+    """Rank 0's `obj` on every rank (e.g. a random train/val split)."""
+    if not is_initialized():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+
+def make_distributed_loader(dataset, batch_size, shuffle, options=None, seed=0):
+    """DataLoader over this rank's shard (all of it in a single process); reshuffle with set_epoch every epoch."""
+    sampler = DistributedSampler(dataset, num_replicas=get_world_size(), rank=get_rank(), shuffle=shuffle, seed=seed)
+    return DataLoader(dataset, batch_size=batch_size, sampler=sampler, **(options or {}))
+
+
+def set_epoch(loader, epoch):
+    if isinstance(getattr(loader, 'sampler', None), DistributedSampler):
+        loader.sampler.set_epoch(epoch)
+
+
+def all_reduce(tensor, op='sum'):
+    """In-place sum/max/min over all ranks (a no-op when not distributed); returns the tensor."""
+    if is_initialized():
+        dist.all_reduce(tensor, op={'sum': dist.ReduceOp.SUM, 'max': dist.ReduceOp.MAX,
+                                    'min': dist.ReduceOp.MIN}[op])
+    return tensor
+
+
+def reduce_timing(summary):
+    """LoaderTimer summary over all ranks: the slowest rank's epoch time, mean data wait and compute."""
+    if not is_initialized():
+        return summary
+    world_size = get_world_size()
+    values = all_reduce(torch.tensor([summary['data_wait_s'], summary['compute_s'], summary['batches']],
+                                     dtype=torch.float64))
+    total = all_reduce(torch.tensor(summary['total_s'], dtype=torch.float64), op='max').item()
+    data_wait = values[0].item() / world_size
+    return {'data_wait_s': data_wait, 'compute_s': values[1].item() / world_size, 'total_s': total,
+            'data_wait_fraction': data_wait / total if total else 0.0, 'batches': int(values[2].item() / world_size)}
@@ -1,19 +1,17 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torchvision import datasets, transforms, models
-from torch.utils.data import DataLoader
+from torchvision import datasets, models
 from tkinter import Tk, filedialog, Label, Button
 from PIL import Image, ImageTk
 import os
+from preprocessing import build_eval_transform, images_to_tensor, load_image
+from data_loading import LoaderTimer, loader_options, make_loader
+from telemetry import configure_logging
 # פונקציות לאימון ולבדיקה
 
 # הגדרות נתונים וטרנספורמציות
-data_transforms = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
+data_transforms = build_eval_transform()
 
 # פונקציית אימון מודל
 def train_model(model, train_loader, val_loader, criterion, optimizer, num_epochs=20):
@@ -23,8 +21,9 @@ def train_model(model, train_loader, val_loader, criterion, optimizer, num_epoch
         running_loss = 0.0
         corrects = 0
 
-        for inputs, labels in train_loader:
-            inputs, labels = inputs.to(device), labels.to(device)
+        timed_loader = LoaderTimer(train_loader, device)
+        for inputs, labels in timed_loader:
+            inputs, labels = inputs.to(device, non_blocking=True), labels.to(device, non_blocking=True)
             optimizer.zero_grad()
             outputs = model(inputs)
             loss = criterion(outputs, labels)
@@ -36,19 +35,14 @@ def train_model(model, train_loader, val_loader, criterion, optimizer, num_epoch
             corrects += torch.sum(preds == labels.data)
 
         print(f'Train Loss: {running_loss/len(train_loader.dataset):.4f} Acc: {corrects.double()/len(train_loader.dataset):.4f}')
+        timed_loader.report(f'Epoch {epoch+1}/{num_epochs} train')
 
     return model
 
 # פונקציה לבדיקת תמונה אם היא סריקת אק"ג
 def classify_image(model, image_path):
     model.eval()
-    image = Image.open(image_path).convert('RGB')
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    input_tensor = transform(image).unsqueeze(0)
+    input_tensor = images_to_tensor([load_image(image_path)])
     input_tensor = input_tensor.to(device)
 
     with torch.no_grad():
@@ -89,6 +83,7 @@ def open_image_window(model):
 # קוד ראשי להרצת המודל
 if __name__ == '__main__':
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    configure_logging()
 
     # יצירת מודל ResNet מאומן מראש
     model = models.resnet18(pretrained=True)
@@ -102,10 +97,12 @@ if __name__ == '__main__':
 
     # טוענים את הנתונים
     data_dir = 'path_to_your_data'
-    train_dataset = datasets.ImageFolder(root=os.path.join(data_dir, 'train'), transform=data_transforms)
-    val_dataset = datasets.ImageFolder(root=os.path.join(data_dir, 'val'), transform=data_transforms)
-    train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=32, shuffle=False)
+    train_dataset = datasets.ImageFolder(root=os.path.join(data_dir, 'train'), transform=data_transforms, loader=load_image)
+    val_dataset = datasets.ImageFolder(root=os.path.join(data_dir, 'val'), transform=data_transforms, loader=load_image)
+    # תהליכי עבודה לטעינת התמונות, זיכרון מוצמד ל-GPU
+    options = loader_options()
+    train_loader = make_loader(train_dataset, batch_size=32, shuffle=True, options=options)
+    val_loader = make_loader(val_dataset, batch_size=32, shuffle=False, options=options)
 
     # אימון המודל
     model = train_model(model, train_loader, val_loader, criterion, optimizer, num_epochs=20)
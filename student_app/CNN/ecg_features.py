@@ -0,0 +1,172 @@
+"""Batched ECG feature extraction from scan images.
+
+The model input is a photo/scan of a standard 12-lead printout: three rows of
+four leads (I aVR V1 V4 / II aVL V2 V5 / III aVF V3 V6), each 2.5 s wide,
+above a rhythm strip. extract_feature_batch works on a whole normalized
+(batch, 3, H, W) tensor on its own device:
+
+1. the trace is the dark ink (all channels dark, which drops the red grid);
+2. the image is cut into the 12 lead tiles and every pixel column gives the
+   trace height as the ink-weighted centroid, i.e. one sampled signal per
+   lead, plus the highest and lowest ink for the QRS;
+3. per lead: the isoelectric baseline (median), the R peak, the ST level
+   80-120 ms after it and the T wave 160-400 ms after it, all relative to the
+   QRS amplitude so the result does not depend on the print scale;
+4. per-lead flags are combined into the features of classification_features.
+
+Everything is tensor arithmetic over (batch, lead, sample); there is no
+per-image Python loop and nothing leaves the device. These are heuristics for
+the training penalty, not a diagnostic measurement.
+
+    python ecg_features.py scan1.jpg scan2.jpg
+"""
+import argparse
+import json
+
+import torch
+
+from preprocessing import MEAN, STD, images_to_tensor, load_image
+
+LEAD_LAYOUT = (('I', 'aVR', 'V1', 'V4'), ('II', 'aVL', 'V2', 'V5'), ('III', 'aVF', 'V3', 'V6'))
+LEADS = tuple(lead for row in LEAD_LAYOUT for lead in row)
+LAYOUT_ROWS = 4  # three lead rows and the rhythm strip
+TILE_SECONDS = 2.5
+
+# Anatomical lead groups for the 'leads' feature, and the Wellens leads for 'specific_leads'
+TERRITORIES = {
+    'Anterior': ('V1', 'V2', 'V3', 'V4'),
+    'Inferior': ('II', 'III', 'aVF'),
+    'Lateral': ('I', 'aVL', 'V5', 'V6'),
+    'Septal': ('V1', 'V2'),
+}
+SPECIFIC_LEADS = ('V2', 'V3')
+
+ECG_FEATURES = ('st_elevation', 'st_depression', 'st_changes', 'extreme_st_changes', 't_wave_inversion',
+                't_wave_negative', 't_wave_high', 't_wave_wide', 'minimal_changes', 'leads', 'specific_leads')
+
+TRACE_THRESHOLD = 0.35  # ink darkness (1 - brightest channel) above which a pixel is trace
+MIN_COVERAGE = 0.5  # share of a tile's columns that must contain trace for the lead to count
+ST_THRESHOLD = 0.1  # ST deviation, as a fraction of the QRS amplitude
+EXTREME_ST_THRESHOLD = 0.3
+T_NEGATIVE_THRESHOLD = 0.1
+T_HIGH_THRESHOLD = 0.5
+T_WIDE_FRACTION = 0.6  # share of the T window above half the T amplitude
+
+
+def trace_signals(inputs):
+    """Normalized (batch, 3, H, W) images -> per-lead trace signals, each (batch, 12, samples).
+
+    Returns the trace height (ink centroid of every column), the highest and
+    lowest ink of the column (steep QRS strokes are vertical lines, so their
+    peaks only show in the envelope) and which columns contain any trace.
+    """
+    mean = torch.tensor(MEAN, device=inputs.device, dtype=inputs.dtype).view(1, 3, 1, 1)
+    std = torch.tensor(STD, device=inputs.device, dtype=inputs.dtype).view(1, 3, 1, 1)
+    darkness = 1 - (inputs * std + mean).amax(dim=1)
+    ink = (darkness - TRACE_THRESHOLD).clamp(min=0)
+
+    batch, height, width = ink.shape
+    rows, columns = len(LEAD_LAYOUT), len(LEAD_LAYOUT[0])
+    tile_height, tile_width = height // LAYOUT_ROWS, width // columns
+    tiles = ink[:, :tile_height * rows, :tile_width * columns].reshape(batch, rows, tile_height, columns, tile_width)
+    tiles = tiles.permute(0, 1, 3, 2, 4).reshape(batch, rows * columns, tile_height, tile_width)
+
+    mass = tiles.sum(dim=2)
+    rows_index = torch.arange(tile_height, device=inputs.device, dtype=inputs.dtype).view(1, 1, tile_height, 1)
+    centroid = (tiles * rows_index).sum(dim=2) / mass.clamp(min=1e-6)
+    inked = (tiles > 0).to(torch.uint8)
+    top = inked.argmax(dim=2).to(inputs.dtype)
+    bottom = (tile_height - 1) - inked.flip(2).argmax(dim=2).to(inputs.dtype)
+    # Image rows grow downwards; positive heights are upward deflections
+    middle = (tile_height - 1) / 2
+    return middle - centroid, middle - top, middle - bottom, mass > 1e-3
+
+
+def _window(start_seconds, end_seconds, samples_per_second, device):
+    start = round(start_seconds * samples_per_second)
+    end = max(start + 1, round(end_seconds * samples_per_second))
+    return torch.arange(start, end, device=device)
+
+
+def lead_measurements(inputs):
+    """Per-lead ST level, T-wave extremes and width (relative to the QRS amplitude) and a validity mask."""
+    heights, upper, lower, covered = trace_signals(inputs)
+    samples = heights.size(-1)
+    valid = covered.float().mean(dim=-1) > MIN_COVERAGE
+
+    baseline = heights.masked_fill(~covered, float('nan')).nanmedian(dim=-1, keepdim=True).values.nan_to_num(0.0)
+    zeros = torch.zeros_like(heights)
+    signal = torch.where(covered, heights - baseline, zeros)
+    upper = torch.where(covered, upper - baseline, zeros)
+    lower = torch.where(covered, lower - baseline, zeros)
+    qrs = (upper.amax(dim=-1) - lower.amin(dim=-1)).clamp(min=1.0)
+    # The QRS is the tallest stroke of the lead, up or down (leads such as aVR are mostly negative)
+    r_peak = torch.where(upper.amax(dim=-1) >= -lower.amin(dim=-1), upper.argmax(dim=-1),
+                         lower.argmin(dim=-1)).unsqueeze(-1)
+
+    samples_per_second = samples / TILE_SECONDS
+    st_window = (r_peak + _window(0.08, 0.12, samples_per_second, inputs.device)).clamp(max=samples - 1)
+    t_window = (r_peak + _window(0.16, 0.40, samples_per_second, inputs.device)).clamp(max=samples - 1)
+
+    st = signal.gather(-1, st_window).mean(dim=-1) / qrs
+    t_wave = signal.gather(-1, t_window)
+    t_max = t_wave.amax(dim=-1) / qrs
+    t_min = t_wave.amin(dim=-1) / qrs
+    t_peak = t_wave.abs().amax(dim=-1, keepdim=True)
+    t_width = (t_wave.abs() > 0.5 * t_peak).float().mean(dim=-1)
+    return {'st': st, 't_max': t_max, 't_min': t_min, 't_width': t_width, 'valid': valid}
+
+
+def _lead_mask(leads, device):
+    return torch.tensor([lead in leads for lead in LEADS], device=device)
+
+
+def extract_feature_batch(inputs, names=ECG_FEATURES, lead_groups=None, specific_leads=SPECIFIC_LEADS):
+    """Boolean (batch, len(names)) tensor of ECG features for a normalized image batch.
+
+    Names outside ECG_FEATURES come back False. `lead_groups` (lists of lead
+    names) defines the territories for 'leads'; defaults to TERRITORIES.
+    """
+    device = inputs.device
+    with torch.no_grad():
+        measured = lead_measurements(inputs.float())
+    valid = measured['valid']
+    st, t_max, t_min = measured['st'], measured['t_max'], measured['t_min']
+    # aVR is normally negative, and T inversion is a normal finding in III and V1 as well
+    not_avr = _lead_mask(('aVR',), device).logical_not()
+    inversion_leads = _lead_mask(('aVR', 'III', 'V1'), device).logical_not()
+
+    st_up = (st > ST_THRESHOLD) & valid
+    st_down = (st < -ST_THRESHOLD) & valid & not_avr
+    t_negative = (t_min < -T_NEGATIVE_THRESHOLD) & (t_max.abs() < t_min.abs()) & valid & not_avr
+
+    features = {
+        'st_elevation': st_up.sum(dim=1) >= 2,
+        'st_depression': st_down.sum(dim=1) >= 2,
+        'extreme_st_changes': ((st.abs() > EXTREME_ST_THRESHOLD) & valid).any(dim=1),
+        't_wave_inversion': (t_negative & inversion_leads).sum(dim=1) >= 2,
+        't_wave_negative': t_negative.any(dim=1),
+        't_wave_high': ((t_max > T_HIGH_THRESHOLD) & valid).any(dim=1),
+        't_wave_wide': ((measured['t_width'] > T_WIDE_FRACTION) & (t_max > T_NEGATIVE_THRESHOLD) & valid).any(dim=1),
+    }
+    features['st_changes'] = features['st_elevation'] | features['st_depression']
+    features['minimal_changes'] = ~(features['st_changes'] | features['extreme_st_changes']
+                                    | features['t_wave_inversion'] | features['t_wave_high'])
+    groups = torch.stack([_lead_mask(group, device) for group in (lead_groups or TERRITORIES.values())])
+    features['leads'] = ((st_up.unsqueeze(1) & groups).sum(dim=2) >= 2).any(dim=1)
+    specific = _lead_mask(specific_leads, device)
+    features['specific_leads'] = (t_negative & specific).sum(dim=1) == specific.sum()
+
+    missing = torch.zeros(inputs.size(0), dtype=torch.bool, device=device)
+    return torch.stack([features.get(name, missing) for name in names], dim=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the ECG features extracted from scan images')
+    parser.add_argument('image_paths', nargs='+')
+    args = parser.parse_args()
+
+    batch = images_to_tensor([load_image(path) for path in args.image_paths])
+    flags = extract_feature_batch(batch)
+    for path, row in zip(args.image_paths, flags.tolist()):
+        print(json.dumps({'image': path, 'features': [name for name, flag in zip(ECG_FEATURES, row) if flag]}))
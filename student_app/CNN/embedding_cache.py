@@ -0,0 +1,122 @@
+"""Persistent cache of pooled ResNet18 backbone embeddings.
+
+An embedding is the 512-d average-pooled layer4 output of an image under the
+eval transform, i.e. exactly what model.fc receives at inference time.
+Entries are keyed by the SHA-256 of the image bytes and a fingerprint of the
+backbone weights (everything but model.fc), so retraining only the head keeps
+the cache valid, while a full retrain (new backbone) starts a new one. Like
+the result cache, it lives in a SQLite file next to this module.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from preprocessing import images_to_tensor, load_image
+from result_cache import file_sha256
+
+DEFAULT_EMBEDDING_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embedding_cache.db')
+EMBEDDING_SIZE = 512
+
+
+def _state_fingerprint(model, skip_prefix=None):
+    digest = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        if skip_prefix is not None and name.startswith(skip_prefix):
+            continue
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def backbone_fingerprint(model):
+    """Hash of every weight and buffer outside the fc head."""
+    return _state_fingerprint(model, skip_prefix='fc.')
+
+
+def model_fingerprint(model):
+    """Hash of every weight and buffer, the head included."""
+    return _state_fingerprint(model)
+
+
+def backbone_of(model):
+    """ResNet18 without its head: (batch, 3, 224, 224) -> (batch, 512) pooled features."""
+    return nn.Sequential(*list(model.children())[:-1], nn.Flatten(1))
+
+
+class EmbeddingCache:
+    def __init__(self, path=DEFAULT_EMBEDDING_CACHE_PATH, backbone_fingerprint=''):
+        self.path = path
+        self.backbone_fingerprint = backbone_fingerprint
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                imageHash TEXT NOT NULL,
+                backboneFingerprint TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (imageHash, backboneFingerprint)
+            )
+        """)
+        # Embeddings of any other backbone can never be used again
+        self.conn.execute("DELETE FROM embeddings WHERE backboneFingerprint != ?", (backbone_fingerprint,))
+        self.conn.commit()
+
+    def get_many(self, image_hashes, chunk_size=500):
+        """{image hash: float32 embedding} for the hashes that are cached."""
+        found = {}
+        with self.lock:
+            for start in range(0, len(image_hashes), chunk_size):
+                chunk = image_hashes[start:start + chunk_size]
+                rows = self.conn.execute(
+                    f"SELECT imageHash, embedding FROM embeddings WHERE backboneFingerprint = ? "
+                    f"AND imageHash IN ({','.join('?' * len(chunk))})",
+                    (self.backbone_fingerprint, *chunk)).fetchall()
+                found.update((image_hash, np.frombuffer(blob, dtype=np.float32)) for image_hash, blob in rows)
+        return found
+
+    def put_many(self, items):
+        """Store (image hash, embedding) pairs."""
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (imageHash, backboneFingerprint, embedding) VALUES (?, ?, ?)",
+                [(image_hash, self.backbone_fingerprint, np.asarray(embedding, dtype=np.float32).tobytes())
+                 for image_hash, embedding in items])
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def compute_embeddings(backbone, image_paths, batch_size=32, device=torch.device('cpu')):
+    """float32 (len(image_paths), 512) embeddings, computed in batches under the eval transform."""
+    embeddings = np.empty((len(image_paths), EMBEDDING_SIZE), dtype=np.float32)
+    backbone.eval()
+    with torch.inference_mode():
+        for start in range(0, len(image_paths), batch_size):
+            batch = images_to_tensor([load_image(path) for path in image_paths[start:start + batch_size]])
+            embeddings[start:start + len(batch)] = backbone(batch.to(device)).float().cpu().numpy()
+    return embeddings
+
+
+def load_embeddings(model, image_paths, cache, batch_size=32, device=torch.device('cpu')):
+    """Embeddings of `image_paths` in order, computing and caching only the images not cached yet.
+
+    Returns the (N, 512) array, the image hashes and how many images had to be run through the backbone.
+    """
+    image_hashes = [file_sha256(path) for path in image_paths]
+    cached = cache.get_many(list(set(image_hashes)))
+    missing = sorted({image_hash: path for image_hash, path in zip(image_hashes, image_paths)
+                      if image_hash not in cached}.items())
+    if missing:
+        computed = compute_embeddings(backbone_of(model), [path for _, path in missing], batch_size, device)
+        cache.put_many(zip((image_hash for image_hash, _ in missing), computed))
+        cached.update(zip((image_hash for image_hash, _ in missing), computed))
+    embeddings = np.stack([cached[image_hash] for image_hash in image_hashes]) if image_hashes else \
+        np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+    return embeddings, image_hashes, len(missing)
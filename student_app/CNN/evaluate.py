@@ -0,0 +1,169 @@
+"""Held-out evaluation of a trained model, written as a JSON report.
+
+Runs batched no-grad inference over one split of the persisted train/val/test
+split (data_split.py; the test split by default), with the same decode and
+eval transform as inference.py. The report contains:
+
+    accuracy, confusion_matrix   {true class: {predicted class: count}}, non-zero counts only,
+                                 by the class_names labels that inference reports
+    per_class                    precision, recall, F1 and support for every class_names entry
+                                 (null where undefined, e.g. a class never predicted)
+    latency                      per batch size: per-image latency percentiles (p50/p95/p99) of
+                                 decode + preprocess + forward, batch latency and images/sec
+
+Ground truth is the image's folder name looked up in class_names. Keys are
+sorted and numbers rounded, so reports of two model versions diff cleanly:
+
+    python evaluate.py --output eval_report.json
+    python evaluate.py --weights checkpoints/best_model.pth --batch-sizes 1 8 32 --output eval_best.json
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from data_split import DEFAULT_SPLIT_PATH, SPLIT_NAMES, split_indices
+from dataset_cache import list_images
+from inference import build_model, class_names, device, model_save_path
+from preprocessing import images_to_tensor, load_image
+from result_cache import weights_fingerprint
+from telemetry import configure_logging, logger
+
+
+def load_weights(path=model_save_path):
+    model = build_model()
+    model.load_state_dict(torch.load(path, map_location='cpu', weights_only=True))
+    return model.to(device).eval()
+
+
+def held_out_images(data_dir='callsifi_images', split_path=DEFAULT_SPLIT_PATH, split_name='test'):
+    """Paths and class_names indices of the images in one split; folders not in class_names are skipped."""
+    samples, _ = list_images(data_dir, labeled=True)
+    rel_paths = [rel_path.replace(os.sep, '/') for rel_path, _ in samples]
+    split = split_indices(rel_paths, split_path)
+    image_paths, labels, skipped = [], [], []
+    for i in split[split_name]:
+        folder = rel_paths[i].split('/')[0]
+        if folder in class_names:
+            image_paths.append(os.path.join(data_dir, rel_paths[i]))
+            labels.append(class_names.index(folder))
+        elif folder not in skipped:
+            skipped.append(folder)
+    if skipped:
+        logger.warning(f"Skipping images of folders that are not in class_names: {skipped}")
+    return image_paths, labels
+
+
+def run_batches(model, image_paths, batch_size):
+    """Predictions for `image_paths` and the wall time of every batch (decode + preprocess + forward)."""
+    predictions = []
+    batch_times = []
+    with torch.inference_mode():
+        for start in range(0, len(image_paths), batch_size):
+            batch_start = time.perf_counter()
+            batch = images_to_tensor([load_image(path) for path in image_paths[start:start + batch_size]])
+            outputs = model(batch.to(device))
+            predictions.extend(outputs.argmax(dim=1).tolist())
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            batch_times.append(time.perf_counter() - batch_start)
+    return predictions, batch_times
+
+
+def confusion_matrix(labels, predictions, num_classes=len(class_names)):
+    matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+    np.add.at(matrix, (np.asarray(labels, dtype=np.int64), np.asarray(predictions, dtype=np.int64)), 1)
+    return matrix
+
+
+def confusion_table(matrix):
+    # One line per non-zero cell keeps diffs between reports readable
+    return {true_name: {predicted_name: int(matrix[i, j])
+                        for j, predicted_name in enumerate(class_names) if matrix[i, j]}
+            for i, true_name in enumerate(class_names)}
+
+
+def _ratio(numerator, denominator):
+    return round(float(numerator) / float(denominator), 4) if denominator else None
+
+
+def per_class_metrics(matrix):
+    metrics = {}
+    for i, name in enumerate(class_names):
+        true_positives = matrix[i, i]
+        precision = _ratio(true_positives, matrix[:, i].sum())
+        recall = _ratio(true_positives, matrix[i, :].sum())
+        f1 = (round(2 * precision * recall / (precision + recall), 4)
+              if precision is not None and recall is not None and precision + recall else None)
+        metrics[name] = {'precision': precision, 'recall': recall, 'f1': f1, 'support': int(matrix[i, :].sum())}
+    return metrics
+
+
+def latency_report(model, image_paths, batch_size, repeats=3):
+    """Latency percentiles over `repeats` passes, after one warm-up batch."""
+    run_batches(model, image_paths[:batch_size], batch_size)
+    per_image_ms = []
+    batch_ms = []
+    for _ in range(repeats):
+        _, batch_times = run_batches(model, image_paths, batch_size)
+        for start, batch_time in zip(range(0, len(image_paths), batch_size), batch_times):
+            count = min(batch_size, len(image_paths) - start)
+            per_image_ms.extend([batch_time * 1000 / count] * count)
+            batch_ms.append(batch_time * 1000)
+    p50, p95, p99 = np.percentile(per_image_ms, [50, 95, 99])
+    return {
+        'per_image_ms': {'p50': round(float(p50), 2), 'p95': round(float(p95), 2), 'p99': round(float(p99), 2),
+                         'mean': round(float(np.mean(per_image_ms)), 2)},
+        'batch_ms_p50': round(float(np.percentile(batch_ms, 50)), 2),
+        'images_per_sec': round(len(per_image_ms) * 1000 / sum(batch_ms), 2),
+        'samples': len(per_image_ms),
+    }
+
+
+def evaluate(model, data_dir='callsifi_images', split_path=DEFAULT_SPLIT_PATH, split_name='test',
+             batch_sizes=(1, 8, 32), repeats=3):
+    """The evaluation report of `model` on one split, as a JSON-serializable dict."""
+    image_paths, labels = held_out_images(data_dir, split_path, split_name)
+    if not image_paths:
+        raise ValueError(f"The {split_name} split of {data_dir} has no images of a class in class_names")
+    predictions, _ = run_batches(model, image_paths, max(batch_sizes))
+    matrix = confusion_matrix(labels, predictions)
+    report = {
+        'split': split_name,
+        'images': len(image_paths),
+        'accuracy': round(float(np.trace(matrix)) / len(image_paths), 4),
+        'confusion_matrix': confusion_table(matrix),
+        'per_class': per_class_metrics(matrix),
+        'latency': {},
+    }
+    for batch_size in batch_sizes:
+        latency = latency_report(model, image_paths, batch_size, repeats)
+        report['latency'][f'batch_{batch_size}'] = latency
+        logger.info(f"Batch size {batch_size}: {latency['per_image_ms']['p50']} ms/image p50, "
+                    f"{latency['per_image_ms']['p99']} ms p99, {latency['images_per_sec']} images/s")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate a model on the held-out split')
+    parser.add_argument('--weights', default=model_save_path)
+    parser.add_argument('--data-dir', default='callsifi_images')
+    parser.add_argument('--split-path', default=DEFAULT_SPLIT_PATH)
+    parser.add_argument('--split', choices=SPLIT_NAMES, default='test')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--repeats', type=int, default=3, help='Timed passes over the split per batch size')
+    parser.add_argument('--output', default='eval_report.json')
+    args = parser.parse_args()
+
+    configure_logging()
+    report = evaluate(load_weights(args.weights), args.data_dir, args.split_path, args.split, args.batch_sizes,
+                      args.repeats)
+    report['model'] = {'weights': args.weights, 'fingerprint': weights_fingerprint(args.weights)}
+    report['environment'] = {'torch': torch.__version__, 'device': device.type, 'threads': torch.get_num_threads()}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    logger.info(f"Accuracy {report['accuracy']:.4f} on {report['images']} {args.split} images; "
+                f"report written to {args.output}")
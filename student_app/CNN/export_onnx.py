@@ -0,0 +1,91 @@
+"""Export the trained classifier to ONNX for the onnxruntime engine.
+
+The exported graph takes a normalized (batch, 3, 224, 224) input with a
+dynamic batch axis and has two outputs:
+
+    logits  (batch, 11)        the classifier scores
+    cams    (batch, 11, 7, 7)  Grad-CAM maps of every class before ReLU
+
+For ResNet18 the gradient of a class score with respect to the layer4
+activations is that class's fc weight divided by the pooled area, so the
+Grad-CAM of inference.forward_with_gradcam reduces to a weighted sum the
+graph can compute without autograd; onnx_engine.py only picks the map of
+the predicted class.
+
+    python export_onnx.py --output ecg_classifier_model.onnx --check
+"""
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import inference
+from inference_config import ONNX_MODEL_PATH
+
+
+class LogitsAndCams(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        m = self.model
+        x = m.maxpool(m.relu(m.bn1(m.conv1(x))))
+        activations = m.layer4(m.layer3(m.layer2(m.layer1(x))))
+        logits = m.fc(torch.flatten(m.avgpool(activations), 1))
+        # Dropout is the identity in eval mode, so fc[1] holds the whole head
+        weights = m.fc[1].weight / (activations.shape[2] * activations.shape[3])
+        cams = torch.einsum('kc,bchw->bkhw', weights, activations)
+        return logits, cams
+
+
+def export_onnx(model, output_path=ONNX_MODEL_PATH, opset_version=17):
+    wrapper = LogitsAndCams(model.cpu().eval()).eval()
+    example = torch.randn(2, 3, 224, 224)
+    torch.onnx.export(
+        wrapper, (example,), output_path,
+        input_names=['input'], output_names=['logits', 'cams'],
+        dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}, 'cams': {0: 'batch'}},
+        opset_version=opset_version,
+    )
+    return output_path
+
+
+def check_equivalence(model, onnx_path=ONNX_MODEL_PATH, batch_sizes=(1, 4), atol=1e-4):
+    """Compare logits and Grad-CAM maps of onnxruntime against the torch path; raises on mismatch."""
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+    model = model.cpu().eval()
+    report = {}
+    for batch_size in batch_sizes:
+        inputs = torch.randn(batch_size, 3, 224, 224, generator=torch.Generator().manual_seed(batch_size))
+        logits, cams = inference.forward_with_gradcam(model, inputs)
+        onnx_logits, onnx_cams = session.run(None, {'input': inputs.numpy()})
+        preds = logits.argmax(dim=1)
+        onnx_cams = np.maximum(onnx_cams[np.arange(batch_size), preds.numpy()], 0)
+
+        logits_diff = float(np.abs(onnx_logits - logits.numpy()).max())
+        cams_diff = float(np.abs(onnx_cams - cams.numpy()).max())
+        same_top1 = bool((onnx_logits.argmax(axis=1) == preds.numpy()).all())
+        report[batch_size] = {'max_logit_diff': logits_diff, 'max_cam_diff': cams_diff, 'same_top1': same_top1}
+        if not same_top1 or logits_diff > atol or cams_diff > atol:
+            raise AssertionError(f"ONNX output differs from torch at batch size {batch_size}: {report[batch_size]}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export ecg_classifier_model.pth to ONNX')
+    parser.add_argument('--output', default=ONNX_MODEL_PATH)
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--check', action='store_true', help='Verify numerical equivalence with the torch path')
+    args = parser.parse_args()
+
+    model = inference.load_model()
+    export_onnx(model, args.output, args.opset)
+    print(f"DEBUG: ONNX model saved at {args.output}")
+    if args.check:
+        for batch_size, result in check_equivalence(model, args.output).items():
+            print(f"DEBUG: batch {batch_size}: max logit diff {result['max_logit_diff']:.2e}, "
+                  f"max CAM diff {result['max_cam_diff']:.2e}, same top-1: {result['same_top1']}")
@@ -0,0 +1,134 @@
+"""Head-only fine-tuning on cached backbone embeddings.
+
+Retraining after a batch of newly classified images usually only needs the
+Dropout+Linear head (model.fc) to adapt. fine_tune_head keeps the ResNet18
+backbone frozen, so each image's pooled embedding never changes. It takes the
+embeddings from embedding_cache.py, runs the backbone only for images it has
+not seen, and then trains the head on the (N, 512) matrix; that takes seconds
+instead of a full forward and backward pass per image and epoch.
+
+Labels follow the ImageFolder layout of callsifi_images, as in train_model.
+The head trains on the train images of the persisted split (data_split.py)
+and keeps the epoch that scores best on its val images; the test images are
+never embedded or trained on, so evaluate.py still measures held-out data.
+Augmentation and the feature penalty of custom_loss need the pixels, so
+neither applies here; use the full train_model when the backbone itself
+should learn.
+
+    python head_finetune.py --data-dir callsifi_images --epochs 200
+    python modelRN.py --head-only
+"""
+import argparse
+import os
+import time
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from checkpointing import snapshot
+from data_split import DEFAULT_SPLIT_PATH, split_indices
+from dataset_cache import list_images
+from embedding_cache import DEFAULT_EMBEDDING_CACHE_PATH, EmbeddingCache, backbone_fingerprint, load_embeddings
+from inference import device, load_model, model_save_path, save_weights
+from telemetry import configure_logging, logger
+
+
+def fine_tune_head(model, data_dir='callsifi_images', cache_path=DEFAULT_EMBEDDING_CACHE_PATH, epochs=200,
+                   batch_size=64, lr=0.001, split_path=DEFAULT_SPLIT_PATH):
+    """Train model.fc on cached embeddings of `data_dir`; returns the model (best head by val accuracy) and a report."""
+    samples, classes = list_images(data_dir, labeled=True)
+    split = split_indices([rel_path.replace(os.sep, '/') for rel_path, _ in samples], split_path)
+    if not split['train']:
+        raise ValueError(f"The train split of {data_dir} is empty")
+    # Train images first, then val; test images are left out entirely
+    used = split['train'] + split['val']
+    image_paths = [os.path.join(data_dir, samples[i][0]) for i in used]
+    labels = torch.tensor([samples[i][1] for i in used], dtype=torch.long)
+
+    start = time.perf_counter()
+    model.eval()
+    cache = EmbeddingCache(cache_path, backbone_fingerprint(model))
+    embeddings, _, computed = load_embeddings(model, image_paths, cache, device=device)
+    cache.close()
+    embed_time = time.perf_counter() - start
+    logger.info(f"Embeddings for {len(image_paths)} images: {computed} computed, "
+                f"{len(image_paths) - computed} from the cache ({embed_time:.1f}s)")
+
+    features = torch.from_numpy(embeddings).to(device)
+    labels = labels.to(device)
+    train_size = len(split['train'])
+    train_x, train_y = features[:train_size], labels[:train_size]
+    val_x, val_y = features[train_size:], labels[train_size:]
+
+    head = model.fc
+    for parameter in model.parameters():
+        parameter.requires_grad_(False)
+    for parameter in head.parameters():
+        parameter.requires_grad_(True)
+    optimizer = optim.Adam(head.parameters(), lr=lr)
+    criterion = nn.CrossEntropyLoss()
+
+    start = time.perf_counter()
+    best_acc = -1.0
+    best_head = snapshot(head.state_dict())
+    for epoch in range(epochs):
+        head.train()
+        order = torch.randperm(len(train_x), device=device)
+        running_loss = torch.zeros((), device=device)
+        for batch_start in range(0, len(order), batch_size):
+            batch = order[batch_start:batch_start + batch_size]
+            optimizer.zero_grad()
+            loss = criterion(head(train_x[batch]), train_y[batch])
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.detach() * len(batch)
+
+        head.eval()
+        with torch.no_grad():
+            # Without validation images, keep the last epoch
+            val_acc = (head(val_x).argmax(dim=1) == val_y).float().mean().item() if len(val_x) else float(epoch)
+        if val_acc > best_acc:
+            best_acc = val_acc
+            best_head = snapshot(head.state_dict())
+        if (epoch + 1) % 50 == 0 or epoch + 1 == epochs:
+            logger.debug(f"Head epoch {epoch + 1}/{epochs} - Loss: {running_loss.item() / max(1, len(train_x)):.4f}, "
+                         f"Val Acc: {val_acc:.4f}")
+
+    head.load_state_dict(best_head)
+    for parameter in model.parameters():
+        parameter.requires_grad_(True)
+    train_time = time.perf_counter() - start
+    report = {
+        'images': len(samples),
+        'train_images': len(train_x),
+        'val_images': len(val_x),
+        'test_images_held_out': len(split['test']),
+        'embeddings_computed': computed,
+        'embed_s': embed_time,
+        'train_s': train_time,
+        'best_val_accuracy': best_acc if len(val_x) else None,
+        'classes': classes,
+    }
+    logger.info(f"Head trained for {epochs} epochs in {train_time:.1f}s"
+                + (f", best validation accuracy {best_acc:.4f}" if len(val_x) else ''))
+    return model, report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Retrain only the classifier head on cached backbone embeddings')
+    parser.add_argument('--data-dir', default='callsifi_images')
+    parser.add_argument('--epochs', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--lr', type=float, default=0.001)
+    parser.add_argument('--split-path', default=DEFAULT_SPLIT_PATH,
+                        help='Persisted train/val/test split (see data_split.py); test images are not used')
+    parser.add_argument('--cache-path', default=DEFAULT_EMBEDDING_CACHE_PATH)
+    parser.add_argument('--output', default=model_save_path, help='Where to save the fine-tuned weights')
+    args = parser.parse_args()
+
+    configure_logging()
+    model, report = fine_tune_head(load_model(), args.data_dir, args.cache_path, args.epochs, args.batch_size,
+                                   args.lr, args.split_path)
+    save_weights(model.state_dict(), args.output)
+    logger.info(f"Model saved at {args.output}")
@@ -0,0 +1,197 @@
+"""Slim classification entry point.
+
+Imports only what classifying an image needs (torch, torchvision's ResNet18,
+PIL and preprocessing.py); torchcam and the overlay writer are imported the first
+time an overlay is requested. modelRN re-exports these functions for the
+training code and for older callers.
+
+    python inference.py <image> [--cam gradcam|smoothgradcampp|none] [--no-cache] [--profile [RUN_DIR]]
+
+Track the import cost with benchmarks/bench_importtime.py.
+"""
+import argparse
+import json
+import os
+
+import torch
+import torch.nn as nn
+from torchvision import models
+from torchvision.models import ResNet18_Weights
+
+from preprocessing import build_eval_transform, images_to_tensor, load_image
+from profiling import add_profile_arguments, configure_from_args, profile_call
+from result_cache import DEFAULT_CACHE_PATH, ResultCache, file_sha256, weights_fingerprint
+
+model_save_path = 'ecg_classifier_model.pth'  # path to trained model
+class_names = ['Avrste', 'DeWinters', 'Hyperacute', 'LossOfBalance', 'TInversion', 'Wellens', 'LOW RISK', 'Anterior',
+               'Inferior', 'Lateral', 'Septal']
+
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+eval_transform = build_eval_transform()
+
+# Build the ResNet18 architecture with our Dropout+Linear head.
+# ImageNet weights are only needed when training starts without a saved model.
+def build_model(pretrained=False):
+    model = models.resnet18(weights=ResNet18_Weights.DEFAULT if pretrained else None)
+    num_ftrs = model.fc.in_features
+    model.fc = nn.Sequential(
+        nn.Dropout(0.5),
+        nn.Linear(num_ftrs, len(class_names))
+    )
+    return model
+
+# Load model
+def load_model():
+    print("DEBUG: Loading model...")
+    if os.path.exists(model_save_path):
+        # The saved state overwrites every weight, so skip the ImageNet weights and the random
+        # init: build the architecture on the meta device and map the saved tensors straight in
+        state_dict = torch.load(model_save_path, map_location='cpu', weights_only=True, mmap=True)
+        with torch.device('meta'):
+            model = build_model()
+        model.load_state_dict(state_dict, assign=True)
+        print("DEBUG: Model loaded from saved state.")
+    else:
+        model = build_model(pretrained=True)
+    model = model.to(device)
+    print("DEBUG: Model is ready.")
+    return model
+
+# Write weights through a temporary file; load_model memory-maps the current file, so overwriting it
+# in place would truncate the tensors the model is still reading from
+def save_weights(state_dict, path=model_save_path):
+    tmp_path = path + '.tmp'
+    torch.save(state_dict, tmp_path)
+    os.replace(tmp_path, path)
+
+# CAM variants accepted by classify_images; None returns the label only
+CAM_METHODS = ('gradcam', 'smoothgradcampp')
+
+# Run the batch forward pass with layer4 hooked and compute plain Grad-CAM maps
+# for the predicted classes from that same pass (one forward, one partial backward)
+def forward_with_gradcam(model, input_batch):
+    captured = {}
+    hook = model.layer4.register_forward_hook(lambda module, inputs, output: captured.update(activations=output))
+    try:
+        with torch.enable_grad():
+            outputs = model(input_batch)
+            preds = outputs.argmax(dim=1)
+            scores = outputs.gather(1, preds.unsqueeze(1)).sum()
+            activations = captured['activations']
+            gradients, = torch.autograd.grad(scores, activations)
+    finally:
+        hook.remove()
+
+    weights = gradients.mean(dim=(2, 3), keepdim=True)
+    cams = torch.relu((weights * activations).sum(dim=1)).detach()
+    return outputs.detach(), cams
+
+# SmoothGrad-CAM++ for one image; noisier passes, but smoother maps
+def smooth_gradcam(model, input_tensor, class_idx, outputs):
+    from torchcam.methods import SmoothGradCAMpp
+
+    cam_extractor = SmoothGradCAMpp(model, target_layer='layer4')
+    _ = model(input_tensor)
+    cams = cam_extractor(class_idx=class_idx, scores=outputs)
+    activation_map = cams[0].cpu()
+    # Detach the CAM hooks so a reused model does not accumulate them
+    cam_extractor.remove_hooks()
+    return activation_map
+
+# Save the Grad-CAM overlay of one image and return the path of the written graph.
+# The overlay is drawn on the full-resolution scan, the model only saw a reduced decode.
+# The legend is the static public/heatmap.png, so only the overlay is written here.
+def save_gradcam(image_path, activation_map):
+    from overlay import write_overlay
+
+    graph_path = image_path.replace('uploads', 'graphs').replace('.jpg', '_graph.png')
+    image = load_image(image_path, draft_size=None)
+    return write_overlay(image, activation_map.cpu().numpy(), graph_path, alpha=0.7, threshold=0.5)
+
+# Result cache bound to the current weights file, so a retrain invalidates it.
+# variant tells apart results of the same weights run differently (e.g. quantized).
+def open_result_cache(path=DEFAULT_CACHE_PATH, max_entries=5000, variant=''):
+    fingerprint = weights_fingerprint(model_save_path) + (f':{variant}' if variant else '')
+    return ResultCache(path, model_fingerprint=fingerprint, max_entries=max_entries,
+                       model_key='torch' + (f':{variant}' if variant else ''))
+
+# Classify several images with a single batched forward pass.
+# cam selects the overlay: 'smoothgradcampp' (default), the cheaper 'gradcam'
+# computed from the same forward pass, or None for label and confidence only.
+# With a ResultCache, images seen before are answered from it by content hash.
+# fast_model (see optimize.py), a CPU-only model, replaces model for the label pass; Grad-CAM still
+# needs the fp32 model's gradients. With profiling on (profiling.py) every call is one profiler step.
+def classify_images(image_paths, model=None, cam='smoothgradcampp', cache=None, fast_model=None):
+    with profile_call('classify_image'):
+        return _classify_images(image_paths, model=model, cam=cam, cache=cache, fast_model=fast_model)
+
+
+def _classify_images(image_paths, model=None, cam='smoothgradcampp', cache=None, fast_model=None):
+    if cam not in CAM_METHODS and cam is not None:
+        raise ValueError(f"Unknown CAM method '{cam}', expected one of {CAM_METHODS} or None")
+    if cache is not None:
+        image_hashes = [file_sha256(image_path) for image_path in image_paths]
+        results = [cache.get(image_hash, cam) for image_hash in image_hashes]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed = _classify_images([image_paths[i] for i in missing], model=model, cam=cam,
+                                        fast_model=fast_model)
+            for i, result in zip(missing, computed):
+                cache.put(image_hashes[i], cam, result)
+                results[i] = result
+        return results
+    if model is None:
+        model = load_model()
+    images = [load_image(image_path) for image_path in image_paths]
+    input_batch = images_to_tensor(images).to(device)
+
+    model.eval()
+    cams = None
+    if cam == 'gradcam':
+        outputs, cams = forward_with_gradcam(model, input_batch)
+    else:
+        with torch.no_grad():
+            if fast_model is None:
+                outputs = model(input_batch).float()
+            else:
+                # Optimized models are CPU-only (see optimize.py), even when `device` is cuda
+                outputs = fast_model(input_batch.cpu()).float().to(device)
+    probabilities = nn.functional.softmax(outputs, dim=1)
+    confidences, preds = torch.max(probabilities, 1)
+
+    results = []
+    for i, image_path in enumerate(image_paths):
+        class_idx = preds[i].item()
+        graph_path = None
+        if cam == 'gradcam':
+            graph_path = save_gradcam(image_path, cams[i])
+        elif cam == 'smoothgradcampp':
+            activation_map = smooth_gradcam(model, input_batch[i:i + 1], class_idx, outputs[i:i + 1])
+            graph_path = save_gradcam(image_path, activation_map)
+        results.append({
+            'classification': class_names[class_idx],
+            'confidence': f'{confidences[i].item() * 100:.2f}%',
+            'graphUrl': graph_path
+        })
+    return results
+
+# Classify image and return results
+# A long-lived caller (see inference_worker.py) passes its already loaded model
+def classify_image(image_path, model=None, cam='smoothgradcampp', cache=None):
+    return classify_images([image_path], model=model, cam=cam, cache=cache)[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Classify an ECG image')
+    parser.add_argument('image_path')
+    parser.add_argument('--cam', choices=CAM_METHODS + ('none',), default='smoothgradcampp',
+                        help="Overlay method; 'none' returns the classification only")
+    parser.add_argument('--no-cache', action='store_true', help='Always recompute, bypassing the result cache')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    configure_from_args(args)
+    cache = None if args.no_cache else open_result_cache()
+    result = classify_image(args.image_path, cam=None if args.cam == 'none' else args.cam, cache=cache)
+    print(json.dumps(result))
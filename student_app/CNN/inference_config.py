@@ -0,0 +1,11 @@
+# inference_config.py
+import os
+
+# Get the base directory of the current file
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Inference engine used by the worker: 'torch' (inference.py) or 'onnx' (onnx_engine.py)
+INFERENCE_ENGINE = os.environ.get('ECG_INFERENCE_ENGINE', 'torch')
+
+# ONNX export of ecg_classifier_model.pth, written by export_onnx.py
+ONNX_MODEL_PATH = os.environ.get('ECG_ONNX_MODEL_PATH', os.path.join(BASE_DIR, 'ecg_classifier_model.onnx'))
@@ -0,0 +1,192 @@
+"""Long-lived ECG classification worker.
+
+Loads the model once and then answers classification requests, so an upload
+no longer pays for interpreter startup, the torch imports and the model load.
+
+Two transports are supported, both speaking JSON lines:
+
+    python inference_worker.py              # requests on stdin, results on stdout
+    python inference_worker.py --port 5050  # same protocol over a local TCP socket
+
+Request:  {"id": 1, "image": "/path/to/upload.jpg"}
+          {"id": 1, "image": "...", "cam": "gradcam"}  ("none" for the label only)
+Response: {"id": 1, "classification": ..., "confidence": ..., "graphUrl": ...}
+          {"id": 1, "error": "..."} when the classification failed
+
+The result fields are exactly those printed by `python modelRN.py <image>`.
+Results are cached by image content and model version (see result_cache.py).
+--optimize static_int8 (or another mode from optimize.py) runs the label pass on
+an optimized copy of the model once it passes the parity check against fp32.
+--engine onnx (or ECG_INFERENCE_ENGINE=onnx) serves the ONNX export through
+onnxruntime instead, without importing torch.
+Requests arriving together are classified in one batch (see micro_batcher.py);
+results may therefore come back out of order and are matched by "id".
+{"id": 2, "stats": true} returns the batching throughput counters.
+"""
+import argparse
+import json
+import socketserver
+import sys
+import threading
+
+# The protocol owns stdout; everything the model code prints goes to stderr instead
+protocol_out = sys.stdout
+sys.stdout = sys.stderr
+
+from inference_config import INFERENCE_ENGINE  # noqa: E402
+from micro_batcher import MicroBatcher  # noqa: E402
+from result_cache import DEFAULT_CACHE_PATH  # noqa: E402
+
+ENGINES = ('torch', 'onnx')
+
+
+# Import only the engine in use, so the onnx worker never loads torch
+def load_engine(name):
+    if name == 'onnx':
+        import onnx_engine
+        return onnx_engine
+    if name == 'torch':
+        import inference
+        return inference
+    raise ValueError(f"Unknown inference engine '{name}', expected one of {ENGINES}")
+
+
+class InferenceWorker:
+    def __init__(self, engine, max_batch_size=8, max_wait_ms=10.0, cam='smoothgradcampp', cache=None,
+                 optimize='fp32', calibration_dir='callsifi_images'):
+        self.engine = engine
+        self.cam = cam
+        self.cache = cache
+        self.model = engine.load_model()
+        # Extra keyword arguments for classify_images; only the torch engine has a fast model
+        self.classify_options = {}
+        if optimize != 'fp32':
+            from optimize import prepare_fast_model
+            self.model.eval()
+            self.classify_options['fast_model'] = prepare_fast_model(self.model, optimize, calibration_dir)
+        # Only the batching thread touches the model
+        self.batcher = MicroBatcher(self.classify_batch, max_batch_size=max_batch_size,
+                                    max_wait_ms=max_wait_ms)
+
+    def classify_batch(self, requests):
+        # Requests in one batch may ask for different overlays; run one pass per CAM method
+        results = [None] * len(requests)
+        for cam in set(cam for _, cam in requests):
+            indices = [i for i, (_, request_cam) in enumerate(requests) if request_cam == cam]
+            batch_results = self.engine.classify_images([requests[i][0] for i in indices], model=self.model,
+                                                        cam=cam, cache=self.cache, **self.classify_options)
+            for i, result in zip(indices, batch_results):
+                results[i] = result
+        return results
+
+    def submit(self, line, respond):
+        """Parse one request line and call `respond(response)` once it is answered."""
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            respond({'id': None, 'error': f'Invalid JSON request: {e}'})
+            return
+        if not isinstance(request, dict):
+            respond({'id': None, 'error': 'Request must be a JSON object'})
+            return
+
+        request_id = request.get('id')
+        if request.get('stats'):
+            respond({'id': request_id, 'stats': self.batcher.stats()})
+            return
+        image_path = request.get('image')
+        if not image_path:
+            respond({'id': request_id, 'error': "Missing 'image' in request"})
+            return
+        cam = request.get('cam', self.cam)
+        if cam == 'none':
+            cam = None
+        if cam is not None and cam not in self.engine.CAM_METHODS:
+            respond({'id': request_id, 'error': f"Unsupported CAM method '{cam}'"})
+            return
+
+        def on_done(future):
+            try:
+                respond({'id': request_id, **future.result()})
+            except Exception as e:
+                respond({'id': request_id, 'error': str(e)})
+
+        self.batcher.submit((image_path, cam)).add_done_callback(on_done)
+
+
+def line_writer(stream, encode=False):
+    lock = threading.Lock()
+
+    def write(response):
+        line = json.dumps(response) + '\n'
+        with lock:
+            stream.write(line.encode('utf-8') if encode else line)
+            stream.flush()
+    return write
+
+
+def serve_stdio(worker):
+    respond = line_writer(protocol_out)
+    # Tell the parent process the model is loaded and requests can be sent
+    respond({'ready': True})
+    for line in sys.stdin:
+        if line.strip():
+            worker.submit(line, respond)
+    worker.batcher.drain()
+
+
+def serve_socket(worker, host, port):
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            respond = line_writer(self.wfile, encode=True)
+            for line in self.rfile:
+                if line.strip():
+                    worker.submit(line.decode('utf-8'), respond)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((host, port), RequestHandler) as server:
+        print(f"DEBUG: Inference worker listening on {host}:{port}")
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Persistent ECG classification worker')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Serve on a local TCP port instead of stdin/stdout')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--max-batch-size', type=int, default=8,
+                        help='Largest number of images classified in one forward pass')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0,
+                        help='How long the first request of a batch waits for company')
+    parser.add_argument('--engine', choices=ENGINES, default=INFERENCE_ENGINE,
+                        help='torch, or onnx for the onnxruntime engine (default from ECG_INFERENCE_ENGINE)')
+    parser.add_argument('--cam', choices=('gradcam', 'smoothgradcampp', 'none'), default=None,
+                        help="Default overlay method for requests that do not choose one "
+                             "(smoothgradcampp with torch, gradcam with onnx)")
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH)
+    parser.add_argument('--cache-size', type=int, default=5000, help='Maximum number of cached results')
+    parser.add_argument('--no-cache', action='store_true', help='Always recompute, bypassing the result cache')
+    parser.add_argument('--optimize', default='fp32',
+                        choices=('fp32', 'channels_last', 'dynamic_int8', 'static_int8', 'jit', 'compile'),
+                        help='Optimized CPU inference mode for the torch engine (see optimize.py)')
+    parser.add_argument('--calibration-dir', default='callsifi_images',
+                        help='Labeled images used to calibrate and parity-check the optimized model')
+    args = parser.parse_args()
+
+    engine = load_engine(args.engine)
+    if args.optimize != 'fp32' and args.engine != 'torch':
+        parser.error('--optimize is only available with the torch engine')
+    cam = args.cam or engine.CAM_METHODS[-1]
+    if cam != 'none' and cam not in engine.CAM_METHODS:
+        parser.error(f"--cam {cam} is not available with the {args.engine} engine")
+
+    # Optimized modes drift slightly from fp32, so they get their own cache entries
+    variant = '' if args.optimize == 'fp32' else args.optimize
+    cache = None if args.no_cache else engine.open_result_cache(args.cache_path, args.cache_size, variant)
+    worker = InferenceWorker(engine, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                             cam=None if cam == 'none' else cam, cache=cache,
+                             optimize=args.optimize, calibration_dir=args.calibration_dir)
+    if args.port is None:
+        serve_stdio(worker)
+    else:
+        serve_socket(worker, args.host, args.port)
@@ -0,0 +1,91 @@
+"""Dynamic micro-batching for the classification worker.
+
+Requests submitted from any thread are queued; a single batching thread
+collects up to `max_batch_size` of them, or whatever arrived within
+`max_wait_ms` of the first one, and hands them to `process_batch` as one
+list. Each caller gets a Future resolved with its own result.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=10.0):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.batch_count = 0
+        self.image_count = 0
+        self.busy_time = 0.0
+        self.started_at = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            start = time.perf_counter()
+            try:
+                results = self.process_batch(items)
+            except Exception:
+                # One bad request must not fail the whole batch, so retry one by one
+                results = []
+                for item in items:
+                    try:
+                        results.append(self.process_batch([item])[0])
+                    except Exception as e:
+                        results.append(e)
+            elapsed = time.perf_counter() - start
+
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            with self.stats_lock:
+                self.batch_count += 1
+                self.image_count += len(items)
+                self.busy_time += elapsed
+            for _ in batch:
+                self.queue.task_done()
+
+    def drain(self):
+        """Block until every submitted request has been answered."""
+        self.queue.join()
+
+    def stats(self):
+        with self.stats_lock:
+            wall_time = time.perf_counter() - self.started_at
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': self.batch_count,
+                'images': self.image_count,
+                'mean_batch_size': self.image_count / self.batch_count if self.batch_count else 0.0,
+                'images_per_sec_busy': self.image_count / self.busy_time if self.busy_time else 0.0,
+                'images_per_sec_wall': self.image_count / wall_time if wall_time else 0.0,
+            }
@@ -2,49 +2,43 @@ import os
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torchvision import transforms, models
-from torch.utils.data import DataLoader, random_split
-from PIL import Image
+from torch.utils.data import Subset
 import matplotlib.pyplot as plt
-from torchcam.methods import SmoothGradCAMpp
-from torchcam.utils import overlay_mask
-import numpy as np
 import json
-import sys
-from torchvision.datasets import DatasetFolder, ImageFolder
-from torchvision.datasets.folder import default_loader
-from torchvision.models import ResNet18_Weights
+import argparse
+from torchvision.datasets import ImageFolder
 from torch.utils.data import Dataset
+# Classification lives in the slim inference module; re-exported here for the training code and older callers
+from inference import (CAM_METHODS, build_model, class_names, classify_image, classify_images, load_model,
+                       model_save_path, open_result_cache, save_weights)
+from preprocessing import (PairedTransform, build_eval_transform, build_train_transform, build_uint8_transform,
+                           load_image)
+from ecg_features import extract_feature_batch
+from telemetry import LOG_LEVELS, MetricsWriter, configure_logging, logger, should_log_batch
+from checkpointing import CheckpointWriter, latest_checkpoint, load_checkpoint, restore_rng_state, snapshot
+from precision import PRECISIONS, autocast, resolve_precision
+from data_loading import (BatchAugment, LoaderTimer, add_loader_arguments, loader_options_from_args, make_loader,
+                          normalize_batch)
+from data_split import DEFAULT_SPLIT_PATH, relative_paths, split_indices
+from pseudo_labels import PseudoLabeledDataset, pseudo_label_selection
+from training_control import MONITORS, SCHEDULES, TrainingController, deadline_from_minutes
+from profiling import DISABLED, add_profile_arguments, configure_from_args, profiled
+from distributed import (all_reduce, barrier, broadcast_object, cleanup, get_world_size, gradient_sync,
+                         init_distributed, is_main_process, make_distributed_loader, reduce_timing, set_epoch, unwrap,
+                         wrap_model)
 
 # Path definitions
 data_dir = 'callsifi_images'  # path to classified images
 unlabeled_dir = 'unlabeled_images'  # path to unclassified images
-model_save_path = 'ecg_classifier_model.pth'  # path to trained model
-class_names = ['Avrste', 'DeWinters', 'Hyperacute', 'LossOfBalance', 'TInversion', 'Wellens', 'LOW RISK', 'Anterior',
-               'Inferior', 'Lateral', 'Septal']
 
 # Check for GPU availability
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 print(f'Device in use: {device}')
 
-# Define data transformations
+# Define data transformations (shared with inference through preprocessing.py)
 data_transforms = {
-    'train': transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.RandomHorizontalFlip(),
-        transforms.RandomRotation(15),
-        transforms.ColorJitter(brightness=0.3, contrast=0.3,
-                               saturation=0.3, hue=0.2),
-        transforms.RandomAffine(degrees=0, shear=10, scale=(0.8, 1.2)),
-        transforms.RandomPerspective(distortion_scale=0.2, p=0.5),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ]),
-    'val': transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ]),
+    'train': build_train_transform(),
+    'val': build_eval_transform(),
 }
 
 # Classification feature definitions
@@ -62,12 +56,24 @@ classification_features = {
     "Septal": {"st_elevation": True, "leads": ["V1", "V2"]}
 }
 
+# Every feature some class requires, and the class -> required-feature table as a boolean
+# (num_classes, num_features) mask, so the feature penalty is one tensor operation per batch
+feature_names = sorted({name for features in classification_features.values()
+                        for name, required in features.items() if required})
+required_feature_mask = torch.tensor([[bool(classification_features.get(class_name, {}).get(name))
+                                       for name in feature_names] for class_name in class_names])
+missing_feature_penalty = 0.5
+# Lead groups behind the 'leads' / 'specific_leads' features, taken from the class definitions
+territory_leads = [features['leads'] for features in classification_features.values() if 'leads' in features]
+specific_leads = classification_features['Wellens']['specific_leads']
+_required_feature_masks = {}
+
 # Function to ensure the GRAPH directory exists
 def ensure_graph_dir():
     graph_dir = 'GRAPH'
     if not os.path.exists(graph_dir):
         os.makedirs(graph_dir)
-        print(f"DEBUG: Created directory {graph_dir} for saving graphs.")
+        logger.debug(f"Created directory {graph_dir} for saving graphs.")
     return graph_dir
 
 # Custom dataset for unlabeled images
@@ -82,113 +88,161 @@ class UnlabeledDataset(Dataset):
 
     def __getitem__(self, index):
         path = self.samples[index]
-        sample = default_loader(path)
+        sample = load_image(path)
         if self.transform is not None:
             sample = self.transform(sample)
         return sample, -1  # Return -1 as a placeholder label for unlabeled data
 
-# Custom loss function with feature-based penalty
+# Per-image feature dicts -> boolean (batch, num_features) tensor
+def features_to_tensor(features, device=None):
+    return torch.tensor([[bool(image_features.get(name)) for name in feature_names] for image_features in features],
+                        dtype=torch.bool, device=device).view(len(features), len(feature_names))
+
+# Custom loss function with feature-based penalty: for every class, the number of features it requires that the
+# image lacks, weighted by the predicted probability of that class and by 0.5, averaged over the batch. Predicting a
+# class whose features are missing costs loss, and the softmax weighting gives the penalty a gradient.
+# `features` is a boolean (batch, num_features) tensor or a list of feature dicts
 def custom_loss(outputs, labels, features):
     base_loss = nn.CrossEntropyLoss()(outputs, labels)
-    penalty = 0.0
 
     if features is None or len(features) != len(labels):
-        print("\033[91mDEBUG: Features list is missing or length mismatch. Returning base loss only.\033[0m")
+        logger.warning("Features list is missing or length mismatch. Returning base loss only.")
         return base_loss
 
-    for i, label in enumerate(labels):
-        class_name = class_names[label.item()]
-        required_features = classification_features.get(class_name, {})
-
-        print(f"DEBUG: Required features for {class_name}: {required_features}")
-        print(f"DEBUG: Provided features: {features[i]}")
-
-        # Feature check for required features
-        for feature_name in required_features:
-            if required_features.get(feature_name) and not features[i].get(feature_name):
-                print(f"DEBUG: Missing feature '{feature_name}'")
-                penalty += 0.5
-
-    print(f"DEBUG: Computed custom loss - Base: {base_loss.item():.4f}, Penalty: {penalty:.4f}")
-    return base_loss + penalty
-
-# Extract ECG-specific features (dummy example function)
-def extract_features(image):
-    # Replace with actual feature extraction logic
-    features = {
-        "t_wave_high": True,  # Dummy values
-        "st_depression": True
-    }
-
-    # Debugging output to check feature extraction
-    print(f"DEBUG: Extracted features: {features}")
-    return features
-
-
-# Train on unlabeled ECG images to learn general patterns
-def train_on_unlabeled_ecg(model, unlabeled_loader, optimizer, criterion, num_epochs=50, max_images=10000):
+    device = outputs.device
+    if not torch.is_tensor(features):
+        features = features_to_tensor(features, device)
+    if device not in _required_feature_masks:
+        _required_feature_masks[device] = required_feature_mask.to(device=device, dtype=torch.float32)
+    # (batch, num_classes) count of each class's required features that the image lacks
+    missing = (~features.to(device=device, dtype=torch.bool)).float() @ _required_feature_masks[device].T
+    probabilities = torch.softmax(outputs.float(), dim=1)
+    penalty = (probabilities * missing).sum(dim=1).mean() * missing_feature_penalty
+    return base_loss + penalty.to(base_loss.dtype)
+
+# Extract ECG-specific features of a whole normalized batch, on its device (see ecg_features.py)
+def extract_features(inputs):
+    return extract_feature_batch(inputs, feature_names, lead_groups=territory_leads, specific_leads=specific_leads)
+
+
+# Loss sum, a count (correct predictions, low-loss batches) and the image count of an epoch phase, summed over ranks
+def reduce_totals(running_loss, running_count, image_count):
+    totals = all_reduce(torch.stack([running_loss.double(), running_count.double(),
+                                     torch.tensor(image_count, dtype=torch.float64, device=running_loss.device)]))
+    return totals[0].item(), int(totals[1].item()), max(1, int(totals[2].item()))
+
+# Train on the confidently pseudo-labeled unlabeled ECG images (see pseudo_labels.py); the loader yields
+# (images, pseudo labels). batch_transform, when given, augments/normalizes each uint8 batch on the device (see data_loading.py);
+# precision='bf16' runs forward and loss under autocast, accumulation_steps batches make one optimizer step.
+# With a CheckpointWriter every epoch is checkpointed; `resume` is a checkpoint of this stage to continue from.
+# Under torchrun (see distributed.py) `model` is the DDP replica, max_images is split between the ranks and the
+# epoch loss and early-stopping counts are summed over all of them, so every rank stops at the same epoch.
+# A TrainingController (see training_control.py) schedules the learning rate on the training loss and can stop
+# on a plateau or the time budget; the default one only records why the stage ended
+# With profiling on (profiling.py) every batch is one profiler step
+@profiled('train_on_unlabeled_ecg')
+def train_on_unlabeled_ecg(model, unlabeled_loader, optimizer, criterion, num_epochs=50, max_images=10000,
+                           batch_transform=None, metrics=None, log_every=5, precision='fp32', accumulation_steps=1,
+                           checkpoints=None, resume=None, controller=None, profiler=DISABLED):
+    metrics = metrics if metrics is not None else MetricsWriter()
+    controller = controller if controller is not None else TrainingController(optimizer, num_epochs, monitor='loss')
+    precision = resolve_precision(device, precision)
     model.train()
-    print("DEBUG: Starting training on unlabeled data.")
-    loss_history = []  # To store loss values for plotting
-    print_interval = 5  # Print progress every 5 batches
+    logger.debug("Starting training on pseudo-labeled data.")
+    loss_history = list(resume['loss_history']) if resume else []  # To store loss values for plotting
 
     # Early stopping variables
-    consecutive_low_loss_epochs = 0  # Count epochs with low loss
+    consecutive_low_loss_epochs = resume['consecutive_low_loss_epochs'] if resume else 0  # Count epochs with low loss
     low_loss_threshold = 0.1  # Loss threshold to trigger early stopping
     low_loss_epochs_to_stop = 3  # Number of consecutive low-loss epochs to stop training
-
-    for epoch in range(num_epochs):
-        running_loss = 0.0
+    start_epoch = resume['epoch'] if resume else 0
+    if consecutive_low_loss_epochs >= low_loss_epochs_to_stop:
+        controller.stop('converged')  # The checkpointed run had already stopped early
+
+    world_size = get_world_size()
+    rank_max_images = -(-max_images // world_size)
+    last_epoch = start_epoch
+    for epoch in range(start_epoch, num_epochs):
+        # Every rank follows rank 0's decision, so none waits in an all-reduce the others skipped
+        if not broadcast_object(controller.begin_epoch()):
+            break
+        set_epoch(unlabeled_loader, epoch)
+        # Accumulated on the device; read once per epoch instead of syncing on every batch
+        running_loss = torch.zeros((), device=device)
+        batch_low_loss_count = torch.zeros((), dtype=torch.long, device=device)  # Low-loss batches this epoch
         image_count = 0
-        batch_low_loss_count = 0  # Track low-loss batches within the epoch
-        print(f"\nDEBUG: Starting Epoch [{epoch + 1}/{num_epochs}]")
+        logger.debug(f"Starting Epoch [{epoch + 1}/{num_epochs}]")
 
         # Iterate through unlabeled data
-        for batch_idx, (inputs, _) in enumerate(unlabeled_loader):
-            if image_count >= max_images:
-                print(f"DEBUG: Reached maximum of {max_images} images for this epoch.")
+        optimizer.zero_grad()
+        timed_loader = LoaderTimer(unlabeled_loader, device)
+        for batch_idx, (inputs, labels) in enumerate(timed_loader):
+            if image_count >= rank_max_images:
+                logger.debug(f"Reached maximum of {max_images} images for this epoch.")
                 break
 
-            inputs = inputs.to(device)
-            optimizer.zero_grad()
-
-            # Forward pass
-            outputs = model(inputs)
-            # Compute loss
-            loss = criterion(outputs, torch.ones(outputs.size(0)).long().to(device))
-            # Backward pass and optimization
-            loss.backward()
-            optimizer.step()
-
-            running_loss += loss.item() * inputs.size(0)
+            inputs = inputs.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
+            if batch_transform is not None:
+                inputs = batch_transform(inputs)
+
+            step = (batch_idx + 1) % accumulation_steps == 0 or batch_idx + 1 == len(unlabeled_loader)
+            with gradient_sync(model, step):
+                with autocast(device, precision):
+                    # Forward pass
+                    outputs = model(inputs)
+                    # Compute loss
+                    loss = criterion(outputs, labels)
+                # Backward pass; the optimizer steps once every accumulation_steps batches
+                (loss / accumulation_steps).backward()
+            if step:
+                optimizer.step()
+                optimizer.zero_grad()
+
+            running_loss += loss.detach() * inputs.size(0)
             image_count += inputs.size(0)
 
             # Check if this batch loss is below threshold
-            if loss.item() < low_loss_threshold:
-                batch_low_loss_count += 1
+            batch_low_loss_count += loss.detach() < low_loss_threshold
+            profiler.step()
 
-            # Add debug output for every print interval
-            if (batch_idx + 1) % print_interval == 0 or (batch_idx + 1) == len(unlabeled_loader):
-                print(f"DEBUG: Epoch [{epoch + 1}/{num_epochs}], Batch [{batch_idx + 1}/{len(unlabeled_loader)}], "
-                      f"Loss: {loss.item():.4f}, Accumulated Loss: {running_loss / image_count:.4f}")
+            if should_log_batch(batch_idx, len(unlabeled_loader), log_every):
+                logger.debug(f"Epoch [{epoch + 1}/{num_epochs}], Batch [{batch_idx + 1}/{len(unlabeled_loader)}], "
+                             f"Loss: {loss.item():.4f}, Accumulated Loss: {running_loss.item() / image_count:.4f}")
 
-        # Average loss per epoch
+        # Average loss per epoch, over the images of all ranks
+        running_loss, batch_low_loss_count, image_count = reduce_totals(running_loss, batch_low_loss_count,
+                                                                        image_count)
         epoch_loss = running_loss / min(image_count, max_images)
         loss_history.append(epoch_loss)
-        print(f'Epoch [{epoch + 1}/{num_epochs}], Unlabeled Loss: {epoch_loss:.4f}')
-        print("DEBUG: End of Epoch.")
+        metrics.epoch('unlabeled', epoch + 1, reduce_timing(timed_loader.summary()), image_count, epoch_loss,
+                      lr=controller.lr())
+        last_epoch = epoch + 1
+        controller.end_epoch({'loss': epoch_loss})
 
         # Check if the number of low-loss batches exceeds 80% of the epoch’s batches
-        if batch_low_loss_count >= 0.8 * len(unlabeled_loader):
+        if batch_low_loss_count >= 0.8 * len(unlabeled_loader) * world_size:
             consecutive_low_loss_epochs += 1
-            print(f"DEBUG: Low-loss batches detected. Consecutive low-loss epochs: {consecutive_low_loss_epochs}")
-            if consecutive_low_loss_epochs >= low_loss_epochs_to_stop:
-                print(f"DEBUG: Loss has been below {low_loss_threshold} for {low_loss_epochs_to_stop} consecutive epochs. Stopping early.")
-                break
+            logger.debug(f"Low-loss batches detected. Consecutive low-loss epochs: {consecutive_low_loss_epochs}")
         else:
             consecutive_low_loss_epochs = 0  # Reset if loss goes above threshold for significant batches
 
-    print("DEBUG: Training on unlabeled data complete.")
+        if consecutive_low_loss_epochs >= low_loss_epochs_to_stop:
+            logger.info(f"Loss has been below {low_loss_threshold} for {low_loss_epochs_to_stop} consecutive epochs. Stopping early.")
+            controller.stop('converged')
+        controller.stop_reason = broadcast_object(controller.stop_reason)
+
+        if checkpoints is not None:
+            checkpoints.save_epoch('unlabeled', epoch + 1, unwrap(model), optimizer, loss_history=loss_history,
+                                   consecutive_low_loss_epochs=consecutive_low_loss_epochs,
+                                   controller=controller.state_dict())
+        if controller.stop_reason is not None:
+            break
+
+    metrics.stop('unlabeled', last_epoch, controller.finish())
+    logger.debug("Training on unlabeled data complete.")
+    if not is_main_process():
+        return model
 
     # Plotting the loss history
     graph_dir = ensure_graph_dir()
@@ -204,96 +258,162 @@ def train_on_unlabeled_ecg(model, unlabeled_loader, optimizer, criterion, num_ep
     # Save the plot
     loss_plot_path = os.path.join(graph_dir, 'unlabeled_loss_plot.png')
     plt.savefig(loss_plot_path)
-    print(f"Loss plot saved at {loss_plot_path}")
+    logger.info(f"Loss plot saved at {loss_plot_path}")
 
     return model
 
-def train_model(model, optimizer, num_epochs=20):
-    best_acc = 0.0
-    best_model_wts = model.state_dict()
-    train_loss_history = []
-    val_loss_history = []
-    print_interval = 10  # Adjust this value as needed
-
-    for epoch in range(num_epochs):
-        print(f'\nEpoch {epoch + 1}/{num_epochs}')
-        print('-' * 10)
+# Loaders default to the module-level ones set up in __main__; train/val_transform apply per batch on the device.
+# The feature penalty always sees un-augmented pixels: the training batch before train_transform (normalized by
+# val_transform), or the clean view when the dataset yields (augmented, clean) pairs (preprocessing.PairedTransform).
+# precision='bf16' runs forward and loss under autocast, accumulation_steps batches make one optimizer step.
+# With a CheckpointWriter every epoch is checkpointed (with `split`, the dataset indices, to resume on the same
+# split) and best_model.pth is written on improvement; `resume` is a labeled-stage checkpoint to continue from.
+# Under torchrun the loaders hold each rank's DistributedSampler shard and losses, correct predictions and image
+# counts are summed over all ranks, so every rank sees the same accuracy and keeps the same best weights.
+# A TrainingController schedules the learning rate and stops early on the validation loss or accuracy, or when
+# the time budget runs out; the default one runs all num_epochs and only records the stop reason.
+# With profiling on (profiling.py) every training batch is one profiler step
+@profiled('train_model')
+def train_model(model, optimizer, num_epochs=20, train_loader=None, val_loader=None, train_transform=None,
+                val_transform=None, metrics=None, log_every=10, precision='fp32', accumulation_steps=1,
+                checkpoints=None, split=None, resume=None, controller=None, profiler=DISABLED):
+    train_loader = train_loader if train_loader is not None else globals()['train_loader']
+    val_loader = val_loader if val_loader is not None else globals()['val_loader']
+    metrics = metrics if metrics is not None else MetricsWriter()
+    controller = controller if controller is not None else TrainingController(optimizer, num_epochs)
+    precision = resolve_precision(device, precision)
+    if resume:
+        best_acc = resume['best_acc']
+        best_model_wts = resume['best_model_wts']
+        train_loss_history = list(resume['train_loss_history'])
+        val_loss_history = list(resume['val_loss_history'])
+    else:
+        best_acc = 0.0
+        # A real copy: state_dict() tensors share storage with the parameters that keep training
+        best_model_wts = snapshot(unwrap(model).state_dict())
+        train_loss_history = []
+        val_loss_history = []
+
+    last_epoch = resume['epoch'] if resume else 0
+    for epoch in range(last_epoch, num_epochs):
+        # Every rank follows rank 0's decision, so none waits in an all-reduce the others skipped
+        if not broadcast_object(controller.begin_epoch()):
+            break
+        logger.debug(f"Epoch {epoch + 1}/{num_epochs}")
 
         # Training phase
+        set_epoch(train_loader, epoch)
         model.train()
-        running_loss = 0.0
-        running_corrects = 0
-
-        for batch_idx, (inputs, labels) in enumerate(train_loader):
-            inputs = inputs.to(device)
-            labels = labels.to(device)
+        running_loss = torch.zeros((), device=device)
+        running_corrects = torch.zeros((), dtype=torch.long, device=device)
+        image_count = 0
 
-            # Generate features for the current batch
-            features = [extract_features(img) for img in inputs.cpu()]
+        optimizer.zero_grad()
+        timed_loader = LoaderTimer(train_loader, device)
+        for batch_idx, (inputs, labels) in enumerate(timed_loader):
+            if isinstance(inputs, (list, tuple)):
+                # (augmented, clean) views from a PairedTransform dataset
+                inputs, clean_inputs = (batch.to(device, non_blocking=True) for batch in inputs)
+            else:
+                inputs = clean_inputs = inputs.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
+
+            # Features of the un-augmented images: flips, rotations and hue shifts would break the fixed lead
+            # layout and the dark-ink trace that ecg_features.py relies on
+            features = extract_features(clean_inputs if val_transform is None else val_transform(clean_inputs))
+            if train_transform is not None:
+                inputs = train_transform(inputs)
 
             # Define custom criterion based on features
             criterion = lambda outputs, labels: custom_loss(outputs, labels, features)
 
-            optimizer.zero_grad()
-            outputs = model(inputs)
+            # Gradients of accumulation_steps batches add up to one step over the effective batch
+            step = (batch_idx + 1) % accumulation_steps == 0 or batch_idx + 1 == len(train_loader)
+            with gradient_sync(model, step):
+                with autocast(device, precision):
+                    outputs = model(inputs)
+                    loss = criterion(outputs, labels)
+                (loss / accumulation_steps).backward()
             _, preds = torch.max(outputs, 1)
-            loss = criterion(outputs, labels)
-
-            loss.backward()
-            optimizer.step()
+            if step:
+                optimizer.step()
+                optimizer.zero_grad()
 
-            running_loss += loss.item() * inputs.size(0)
+            running_loss += loss.detach() * inputs.size(0)
             running_corrects += torch.sum(preds == labels.data)
+            image_count += inputs.size(0)
+            profiler.step()
 
-            # Add debug output here
-            if (batch_idx + 1) % print_interval == 0 or (batch_idx + 1) == len(train_loader):
-                accumulated_loss = running_loss / ((batch_idx + 1) * inputs.size(0))
-                print(f"DEBUG: Epoch [{epoch + 1}/{num_epochs}], Batch [{batch_idx + 1}/{len(train_loader)}], Loss: {loss.item():.4f}, Accumulated Loss: {accumulated_loss:.4f}")
+            if should_log_batch(batch_idx, len(train_loader), log_every):
+                accumulated_loss = running_loss.item() / ((batch_idx + 1) * inputs.size(0))
+                logger.debug(f"Epoch [{epoch + 1}/{num_epochs}], Batch [{batch_idx + 1}/{len(train_loader)}], Loss: {loss.item():.4f}, Accumulated Loss: {accumulated_loss:.4f}")
 
-        epoch_loss = running_loss / len(train_dataset)
+        running_loss, running_corrects, train_size = reduce_totals(running_loss, running_corrects, image_count)
+        epoch_loss = running_loss / train_size
         train_loss_history.append(epoch_loss)
-        epoch_acc = running_corrects.double() / len(train_dataset)
-
-        print(f'Train Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
+        epoch_acc = running_corrects / train_size
+        metrics.epoch('train', epoch + 1, reduce_timing(timed_loader.summary()), train_size, epoch_loss, epoch_acc,
+                      lr=controller.lr())
 
         # Validation phase
         model.eval()
-        val_running_loss = 0.0
-        running_corrects = 0
+        val_running_loss = torch.zeros((), device=device)
+        running_corrects = torch.zeros((), dtype=torch.long, device=device)
+        image_count = 0
 
+        timed_loader = LoaderTimer(val_loader, device)
         with torch.no_grad():
-            for batch_idx, (inputs, labels) in enumerate(val_loader):
-                inputs = inputs.to(device)
-                labels = labels.to(device)
+            for batch_idx, (inputs, labels) in enumerate(timed_loader):
+                inputs = inputs.to(device, non_blocking=True)
+                labels = labels.to(device, non_blocking=True)
+                if val_transform is not None:
+                    inputs = val_transform(inputs)
 
-                features = [extract_features(img) for img in inputs.cpu()]
+                features = extract_features(inputs)
                 criterion = lambda outputs, labels: custom_loss(outputs, labels, features)
 
-                outputs = model(inputs)
+                with autocast(device, precision):
+                    outputs = model(inputs)
+                    loss = criterion(outputs, labels)
                 _, preds = torch.max(outputs, 1)
-                loss = criterion(outputs, labels)
 
-                val_running_loss += loss.item() * inputs.size(0)
+                val_running_loss += loss * inputs.size(0)
                 running_corrects += torch.sum(preds == labels.data)
+                image_count += inputs.size(0)
 
-                # Add debug output here
-                if (batch_idx + 1) % print_interval == 0 or (batch_idx + 1) == len(val_loader):
-                    print(f"DEBUG: Validation Epoch [{epoch + 1}/{num_epochs}], Batch [{batch_idx + 1}/{len(val_loader)}], Loss: {loss.item():.4f}")
+                if should_log_batch(batch_idx, len(val_loader), log_every):
+                    logger.debug(f"Validation Epoch [{epoch + 1}/{num_epochs}], Batch [{batch_idx + 1}/{len(val_loader)}], Loss: {loss.item():.4f}")
 
-        epoch_val_loss = val_running_loss / len(val_dataset)
+        val_running_loss, running_corrects, val_size = reduce_totals(val_running_loss, running_corrects, image_count)
+        epoch_val_loss = val_running_loss / val_size
         val_loss_history.append(epoch_val_loss)
-        epoch_acc = running_corrects.double() / len(val_dataset)
-
-        print(f'Val Loss: {epoch_val_loss:.4f} Acc: {epoch_acc:.4f}')
+        epoch_acc = running_corrects / val_size
+        metrics.epoch('val', epoch + 1, reduce_timing(timed_loader.summary()), val_size, epoch_val_loss, epoch_acc,
+                      lr=controller.lr())
+        last_epoch = epoch + 1
+        controller.end_epoch({'val_loss': epoch_val_loss, 'val_accuracy': epoch_acc})
+        controller.stop_reason = broadcast_object(controller.stop_reason)
 
         # Save best model
         if epoch_acc > best_acc:
             best_acc = epoch_acc
-            best_model_wts = model.state_dict().copy()
-            print(f"DEBUG: New best model with accuracy {best_acc:.4f} found, saving weights")
-
-    print(f'\nBest Validation Accuracy: {best_acc:.4f}')
-    model.load_state_dict(best_model_wts)
+            best_model_wts = snapshot(unwrap(model).state_dict())
+            logger.debug(f"New best model with accuracy {best_acc:.4f} found, saving weights")
+            if checkpoints is not None:
+                checkpoints.save_best(best_model_wts)
+
+        if checkpoints is not None:
+            checkpoints.save_epoch('labeled', epoch + 1, unwrap(model), optimizer, split, best_acc=best_acc,
+                                   best_model_wts=best_model_wts, train_loss_history=train_loss_history,
+                                   val_loss_history=val_loss_history, controller=controller.state_dict())
+        if controller.stop_reason is not None:
+            break
+
+    metrics.stop('labeled', last_epoch, controller.finish(), best_val_accuracy=best_acc)
+    logger.info(f"Best Validation Accuracy: {best_acc:.4f}")
+    unwrap(model).load_state_dict(best_model_wts)
+    if not is_main_process():
+        return model
 
     # Save training and validation loss graphs
     graph_dir = ensure_graph_dir()
@@ -310,140 +430,243 @@ def train_model(model, optimizer, num_epochs=20):
     # Save the plot
     loss_plot_path = os.path.join(graph_dir, 'labeled_loss_plot.png')
     plt.savefig(loss_plot_path)
-    print(f"Loss plot saved at {loss_plot_path}")
-
-    return model
+    logger.info(f"Loss plot saved at {loss_plot_path}")
 
-# Load model
-def load_model():
-    print("DEBUG: Loading model...")
-    model = models.resnet18(weights=ResNet18_Weights.DEFAULT)
-    num_ftrs = model.fc.in_features
-    model.fc = nn.Sequential(
-        nn.Dropout(0.5),
-        nn.Linear(num_ftrs, len(class_names))
-    )
-    if os.path.exists(model_save_path):
-        model.load_state_dict(torch.load(model_save_path, map_location=device, weights_only=True))
-        print("DEBUG: Model loaded from saved state.")
-    model = model.to(device)
-    print("DEBUG: Model is ready.")
     return model
 
-# Classify image and return results
-def classify_image(image_path):
-    model = load_model()
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    image = Image.open(image_path).convert('RGB')
-    input_tensor = transform(image).unsqueeze(0).to(device)
-
-    model.eval()
-    with torch.no_grad():
-        outputs = model(input_tensor)
-        probabilities = nn.functional.softmax(outputs, dim=1)
-        confidence, preds = torch.max(probabilities, 1)
-        predicted_class = class_names[preds[0].item()]
-        confidence_percent = confidence[0].item() * 100
-
-    # Creating Grad-CAM with layer2
-    cam_extractor = SmoothGradCAMpp(model, target_layer='layer4')
-    _ = model(input_tensor)
-    cams = cam_extractor(class_idx=preds[0].item(), scores=outputs)
-    activation_map = cams[0].cpu().numpy()
-
-    if len(activation_map.shape) == 3:
-        activation_map = np.mean(activation_map, axis=0)
-
-    # Normalize and threshold the heatmap
-    activation_map = (activation_map - activation_map.min()) / (activation_map.max() - activation_map.min())
-    activation_map = np.where(activation_map > 0.5, activation_map, 0)
-
-    result = overlay_mask(image, Image.fromarray(np.uint8(activation_map * 255), mode='L'), alpha=0.7)
-
-    # Save Grad-CAM and color bar images
-    graph_path = image_path.replace('uploads', 'graphs').replace('.jpg', '_graph.png')
-    heatmap_path = image_path.replace('uploads', 'graphs').replace('.jpg', '_heatmap.png')
-
-    # Save Grad-CAM image
-    plt.figure(figsize=(16, 12))
-    plt.imshow(result)
-    plt.axis('off')
-    plt.savefig(graph_path, bbox_inches='tight')
-
-    # Save heatmap legend
-    plt.figure(figsize=(6, 1))
-    plt.imshow(np.linspace(0, 1, 256).reshape(1, 256), cmap='jet', aspect='auto')
-    plt.gca().set_yticks([])
-    plt.gca().set_xticks([0, 128, 255])
-    plt.gca().set_xticklabels(['Low', 'Medium', 'High'])
-    plt.title("Heatmap Legend", fontsize=8)
-    plt.savefig(heatmap_path)
-
-    # Return classification details
-    return {
-        'classification': predicted_class,
-        'confidence': f'{confidence_percent:.2f}%',
-        'graphUrl': graph_path
-    }
-
 if __name__ == '__main__':
-    if len(sys.argv) >= 2:
-        image_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Classify an ECG image, or train the model when no image is given')
+    parser.add_argument('image_path', nargs='?', default=None)
+    parser.add_argument('--cam', choices=CAM_METHODS + ('none',), default='smoothgradcampp',
+                        help="Overlay method; 'none' returns the classification only")
+    parser.add_argument('--no-cache', action='store_true', help='Always recompute, bypassing the result cache')
+    parser.add_argument('--dataset-cache', default=None, metavar='DIR',
+                        help='Train from pre-decoded memory-mapped shards in DIR (built or updated on start)')
+    add_loader_arguments(parser)
+    parser.add_argument('--lr', type=float, default=0.001, help='Adam learning rate (of the head with --head-only)')
+    parser.add_argument('--batch-size', type=int, default=None, help='Default 16, or 64 with --head-only')
+    parser.add_argument('--epochs', type=int, default=None,
+                        help='Epochs of labeled training (default 20), or of the head with --head-only (default 200)')
+    parser.add_argument('--unlabeled-epochs', type=int, default=20, help='Epochs of unlabeled pretraining (0 skips it)')
+    parser.add_argument('--max-unlabeled-images', type=int, default=100,
+                        help='Unlabeled images per pretraining epoch')
+    parser.add_argument('--pseudo-label-threshold', type=float, default=0.9,
+                        help='Minimum confidence for an unlabeled image to be trained on (see pseudo_labels.py)')
+    parser.add_argument('--pseudo-label-balance', type=float, default=2.0,
+                        help='Cap every pseudo class at N x the images of the rarest one')
+    parser.add_argument('--rescore-pseudo-labels', action='store_true',
+                        help='Score every unlabeled image again, ignoring the pseudo-label cache '
+                             '(cached labels are already tied to the weights that scored them)')
+    parser.add_argument('--split-path', default=DEFAULT_SPLIT_PATH,
+                        help='Persisted train/val/test split of the labeled images (see data_split.py)')
+    parser.add_argument('--schedule', choices=SCHEDULES, default='none',
+                        help='Learning-rate schedule: plateau (ReduceLROnPlateau) or cosine (see training_control.py)')
+    parser.add_argument('--monitor', choices=MONITORS[:2], default='val_loss',
+                        help='Validation metric for the plateau schedule and early stopping')
+    parser.add_argument('--patience', type=int, default=None,
+                        help='Stop after N epochs without improvement (default: run every epoch)')
+    parser.add_argument('--min-delta', type=float, default=0.0, help='Smallest change that counts as improvement')
+    parser.add_argument('--time-budget', type=float, default=None, metavar='MINUTES',
+                        help='Wall-clock budget of this run; no epoch is started that would overrun it')
+    parser.add_argument('--precision', choices=PRECISIONS, default='fp32',
+                        help='bf16 runs forward passes under bfloat16 autocast (see precision.py)')
+    parser.add_argument('--accumulation-steps', type=int, default=1,
+                        help='Batches per optimizer step; the effective batch is --batch-size x N')
+    parser.add_argument('--head-only', action='store_true',
+                        help='Only retrain the classifier head on cached backbone embeddings (see head_finetune.py); '
+                             'honours --epochs, --lr and --batch-size')
+    parser.add_argument('--checkpoint-dir', default='checkpoints', help='Per-epoch checkpoints and best_model.pth')
+    parser.add_argument('--keep-checkpoints', type=int, default=3, help='Number of epoch checkpoints to keep (>= 1)')
+    parser.add_argument('--resume', nargs='?', const='latest', default=None, metavar='CHECKPOINT',
+                        help='Continue from a checkpoint (default: the newest in --checkpoint-dir)')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default=None,
+                        help='Console log level for training (default ECG_LOG_LEVEL or info)')
+    parser.add_argument('--log-every', type=int, default=10, help='Log every Nth batch at debug level')
+    add_profile_arguments(parser)
+    parser.add_argument('--metrics-path', default='training_metrics.jsonl',
+                        help="Per-epoch JSON-lines metrics file, appended to on every run ('' to disable)")
+    args = parser.parse_args()
+    configure_from_args(args)
+    # Head-only training on cached embeddings is cheap per epoch, so it gets more and larger batches by default
+    if args.epochs is None:
+        args.epochs = 200 if args.head_only else 20
+    if args.batch_size is None:
+        args.batch_size = 64 if args.head_only else 16
+
+    if args.image_path:
+        image_path = args.image_path
         print("DEBUG: Image path provided, running classification.")
-        result = classify_image(image_path)
+        cache = None if args.no_cache else open_result_cache()
+        result = classify_image(image_path, cam=None if args.cam == 'none' else args.cam, cache=cache)
         print("DEBUG: Classification complete. Result:")
         print(json.dumps(result))
     else:
-        print("No image provided. Starting model training...")
+        # Under torchrun this process is one rank of a DDP run; only rank 0 logs progress and writes files
+        rank, world_size = init_distributed()
+        configure_logging(args.log_level if rank == 0 else 'warning')
+        if args.head_only:
+            if world_size > 1:
+                parser.error('--head-only runs in a single process; start it without torchrun')
+            from head_finetune import fine_tune_head
+            logger.info("No image provided. Retraining the classifier head...")
+            model, _ = fine_tune_head(load_model(), data_dir, epochs=args.epochs, batch_size=args.batch_size,
+                                      lr=args.lr, split_path=args.split_path)
+            save_weights(model.state_dict(), model_save_path)
+            logger.info(f"Model saved at {model_save_path}")
+            raise SystemExit(0)
+        logger.info("No image provided. Starting model training...")
+        deadline = deadline_from_minutes(args.time_budget)
+        if args.keep_checkpoints < 1:
+            parser.error('--keep-checkpoints must be at least 1')
+
+        resume = None
+        if args.resume:
+            resume_path = latest_checkpoint(args.checkpoint_dir) if args.resume == 'latest' else args.resume
+            if resume_path is None:
+                raise FileNotFoundError(f"No checkpoint to resume from in {args.checkpoint_dir}")
+            resume = load_checkpoint(resume_path)
+            logger.info(f"Resuming from {resume_path} ({resume['stage']} stage, epoch {resume['epoch']})")
+        checkpoints = CheckpointWriter(args.checkpoint_dir, keep_last=args.keep_checkpoints) if rank == 0 else None
 
         # Check if labeled images directory exists
         if not os.path.exists(data_dir):
             raise FileNotFoundError(f"DEBUG: The directory {data_dir} does not exist.")
-        print("DEBUG: Labeled data directory found.")
+        logger.debug("Labeled data directory found.")
 
         # Check if unlabeled images directory exists
         if not os.path.exists(unlabeled_dir):
             raise FileNotFoundError(f"DEBUG: The directory {unlabeled_dir} does not exist.")
-        print("DEBUG: Unlabeled data directory found.")
+        logger.debug("Unlabeled data directory found.")
 
         # Load unlabeled dataset
-        print("DEBUG: Loading unlabeled dataset...")
-        unlabeled_dataset = UnlabeledDataset(root=unlabeled_dir, transform=data_transforms['train'])
-        unlabeled_loader = DataLoader(unlabeled_dataset, batch_size=16, shuffle=True)
-        print(f"DEBUG: Unlabeled dataset loaded with {len(unlabeled_dataset)} samples.")
+        logger.debug("Loading unlabeled dataset...")
+        options = loader_options_from_args(args)
+        # One JSON line per epoch phase, tagged with the settings of this run
+        metrics = MetricsWriter((args.metrics_path or None) if rank == 0 else None, batch_size=args.batch_size,
+                                workers=options['num_workers'], batch_augment=args.batch_augment,
+                                dataset_cache=bool(args.dataset_cache), precision=args.precision,
+                                accumulation_steps=args.accumulation_steps, world_size=world_size)
+        # DistributedSampler shards every epoch between the ranks
+        loader_for = make_distributed_loader if world_size > 1 else make_loader
+        # With --batch-augment the datasets only decode; augmentation runs per batch on the device
+        image_transform = build_uint8_transform() if args.batch_augment else data_transforms['train']
+        train_transform = BatchAugment() if args.batch_augment else None
+        val_transform = normalize_batch if args.batch_augment else None
+        if args.dataset_cache:
+            from dataset_cache import CachedImageDataset, build_cache
+            cached_transform = (build_uint8_transform(resize=False) if args.batch_augment
+                                else build_train_transform(resize=False))
+            unlabeled_cache = os.path.join(args.dataset_cache, os.path.basename(os.path.normpath(unlabeled_dir)))
+            if rank == 0:
+                build_cache(unlabeled_dir, unlabeled_cache, labeled=False)
+            barrier()
+            unlabeled_dataset = CachedImageDataset(unlabeled_cache, transform=cached_transform)
+            unlabeled_paths = [os.path.join(unlabeled_dir, rel_path) for rel_path, _ in unlabeled_dataset.samples]
+        else:
+            unlabeled_dataset = UnlabeledDataset(root=unlabeled_dir, transform=image_transform)
+            unlabeled_paths = unlabeled_dataset.samples
+        logger.debug(f"Unlabeled dataset loaded with {len(unlabeled_dataset)} samples.")
 
         # Load the model
         model = load_model()
-        optimizer = optim.Adam(model.parameters(), lr=0.001)
+        optimizer = optim.Adam(model.parameters(), lr=args.lr)
         criterion = nn.CrossEntropyLoss()
-
-        # Train on unlabeled ECG images
-        print("DEBUG: Starting training on unlabeled ECG data...")
-        model = train_on_unlabeled_ecg(model, unlabeled_loader, optimizer, criterion, num_epochs=20, max_images=100)
-        print("DEBUG: Finished training on unlabeled data.")
+        if resume:
+            model.load_state_dict(resume['model'])
+            optimizer.load_state_dict(resume['optimizer'])
+            restore_rng_state(resume['rng'])
+        # DDP starts every replica from rank 0's weights and averages the gradients of each step
+        model = wrap_model(model)
+
+        # Train on unlabeled ECG images, labeled with the model's own confident predictions
+        selection = []
+        if (resume is None or resume['stage'] == 'unlabeled') and args.unlabeled_epochs > 0:
+            if rank == 0:
+                # The plain model: a DDP forward would wait for the other ranks
+                selection, summary = pseudo_label_selection(
+                    unwrap(model), unlabeled_paths, threshold=args.pseudo_label_threshold,
+                    balance_ratio=args.pseudo_label_balance, rescore=args.rescore_pseudo_labels, device=device)
+                logger.info(f"Pseudo-labels: {summary['selected']} of {summary['images']} unlabeled images selected "
+                            f"({summary['scored']} newly scored, {summary['confident']} above "
+                            f"{args.pseudo_label_threshold}), per class "
+                            f"{ {class_names[label]: count for label, count in sorted(summary['per_class'].items())} }")
+            selection = broadcast_object(selection)
+            if not selection:
+                logger.warning("No unlabeled image is confident enough to pseudo-label; skipping the unlabeled stage.")
+        if selection:
+            logger.debug("Starting training on unlabeled ECG data...")
+            unlabeled_loader = loader_for(PseudoLabeledDataset(unlabeled_dataset, selection),
+                                          batch_size=args.batch_size, shuffle=True, options=options)
+            # No validation set here, so the schedule and patience follow the training loss
+            controller = TrainingController(optimizer, args.unlabeled_epochs, args.schedule, 'loss', args.patience,
+                                            args.min_delta, deadline)
+            if resume and resume.get('controller'):
+                controller.load_state_dict(resume['controller'])
+            model = train_on_unlabeled_ecg(model, unlabeled_loader, optimizer, criterion,
+                                           num_epochs=args.unlabeled_epochs, max_images=args.max_unlabeled_images,
+                                           batch_transform=train_transform, metrics=metrics,
+                                           log_every=args.log_every, precision=args.precision,
+                                           accumulation_steps=args.accumulation_steps, checkpoints=checkpoints,
+                                           resume=resume, controller=controller)
+            logger.debug("Finished training on unlabeled data.")
 
         # Prepare labeled data for training
-        print("DEBUG: Loading labeled dataset for main training...")
-        full_dataset = ImageFolder(root=data_dir, transform=data_transforms['train'])
-        train_size = int(0.7 * len(full_dataset))
-        val_size = int(0.15 * len(full_dataset))
-        test_size = len(full_dataset) - train_size - val_size
-        train_dataset, val_dataset, test_dataset = random_split(full_dataset, [train_size, val_size, test_size])
+        logger.debug("Loading labeled dataset for main training...")
+        # Augmented per image, the training samples also carry the clean eval view for the feature penalty
+        if args.dataset_cache:
+            labeled_cache = os.path.join(args.dataset_cache, os.path.basename(os.path.normpath(data_dir)))
+            if rank == 0:
+                build_cache(data_dir, labeled_cache, labeled=True)
+            barrier()
+            full_dataset = CachedImageDataset(labeled_cache, transform=cached_transform if args.batch_augment else
+                                              PairedTransform(cached_transform, build_eval_transform(resize=False)))
+            # Without a transform the cache returns normalized tensors, i.e. the eval transform
+            eval_dataset = full_dataset if args.batch_augment else CachedImageDataset(labeled_cache)
+        else:
+            full_dataset = ImageFolder(root=data_dir, transform=image_transform if args.batch_augment else
+                                       PairedTransform(image_transform, data_transforms['val']), loader=load_image)
+            eval_dataset = full_dataset if args.batch_augment else ImageFolder(
+                root=data_dir, transform=data_transforms['val'], loader=load_image)
+        labeled_resume = resume if resume is not None and resume['stage'] == 'labeled' else None
+        if labeled_resume:
+            # Same split as the checkpointed run, so validation never sees training images
+            split = labeled_resume['split']
+            if split['size'] != len(full_dataset):
+                raise ValueError(f"{data_dir} has {len(full_dataset)} images, the checkpoint was split over "
+                                 f"{split['size']}; resuming would mix training and validation images")
+        else:
+            # The persisted split (see data_split.py), so the test images stay held out from every run;
+            # rank 0 alone updates the file
+            split = split_indices(relative_paths(full_dataset, data_dir), args.split_path) if rank == 0 else None
+            split = broadcast_object(split)
+        # Validation batches get the eval transform, never the training augmentations
+        train_dataset = Subset(full_dataset, split['train'])
+        val_dataset = Subset(eval_dataset, split['val'])
+        test_dataset = Subset(eval_dataset, split['test'])
+        train_size, val_size, test_size = len(train_dataset), len(val_dataset), len(test_dataset)
 
-        print(f"DEBUG: Labeled dataset split - Train size: {train_size}, Validation size: {val_size}, Test size: {test_size}")
+        logger.debug(f"Labeled dataset split - Train size: {train_size}, Validation size: {val_size}, Test size: {test_size}")
 
-        train_loader = DataLoader(train_dataset, batch_size=16, shuffle=True)
-        val_loader = DataLoader(val_dataset, batch_size=16, shuffle=False)
+        train_loader = loader_for(train_dataset, batch_size=args.batch_size, shuffle=True, options=options)
+        val_loader = loader_for(val_dataset, batch_size=args.batch_size, shuffle=False, options=options)
 
         # Start training on labeled data
-        print("DEBUG: Starting main training with labeled data...")
-        model = train_model(model=model, optimizer=optimizer, num_epochs=20)
-        print("DEBUG: Training complete.")
+        logger.debug("Starting main training with labeled data...")
+        controller = TrainingController(optimizer, args.epochs, args.schedule, args.monitor, args.patience,
+                                        args.min_delta, deadline)
+        if labeled_resume and labeled_resume.get('controller'):
+            controller.load_state_dict(labeled_resume['controller'])
+        model = train_model(model=model, optimizer=optimizer, num_epochs=args.epochs, train_transform=train_transform,
+                            val_transform=val_transform, metrics=metrics, log_every=args.log_every,
+                            precision=args.precision, accumulation_steps=args.accumulation_steps,
+                            checkpoints=checkpoints, split=split, resume=labeled_resume, controller=controller)
+        if checkpoints is not None:
+            checkpoints.close()
+        metrics.close()
+        logger.info("Training complete.")
 
         # Save the trained model
-        torch.save(model.state_dict(), model_save_path)
-        print(f"DEBUG: Model saved at {model_save_path}")
+        if rank == 0:
+            save_weights(unwrap(model).state_dict(), model_save_path)
+            logger.info(f"Model saved at {model_save_path}")
+        cleanup()
@@ -0,0 +1,90 @@
+"""onnxruntime-backed classification engine.
+
+Same result contract as inference.classify_images, but runs the ONNX export
+(see export_onnx.py) on CPU with onnxruntime, NumPy and PIL only, so a worker
+using it never imports torch. Plain Grad-CAM comes out of the same run; the
+SmoothGrad-CAM++ variant needs autograd and is only offered by the torch
+engine. Select it with ECG_INFERENCE_ENGINE=onnx or the worker's --engine.
+"""
+import numpy as np
+
+from inference_config import ONNX_MODEL_PATH
+from preprocessing import images_to_array, load_image
+from result_cache import DEFAULT_CACHE_PATH, ResultCache, file_sha256, weights_fingerprint
+
+class_names = ['Avrste', 'DeWinters', 'Hyperacute', 'LossOfBalance', 'TInversion', 'Wellens', 'LOW RISK', 'Anterior',
+               'Inferior', 'Lateral', 'Septal']
+
+CAM_METHODS = ('gradcam',)
+
+
+# Load model
+def load_model(model_path=ONNX_MODEL_PATH):
+    import onnxruntime as ort
+
+    print("DEBUG: Loading ONNX model...")
+    session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+    print("DEBUG: Model is ready.")
+    return session
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+# Save the Grad-CAM overlay of one image, drawn on the full-resolution scan
+def save_gradcam(image_path, activation_map):
+    from overlay import write_overlay
+
+    graph_path = image_path.replace('uploads', 'graphs').replace('.jpg', '_graph.png')
+    image = load_image(image_path, draft_size=None)
+    return write_overlay(image, activation_map, graph_path, alpha=0.7, threshold=0.5)
+
+
+# Result cache bound to the ONNX file, so a new export invalidates it
+def open_result_cache(path=DEFAULT_CACHE_PATH, max_entries=5000, variant=''):
+    fingerprint = weights_fingerprint(ONNX_MODEL_PATH) + (f':{variant}' if variant else '')
+    return ResultCache(path, model_fingerprint=fingerprint, max_entries=max_entries,
+                       model_key='onnx' + (f':{variant}' if variant else ''))
+
+
+def classify_images(image_paths, model=None, cam='gradcam', cache=None):
+    if cam not in CAM_METHODS and cam is not None:
+        raise ValueError(f"CAM method '{cam}' is not available with the onnx engine, expected one of "
+                         f"{CAM_METHODS} or None")
+    if cache is not None:
+        image_hashes = [file_sha256(image_path) for image_path in image_paths]
+        results = [cache.get(image_hash, cam) for image_hash in image_hashes]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed = classify_images([image_paths[i] for i in missing], model=model, cam=cam)
+            for i, result in zip(missing, computed):
+                cache.put(image_hashes[i], cam, result)
+                results[i] = result
+        return results
+    if model is None:
+        model = load_model()
+
+    images = [load_image(image_path) for image_path in image_paths]
+    input_batch = images_to_array(images)
+    logits, cams = model.run(None, {'input': input_batch})
+    probabilities = softmax(logits)
+    preds = probabilities.argmax(axis=1)
+
+    results = []
+    for i, image_path in enumerate(image_paths):
+        class_idx = int(preds[i])
+        graph_path = None
+        if cam == 'gradcam':
+            graph_path = save_gradcam(image_path, np.maximum(cams[i, class_idx], 0))
+        results.append({
+            'classification': class_names[class_idx],
+            'confidence': f'{probabilities[i, class_idx] * 100:.2f}%',
+            'graphUrl': graph_path
+        })
+    return results
+
+
+def classify_image(image_path, model=None, cam='gradcam', cache=None):
+    return classify_images([image_path], model=model, cam=cam, cache=cache)[0]
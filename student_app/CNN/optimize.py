@@ -0,0 +1,167 @@
+"""Optimized CPU inference modes for the ECG classifier.
+
+optimize_model returns a separate copy of the fp32 model tuned for CPU
+inference; the fp32 model stays untouched because Grad-CAM needs its hooks
+and gradients. Modes:
+
+    fp32           the model as trained, eager mode
+    channels_last  NHWC memory layout, which the CPU convolution kernels prefer
+    dynamic_int8   dynamic INT8 quantization; for ResNet18 this only covers the
+                   Linear head, since convolutions cannot be quantized dynamically
+    static_int8    FX graph mode INT8 quantization of the whole network,
+                   calibrated on images from callsifi_images
+    jit            TorchScript trace, frozen and optimized for inference
+    compile        torch.compile
+
+Every mode is checked against fp32 with parity_report (top-1 agreement and
+maximum probability drift). Compare all of them with
+
+    python optimize.py --modes fp32 channels_last dynamic_int8 static_int8 jit
+"""
+import argparse
+import copy
+import os
+import time
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+from torchvision.datasets import ImageFolder
+
+from inference import eval_transform, load_model
+from preprocessing import load_image
+
+OPTIMIZATION_MODES = ('fp32', 'channels_last', 'dynamic_int8', 'static_int8', 'jit', 'compile')
+
+
+class ChannelsLast(nn.Module):
+    """Feeds NHWC inputs to a model whose weights were converted to channels_last."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+# First batches of the labeled images, preprocessed exactly like at inference time
+def calibration_batches(data_dir='callsifi_images', num_images=64, batch_size=16):
+    dataset = ImageFolder(root=data_dir, transform=eval_transform, loader=load_image)
+    indices = torch.randperm(len(dataset), generator=torch.Generator().manual_seed(0))[:num_images]
+    loader = DataLoader(Subset(dataset, indices.tolist()), batch_size=batch_size, shuffle=False)
+    return [inputs for inputs, _ in loader]
+
+
+def optimize_model(model, mode, calibration=None):
+    """Return an inference-only copy of `model` in the given mode."""
+    if mode not in OPTIMIZATION_MODES:
+        raise ValueError(f"Unknown optimization mode '{mode}', expected one of {OPTIMIZATION_MODES}")
+    model = copy.deepcopy(model).cpu().eval()
+    example = calibration[0] if calibration else torch.randn(1, 3, 224, 224)
+
+    if mode == 'fp32':
+        return model
+    if mode == 'channels_last':
+        return ChannelsLast(model).eval()
+    if mode == 'dynamic_int8':
+        from torch.ao.quantization import quantize_dynamic
+        return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    if mode == 'static_int8':
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+        if not calibration:
+            raise ValueError("static_int8 needs calibration batches (see calibration_batches)")
+        prepared = prepare_fx(model, get_default_qconfig_mapping('x86'), (example,))
+        with torch.no_grad():
+            for inputs in calibration:
+                prepared(inputs)
+        return convert_fx(prepared)
+    if mode == 'jit':
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+            return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    # compile
+    return torch.compile(model)
+
+
+def parity_report(reference, candidate, batches):
+    """Top-1 agreement and maximum softmax probability drift of `candidate` against `reference`."""
+    agree = 0
+    total = 0
+    max_drift = 0.0
+    with torch.no_grad():
+        for inputs in batches:
+            expected = torch.softmax(reference(inputs).float(), dim=1)
+            actual = torch.softmax(candidate(inputs).float(), dim=1)
+            agree += (expected.argmax(dim=1) == actual.argmax(dim=1)).sum().item()
+            total += inputs.size(0)
+            max_drift = max(max_drift, (expected - actual).abs().max().item())
+    return {'top1_agreement': agree / total if total else 1.0, 'max_prob_drift': max_drift}
+
+
+def measure_latency(model, batch_size, repeats=20, warmup=3):
+    """Median milliseconds per forward pass and images/sec at `batch_size`."""
+    inputs = torch.randn(batch_size, 3, 224, 224)
+    timings = []
+    with torch.no_grad():
+        for i in range(warmup + repeats):
+            start = time.perf_counter()
+            model(inputs)
+            if i >= warmup:
+                timings.append(time.perf_counter() - start)
+    median = sorted(timings)[len(timings) // 2]
+    return {'ms_per_batch': median * 1000, 'images_per_sec': batch_size / median}
+
+
+# Optimized model for the worker, or None when it fails the parity check against fp32
+def prepare_fast_model(model, mode, calibration_dir='callsifi_images', min_agreement=0.98):
+    if mode == 'fp32':
+        return None
+    calibration = calibration_batches(calibration_dir) if os.path.isdir(calibration_dir) else None
+    fast_model = optimize_model(model, mode, calibration)
+    if calibration:
+        # A CPU copy as the reference: the caller's model keeps its device (e.g. cuda for Grad-CAM)
+        report = parity_report(optimize_model(model, 'fp32'), fast_model, calibration)
+        print(f"DEBUG: {mode} parity vs fp32 - top-1 agreement {report['top1_agreement']:.4f}, "
+              f"max probability drift {report['max_prob_drift']:.4f}")
+        if report['top1_agreement'] < min_agreement:
+            print(f"DEBUG: {mode} is below the required agreement of {min_agreement}; using fp32.")
+            return None
+    else:
+        print(f"DEBUG: {calibration_dir} not found, {mode} is used without a parity check.")
+    return fast_model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare optimized CPU inference modes against fp32')
+    parser.add_argument('--modes', nargs='+', choices=OPTIMIZATION_MODES,
+                        default=['fp32', 'channels_last', 'dynamic_int8', 'static_int8', 'jit'])
+    parser.add_argument('--calibration-dir', default='callsifi_images')
+    parser.add_argument('--calibration-images', type=int, default=64)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--threads', type=int, default=None, help='torch.set_num_threads for the measurement')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if os.path.isdir(args.calibration_dir):
+        calibration = calibration_batches(args.calibration_dir, args.calibration_images)
+    else:
+        # Only useful for timing; parity on random inputs says little about real scans
+        print(f"{args.calibration_dir} not found, calibrating and checking parity on random inputs.")
+        calibration = [torch.randn(16, 3, 224, 224) for _ in range(max(1, args.calibration_images // 16))]
+
+    reference = load_model().cpu().eval()
+    header = f"{'mode':<14}{'top-1 agree':>12}{'max drift':>11}"
+    for batch_size in args.batch_sizes:
+        header += f"{f'ms@bs{batch_size}':>11}{f'img/s@bs{batch_size}':>14}"
+    print(header)
+    for mode in args.modes:
+        candidate = optimize_model(reference, mode, calibration)
+        report = parity_report(reference, candidate, calibration)
+        row = f"{mode:<14}{report['top1_agreement']:>12.4f}{report['max_prob_drift']:>11.4f}"
+        for batch_size in args.batch_sizes:
+            latency = measure_latency(candidate, batch_size)
+            row += f"{latency['ms_per_batch']:>11.1f}{latency['images_per_sec']:>14.1f}"
+        print(row)
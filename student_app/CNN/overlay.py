@@ -0,0 +1,92 @@
+"""Grad-CAM overlay writer.
+
+Blends a class activation map onto the original scan with NumPy/PIL and
+writes it straight to disk at the scan's own resolution, so a request does
+not have to build and rasterise a matplotlib figure. The colour legend is a
+static asset (public/heatmap.png); regenerate it once with
+
+    python overlay.py --legend ../public/heatmap.png
+"""
+import argparse
+
+import numpy as np
+from PIL import Image
+
+# matplotlib's 'jet' segment data, so overlays keep the colours of the legend
+_JET_SEGMENTS = {
+    'red': [(0.0, 0.0), (0.35, 0.0), (0.66, 1.0), (0.89, 1.0), (1.0, 0.5)],
+    'green': [(0.0, 0.0), (0.125, 0.0), (0.375, 1.0), (0.64, 1.0), (0.91, 0.0), (1.0, 0.0)],
+    'blue': [(0.0, 0.5), (0.11, 1.0), (0.34, 1.0), (0.65, 0.0), (1.0, 0.0)],
+}
+
+
+def _build_lut(segments):
+    positions = np.linspace(0.0, 1.0, 256)
+    channels = []
+    for name in ('red', 'green', 'blue'):
+        xs, ys = zip(*segments[name])
+        channels.append(np.interp(positions, xs, ys))
+    return np.round(np.stack(channels, axis=1) * 255).astype(np.uint8)
+
+
+JET_LUT = _build_lut(_JET_SEGMENTS)
+
+# Encoder settings per output format; PNG level 3 is much faster than the default 6
+SAVE_OPTIONS = {
+    'PNG': {'compress_level': 3},
+    'WEBP': {'quality': 85, 'method': 4},
+}
+
+
+def normalize_map(activation_map, threshold=None):
+    """Scale a CAM to [0, 1], optionally zeroing everything at or below `threshold`."""
+    activation_map = np.asarray(activation_map, dtype=np.float32)
+    if activation_map.ndim == 3:
+        activation_map = activation_map.mean(axis=0)
+    activation_map = activation_map - activation_map.min()
+    activation_map = activation_map / (activation_map.max() + 1e-8)
+    if threshold is not None:
+        activation_map = np.where(activation_map > threshold, activation_map, 0)
+    return activation_map
+
+
+def blend_overlay(image, activation_map, alpha=0.7, threshold=None):
+    """Return `image` with the jet-coloured CAM blended in; `alpha` is the weight of the image."""
+    image = image.convert('RGB')
+    activation_map = normalize_map(activation_map, threshold)
+    mask = Image.fromarray(np.uint8(activation_map * 255), mode='L')
+    mask = mask.resize(image.size, resample=Image.Resampling.BICUBIC)
+    heat = Image.fromarray(JET_LUT[np.asarray(mask)])
+    return Image.blend(heat, image, alpha)
+
+
+def write_overlay(image, activation_map, output_path, alpha=0.7, threshold=None):
+    """Blend the CAM onto `image` and save it; the format follows the extension (.png or .webp)."""
+    result = blend_overlay(image, activation_map, alpha=alpha, threshold=threshold)
+    image_format = 'WEBP' if output_path.lower().endswith('.webp') else 'PNG'
+    result.save(output_path, format=image_format, **SAVE_OPTIONS[image_format])
+    return output_path
+
+
+def save_legend(output_path):
+    """Render the heatmap colour legend; run once, the result is served as a static file."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(6, 1))
+    plt.imshow(np.linspace(0, 1, 256).reshape(1, 256), cmap='jet', aspect='auto')
+    plt.gca().set_yticks([])
+    plt.gca().set_xticks([0, 128, 255])
+    plt.gca().set_xticklabels(['Low', 'Medium', 'High'])
+    plt.title("Heatmap Legend", fontsize=8)
+    fig.savefig(output_path)
+    plt.close(fig)
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Heatmap overlay utilities')
+    parser.add_argument('--legend', required=True, help='Write the heatmap legend image to this path')
+    args = parser.parse_args()
+    print(f"Legend saved at {save_legend(args.legend)}")
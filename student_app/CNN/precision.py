@@ -0,0 +1,45 @@
+"""Mixed-precision helpers for training.
+
+'bf16' runs the forward pass and loss under torch.autocast with bfloat16.
+The weights, gradients and optimizer state stay fp32, so no loss scaling is
+needed. On CPUs with native bf16 (AVX512-BF16 / AMX) convolutions get much
+faster and activations take half the memory; on other CPUs autocast still
+works, but is emulated and may be slower than fp32. Check with
+benchmarks/bench_precision.py before switching a training box over.
+"""
+import contextlib
+
+import torch
+
+from telemetry import logger
+
+PRECISIONS = ('fp32', 'bf16')
+
+
+def native_bf16(device):
+    """Whether the device has hardware bfloat16 support."""
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    # Private, but the only way to ask; assume emulation when it is missing
+    checks = [getattr(torch.cpu, name, None) for name in ('_is_avx512_bf16_supported', '_is_amx_tile_supported')]
+    return any(check() for check in checks if check is not None)
+
+
+def resolve_precision(device, precision):
+    """The precision to train with: bf16 falls back to fp32 where autocast is not available for the device."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+    if precision == 'bf16':
+        if not torch.amp.is_autocast_available(device.type):
+            logger.warning(f"bf16 autocast is not available on {device.type}; training in fp32.")
+            return 'fp32'
+        if not native_bf16(device):
+            logger.warning(f"{device.type} has no native bf16 support; bf16 autocast will be emulated.")
+    return precision
+
+
+def autocast(device, precision):
+    """Context for the forward pass and loss of one step."""
+    if precision == 'bf16':
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
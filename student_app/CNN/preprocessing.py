@@ -0,0 +1,102 @@
+"""Image preprocessing shared by training and every inference entry point.
+
+Scans are decoded with JPEG draft mode: libjpeg scales the image down by
+1/2, 1/4 or 1/8 while decoding, to the smallest size that is still at least
+224x224, so a large scan is never fully decoded only to be resized. The
+model input is then built for a whole batch at once (one uint8 stack, one
+normalization) instead of per-image ToTensor/Normalize.
+
+Only NumPy and PIL are imported at module level so the onnxruntime engine
+can use this module without torch; the torch helpers import it lazily.
+"""
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZE = 224
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+_MEAN = np.array(MEAN, dtype=np.float32).reshape(1, 3, 1, 1)
+_STD = np.array(STD, dtype=np.float32).reshape(1, 3, 1, 1)
+
+
+def load_image(path, draft_size=IMAGE_SIZE):
+    """Open an image as RGB; JPEGs are decoded at a reduced scale no smaller than `draft_size`.
+
+    Pass draft_size=None for the full-resolution image, e.g. to draw an overlay on it.
+    """
+    image = Image.open(path)
+    if draft_size:
+        image.draft('RGB', (draft_size, draft_size))
+    return image.convert('RGB')
+
+
+def resize_for_model(image):
+    # Same interpolation as transforms.Resize((224, 224)) on a PIL image
+    return image.resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR)
+
+
+def images_to_array(images):
+    """Resize PIL images and return one normalized float32 (batch, 3, 224, 224) array."""
+    pixels = np.stack([np.asarray(resize_for_model(image), dtype=np.uint8) for image in images])
+    batch = pixels.transpose(0, 3, 1, 2).astype(np.float32) * (1.0 / 255.0)
+    return np.ascontiguousarray((batch - _MEAN) / _STD)
+
+
+def images_to_tensor(images):
+    """Torch version of images_to_array, sharing its memory."""
+    import torch
+    return torch.from_numpy(images_to_array(images))
+
+
+def build_eval_transform(resize=True):
+    """Per-image transform for datasets; matches images_to_tensor.
+
+    Pass resize=False for images that are already 224x224 (dataset_cache.py).
+    """
+    from torchvision import transforms
+    return transforms.Compose(([transforms.Resize((IMAGE_SIZE, IMAGE_SIZE))] if resize else []) + [
+        transforms.ToTensor(),
+        transforms.Normalize(mean=MEAN, std=STD)
+    ])
+
+
+def build_train_transform(resize=True):
+    """Training augmentation; resizes first so the augmentations run on 224x224 images.
+
+    Pass resize=False for images that are already 224x224 (dataset_cache.py).
+    """
+    from torchvision import transforms
+    return transforms.Compose(([transforms.Resize((IMAGE_SIZE, IMAGE_SIZE))] if resize else []) + [
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(15),
+        transforms.ColorJitter(brightness=0.3, contrast=0.3,
+                               saturation=0.3, hue=0.2),
+        transforms.RandomAffine(degrees=0, shear=10, scale=(0.8, 1.2)),
+        transforms.RandomPerspective(distortion_scale=0.2, p=0.5),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=MEAN, std=STD)
+    ])
+
+
+class PairedTransform:
+    """Returns (augment(image), clean(image)) of one decoded image.
+
+    Training feeds the augmented view to the model and extracts the ECG
+    features from the clean one; see modelRN.train_model.
+    """
+
+    def __init__(self, augment, clean):
+        self.augment = augment
+        self.clean = clean
+
+    def __call__(self, image):
+        return self.augment(image), self.clean(image)
+
+
+def build_uint8_transform(resize=True):
+    """Decode-only transform for batch augmentation: a uint8 (3, 224, 224) tensor, augmented later per batch."""
+    from torchvision import transforms
+    return transforms.Compose(([transforms.Resize((IMAGE_SIZE, IMAGE_SIZE))] if resize else []) + [
+        transforms.PILToTensor()
+    ])
@@ -0,0 +1,220 @@
+"""Opt-in torch.profiler runs of classification and training.
+
+Profiling is off unless ECG_PROFILE names a run directory (1 means
+./profiles) or a CLI passes --profile:
+
+    ECG_PROFILE=profiles python modelRN.py
+    python modelRN.py --profile profiles --profile-schedule 2 1 5
+    python inference.py scan.jpg --cam gradcam --profile profiles
+    ECG_PROFILE=profiles ECG_PROFILE_SCHEDULE=5,1,10 python inference_worker.py
+
+A profiler step is one training batch of train_model and
+train_on_unlabeled_ecg, and one classify_images call (classify_image
+included) of the process. The schedule (--profile-schedule WAIT WARMUP ACTIVE
+[REPEAT], or ECG_PROFILE_SCHEDULE=wait,warmup,active[,repeat]) skips `wait`
+steps, warms up for `warmup` and records `active`, `repeat` times (0: until the
+run ends). Defaults are 1,1,3,1 for training and 0,0,1,1 (the first call) for
+classification. Every recorded window is written as
+
+    <run dir>/<target>-<time>-<pid>/trace_<n>.json      Chrome trace (chrome://tracing or Perfetto)
+                                     operators_<n>.txt   per-operator CPU time, memory and call counts
+
+A run that ends inside a recording window still writes it. When profiling is
+off, torch.profiler is never imported and each step is a no-op method call.
+"""
+import atexit
+import functools
+import os
+import threading
+import time
+
+from telemetry import logger
+
+DEFAULT_PROFILE_DIR = 'profiles'
+DEFAULT_SCHEDULES = {
+    'train_model': (1, 1, 3, 1),
+    'train_on_unlabeled_ecg': (1, 1, 3, 1),
+    'classify_image': (0, 0, 1, 1),
+}
+TABLE_ROWS = 40
+
+_settings = None
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def parse_schedule(values):
+    """(wait, warmup, active, repeat) from 3 or 4 non-negative integers, or their comma-separated text."""
+    if isinstance(values, str):
+        values = values.replace(',', ' ').split()
+    values = tuple(int(value) for value in values)
+    if len(values) not in (3, 4) or min(values) < 0 or values[2] < 1:
+        raise ValueError(f"Expected WAIT WARMUP ACTIVE [REPEAT] with ACTIVE >= 1, got {values}")
+    return values if len(values) == 4 else values + (1,)
+
+
+def settings():
+    """{'root': run directory or None when off, 'schedule': explicit schedule or None}, read once from the env."""
+    global _settings
+    if _settings is None:
+        root = os.environ.get('ECG_PROFILE', '').strip()
+        if root.lower() in ('', '0', 'false', 'no', 'off'):
+            root = None
+        elif root.lower() in ('1', 'true', 'yes', 'on'):
+            root = DEFAULT_PROFILE_DIR
+        schedule = os.environ.get('ECG_PROFILE_SCHEDULE')
+        _settings = {'root': root, 'schedule': parse_schedule(schedule) if schedule else None}
+    return _settings
+
+
+def configure(root=None, schedule=None):
+    """Turn profiling on into `root` and/or set the schedule of every target; unset arguments keep the env values."""
+    current = settings()
+    if root:
+        current['root'] = root
+    if schedule:
+        current['schedule'] = parse_schedule(schedule)
+    return current
+
+
+def enabled():
+    return settings()['root'] is not None
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', nargs='?', const=DEFAULT_PROFILE_DIR, default=None, metavar='RUN_DIR',
+                        help=f'Profile with torch.profiler into RUN_DIR (default {DEFAULT_PROFILE_DIR}; or ECG_PROFILE)')
+    parser.add_argument('--profile-schedule', type=int, nargs='+', default=None,
+                        metavar='N', help='WAIT WARMUP ACTIVE [REPEAT] profiler steps (or ECG_PROFILE_SCHEDULE)')
+
+
+def configure_from_args(args):
+    try:
+        return configure(args.profile, args.profile_schedule)
+    except ValueError as e:
+        raise SystemExit(f"--profile-schedule: {e}")
+
+
+class _Disabled:
+    """Stands in for a Profile when profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def step(self):
+        pass
+
+
+DISABLED = _Disabled()
+
+
+class Profile:
+    """One torch.profiler session of `target`; step() after every unit of work, close() (or leave the with block) at the end."""
+
+    def __init__(self, target, root, schedule):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+        from torch.profiler import schedule as make_schedule
+
+        self.target = target
+        self.wait, self.warmup, self.active, self.repeat = schedule
+        self.run_dir = os.path.join(root, f"{target}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.cuda = torch.cuda.is_available()
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if self.cuda else [])
+        self.profiler = profile(activities=activities, profile_memory=True, on_trace_ready=self._export,
+                                schedule=make_schedule(wait=self.wait, warmup=self.warmup, active=self.active,
+                                                       repeat=self.repeat))
+        self.steps = 0
+        self.windows = 0
+        self.closed = False
+        self.profiler.start()
+
+    def _export(self, profiler):
+        self.windows += 1
+        trace_path = os.path.join(self.run_dir, f'trace_{self.windows}.json')
+        table_path = os.path.join(self.run_dir, f'operators_{self.windows}.txt')
+        profiler.export_chrome_trace(trace_path)
+        table = profiler.key_averages().table(sort_by='self_cuda_time_total' if self.cuda else 'self_cpu_time_total',
+                                              row_limit=TABLE_ROWS)
+        with open(table_path, 'w') as f:
+            f.write(table + '\n')
+        logger.info(f"Profile of {self.target} written to {trace_path} and {table_path}")
+
+    def step(self):
+        self.steps += 1
+        self.profiler.step()
+
+    def done(self):
+        """True once every recording window of a finite schedule has been written."""
+        return bool(self.repeat) and self.steps >= (self.wait + self.warmup + self.active) * self.repeat
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.profiler.stop()
+        if not self.windows:
+            logger.warning(f"Profiled {self.steps} step(s) of {self.target}, fewer than the {self.wait} wait + "
+                           f"{self.warmup} warmup of the schedule; nothing was recorded")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def profile_run(target):
+    """A Profile of one run of `target` (its steps being batches), or DISABLED when profiling is off."""
+    if not enabled():
+        return DISABLED
+    current = settings()
+    return Profile(target, current['root'], current['schedule'] or DEFAULT_SCHEDULES[target])
+
+
+def profiled(target):
+    """Run the decorated training function inside profile_run(target), passing the Profile as `profiler`."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if 'profiler' in kwargs or not enabled():
+                return function(*args, **kwargs)
+            with profile_run(target) as profiler:
+                return function(*args, profiler=profiler, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _CallStep:
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        return self.session
+
+    def __exit__(self, *exc_info):
+        with _sessions_lock:
+            self.session.step()
+            if self.session.done():
+                self.session.close()
+        return False
+
+
+def profile_call(target):
+    """Context around one call of `target`; the calls of a process are the steps of one profiler session."""
+    if not enabled():
+        return DISABLED
+    with _sessions_lock:
+        session = _sessions.get(target)
+        if session is None:
+            current = settings()
+            session = _sessions[target] = Profile(target, current['root'],
+                                                  current['schedule'] or DEFAULT_SCHEDULES[target])
+            # A process that exits inside a recording window still writes it
+            atexit.register(session.close)
+    return DISABLED if session.closed else _CallStep(session)
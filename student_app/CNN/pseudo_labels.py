@@ -0,0 +1,195 @@
+"""Confidence-thresholded pseudo-labels for the unlabeled training stage.
+
+The unlabeled stage trains on unlabeled_images with the current model's own
+confident predictions as targets. score_images runs batched no-grad inference
+under the eval transform in a streaming pass (one batch of decoded images in
+memory at a time). Each batch's predictions go into a SQLite cache keyed by
+the SHA-256 of the image bytes and a fingerprint of the model's weights, so
+a run with unchanged weights only scores files it has not seen, and any
+retrain (or a fresh random head) scores everything again. rescore=True
+(modelRN.py --rescore-pseudo-labels) ignores the cache altogether.
+
+select_pseudo_labels keeps predictions with confidence >= threshold and then
+balances the classes: no class keeps more than balance_ratio times the images
+of the rarest selected class, the most confident ones first, so one dominant
+prediction cannot drown out the others.
+
+    python pseudo_labels.py --unlabeled-dir unlabeled_images --threshold 0.9
+"""
+import argparse
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from embedding_cache import model_fingerprint
+from preprocessing import images_to_tensor, load_image
+from result_cache import file_sha256
+
+DEFAULT_PSEUDO_LABEL_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pseudo_labels.db')
+
+
+class PseudoLabelCache:
+    def __init__(self, path=DEFAULT_PSEUDO_LABEL_CACHE_PATH, model_fingerprint=''):
+        self.path = path
+        self.model_fingerprint = model_fingerprint
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(pseudo_labels)")]
+        if columns and 'modelFingerprint' not in columns:
+            # Labels cached before fingerprints cannot be matched to the model that scored them
+            self.conn.execute("DROP TABLE pseudo_labels")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pseudo_labels (
+                imageHash TEXT NOT NULL,
+                modelFingerprint TEXT NOT NULL,
+                label INTEGER NOT NULL,
+                confidence REAL NOT NULL,
+                scoredAt REAL NOT NULL,
+                PRIMARY KEY (imageHash, modelFingerprint)
+            )
+        """)
+        # Labels of any other weights can never be used again
+        self.conn.execute("DELETE FROM pseudo_labels WHERE modelFingerprint != ?", (model_fingerprint,))
+        self.conn.commit()
+
+    def get_many(self, image_hashes, chunk_size=500):
+        """{image hash: (label, confidence)} for the hashes that have been scored."""
+        found = {}
+        with self.lock:
+            for start in range(0, len(image_hashes), chunk_size):
+                chunk = image_hashes[start:start + chunk_size]
+                rows = self.conn.execute(
+                    f"SELECT imageHash, label, confidence FROM pseudo_labels WHERE modelFingerprint = ? "
+                    f"AND imageHash IN ({','.join('?' * len(chunk))})", (self.model_fingerprint, *chunk)).fetchall()
+                found.update((image_hash, (label, confidence)) for image_hash, label, confidence in rows)
+        return found
+
+    def put_many(self, items):
+        """Store (image hash, label, confidence) triples."""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pseudo_labels (imageHash, modelFingerprint, label, confidence, scoredAt) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(image_hash, self.model_fingerprint, int(label), float(confidence), now)
+                 for image_hash, label, confidence in items])
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def score_images(model, image_paths, batch_size=32, device=torch.device('cpu')):
+    """Yield (batch start, predicted labels, confidences) per batch of `image_paths`, without gradients."""
+    model.eval()
+    with torch.inference_mode():
+        for start in range(0, len(image_paths), batch_size):
+            batch = images_to_tensor([load_image(path) for path in image_paths[start:start + batch_size]])
+            probabilities = torch.softmax(model(batch.to(device)).float(), dim=1)
+            confidences, labels = probabilities.max(dim=1)
+            yield start, labels.cpu().numpy(), confidences.cpu().numpy()
+
+
+def load_pseudo_labels(model, image_paths, cache, batch_size=32, device=torch.device('cpu'), rescore=False):
+    """Predicted labels and confidences of `image_paths` in order, scoring only images missing from the cache.
+
+    Returns the labels, the confidences and how many images had to be run through the model.
+    """
+    image_hashes = [file_sha256(path) for path in image_paths]
+    cached = {} if rescore else cache.get_many(list(set(image_hashes)))
+    missing = sorted({image_hash: path for image_hash, path in zip(image_hashes, image_paths)
+                      if image_hash not in cached}.items())
+    missing_paths = [path for _, path in missing]
+    for start, labels, confidences in score_images(model, missing_paths, batch_size, device):
+        scored = [(missing[start + i][0], label, confidence)
+                  for i, (label, confidence) in enumerate(zip(labels, confidences))]
+        # Written per batch, so an interrupted pass keeps what it already scored
+        cache.put_many(scored)
+        cached.update((image_hash, (int(label), float(confidence))) for image_hash, label, confidence in scored)
+    labels = np.array([cached[image_hash][0] for image_hash in image_hashes], dtype=np.int64)
+    confidences = np.array([cached[image_hash][1] for image_hash in image_hashes], dtype=np.float32)
+    return labels, confidences, len(missing)
+
+
+def select_pseudo_labels(labels, confidences, threshold=0.9, balance_ratio=2.0):
+    """Indices of the confident predictions, capped per class at balance_ratio x the rarest selected class."""
+    confident = [i for i in range(len(labels)) if confidences[i] >= threshold]
+    counts = Counter(int(labels[i]) for i in confident)
+    if not counts:
+        return []
+    cap = math.ceil(balance_ratio * min(counts.values()))
+    selected = []
+    for label in counts:
+        ranked = sorted((i for i in confident if labels[i] == label), key=lambda i: -confidences[i])
+        selected.extend(ranked[:cap])
+    return sorted(selected)
+
+
+def pseudo_label_selection(model, image_paths, cache_path=DEFAULT_PSEUDO_LABEL_CACHE_PATH, threshold=0.9,
+                           balance_ratio=2.0, rescore=False, batch_size=32, device=torch.device('cpu')):
+    """[(index into image_paths, pseudo label)] of the images to train on, plus a summary for logging."""
+    cache = PseudoLabelCache(cache_path, model_fingerprint(model))
+    try:
+        labels, confidences, scored = load_pseudo_labels(model, image_paths, cache, batch_size, device, rescore)
+    finally:
+        cache.close()
+    selected = select_pseudo_labels(labels, confidences, threshold, balance_ratio)
+    summary = {
+        'images': len(image_paths),
+        'scored': scored,
+        'confident': int((confidences >= threshold).sum()),
+        'selected': len(selected),
+        'per_class': dict(Counter(int(labels[i]) for i in selected)),
+    }
+    return [(i, int(labels[i])) for i in selected], summary
+
+
+class PseudoLabeledDataset(Dataset):
+    """The selected samples of `dataset`, each with its pseudo label instead of the dataset's own."""
+
+    def __init__(self, dataset, selection):
+        self.dataset = dataset
+        self.indices = [index for index, _ in selection]
+        self.labels = [label for _, label in selection]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        sample, _ = self.dataset[self.indices[index]]
+        return sample, self.labels[index]
+
+
+if __name__ == '__main__':
+    from dataset_cache import list_images
+    from inference import class_names, device, load_model
+    from telemetry import configure_logging, logger
+
+    parser = argparse.ArgumentParser(description='Score unlabeled images and show the pseudo-labels that would be used')
+    parser.add_argument('--unlabeled-dir', default='unlabeled_images')
+    parser.add_argument('--threshold', type=float, default=0.9)
+    parser.add_argument('--balance-ratio', type=float, default=2.0)
+    parser.add_argument('--rescore', action='store_true', help='Score every image again, ignoring the cache')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--cache-path', default=DEFAULT_PSEUDO_LABEL_CACHE_PATH)
+    args = parser.parse_args()
+
+    configure_logging()
+    samples, _ = list_images(args.unlabeled_dir, labeled=False)
+    image_paths = [os.path.join(args.unlabeled_dir, rel_path) for rel_path, _ in samples]
+    start = time.perf_counter()
+    selection, summary = pseudo_label_selection(load_model(), image_paths, args.cache_path, args.threshold,
+                                                args.balance_ratio, args.rescore, args.batch_size, device)
+    logger.info(f"{summary['images']} images ({summary['scored']} scored now, the rest cached) in "
+                f"{time.perf_counter() - start:.1f}s; {summary['confident']} at confidence >= {args.threshold}, "
+                f"{summary['selected']} selected after balancing")
+    for label, count in sorted(summary['per_class'].items()):
+        logger.info(f"  {class_names[label]}: {count}")
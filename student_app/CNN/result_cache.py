@@ -0,0 +1,108 @@
+"""Persistent, content-addressed cache of classification results.
+
+Entries are keyed by the SHA-256 of the image bytes, the fingerprint of the
+model weights file and the CAM method, so a re-uploaded ECG is answered
+without touching the model and a retrained model (new weights, new
+fingerprint) never sees results from the previous one. The cache lives in a
+SQLite file and is bounded to `max_entries`, evicting the least recently
+used entries first. Engines and variants that share the file (torch, onnx,
+optimized modes) each open it under their own model_key, and opening one
+only drops the outdated results of that key.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classification_cache.db')
+
+_fingerprints = {}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weights_fingerprint(weights_path):
+    """Hash of the weights file, memoised on its size and mtime so it is computed once per version."""
+    if not os.path.exists(weights_path):
+        return 'no-weights'
+    stat = os.stat(weights_path)
+    key = (os.path.abspath(weights_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _fingerprints:
+        _fingerprints[key] = file_sha256(weights_path)
+    return _fingerprints[key]
+
+
+class ResultCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, model_fingerprint='', max_entries=5000, model_key=''):
+        self.path = path
+        self.model_fingerprint = model_fingerprint
+        self.model_key = model_key
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(results)")]
+        if columns and 'modelKey' not in columns:
+            # A cache file from before model keys; its results are cheap to recompute
+            self.conn.execute("DROP TABLE results")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                imageHash TEXT NOT NULL,
+                modelKey TEXT NOT NULL,
+                modelFingerprint TEXT NOT NULL,
+                cam TEXT NOT NULL,
+                result TEXT NOT NULL,
+                graphPath TEXT,
+                lastAccess REAL NOT NULL,
+                PRIMARY KEY (imageHash, modelKey, modelFingerprint, cam)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (lastAccess)")
+        # Results of an older version of this model can never be hit again; other keys keep theirs
+        self.conn.execute("DELETE FROM results WHERE modelKey = ? AND modelFingerprint != ?",
+                          (model_key, model_fingerprint))
+        self.conn.commit()
+
+    def get(self, image_hash, cam):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT result, graphPath FROM results "
+                "WHERE imageHash = ? AND modelKey = ? AND modelFingerprint = ? AND cam = ?",
+                (image_hash, self.model_key, self.model_fingerprint, cam or 'none')).fetchone()
+            if row is None:
+                return None
+            result, graph_path = row
+            # The overlay file may have been cleaned up since; recompute it then
+            if graph_path and not os.path.exists(graph_path):
+                return None
+            self.conn.execute(
+                "UPDATE results SET lastAccess = ? "
+                "WHERE imageHash = ? AND modelKey = ? AND modelFingerprint = ? AND cam = ?",
+                (time.time(), image_hash, self.model_key, self.model_fingerprint, cam or 'none'))
+            self.conn.commit()
+            return json.loads(result)
+
+    def put(self, image_hash, cam, result):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results "
+                "(imageHash, modelKey, modelFingerprint, cam, result, graphPath, lastAccess) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (image_hash, self.model_key, self.model_fingerprint, cam or 'none', json.dumps(result),
+                 result.get('graphUrl'), time.time()))
+            self.conn.execute(
+                "DELETE FROM results WHERE rowid IN ("
+                "SELECT rowid FROM results ORDER BY lastAccess DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,262 @@
+"""Parallel hyperparameter sweep with successive halving.
+
+Every combination of the given values (or --trials of them, sampled) is a
+trial. Trials run in a pool of --parallel processes, each limited to
+--threads-per-trial intra-op threads, and all of them read the same
+pre-decoded dataset cache (dataset_cache.py; the memory-mapped shards are
+shared through the page cache) with the same persisted train/val split (data_split.py), so their
+validation scores are comparable.
+
+Successive halving: all trials train for --min-epochs, then only the best
+1/--reduction-factor (by best validation accuracy, then validation loss) get
+trained further, up to reduction-factor times as many epochs, and so on until
+--max-epochs. Promoted trials continue from their last epoch checkpoint (the
+modelRN --resume format), so no epoch is trained twice. Unlabeled pretraining,
+when a trial has unlabeled_epochs > 0, runs once in its first round on
+pseudo-labels chosen once for the whole sweep (pseudo_labels.py).
+
+    python sweep.py --lr 0.001 0.0003 0.0001 --batch-size 16 32 --parallel 3
+    python sweep.py --lr 0.003 0.001 --unlabeled-epochs 0 5 --max-unlabeled-images 100 --max-epochs 27
+
+Each trial keeps its checkpoints, best_model.pth and metrics.jsonl in
+<sweep dir>/<trial>/; leaderboard.json in the sweep dir ranks all trials.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from data_split import DEFAULT_SPLIT_PATH, split_indices
+from telemetry import configure_logging, logger
+
+SEARCH_SPACE = ('lr', 'batch_size', 'unlabeled_epochs', 'max_unlabeled_images')
+
+
+def trial_configs(space, trials=None, seed=0):
+    """Every combination of the values in `space` ({name: [values]}), or `trials` of them sampled without repeats."""
+    names = list(space)
+    configs = [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+    if trials is not None and trials < len(configs):
+        configs = random.Random(seed).sample(configs, trials)
+    return configs
+
+
+def trial_name(index, config, varied):
+    return '_'.join([f"trial_{index:03d}"] + [f"{name}={config[name]}" for name in SEARCH_SPACE if name in varied])
+
+
+def rung_epochs(min_epochs, max_epochs, reduction_factor):
+    """Epoch budgets of the successive-halving rounds, e.g. 1, 3, 9, 20."""
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= reduction_factor
+    return rungs + [max_epochs]
+
+
+def _init_worker(threads):
+    torch.set_num_threads(threads)
+    configure_logging('warning')
+
+
+def run_trial(trial_dir, config, epochs, labeled_cache, unlabeled_cache, pseudo_selection, split, seed, workers):
+    """Train one trial up to `epochs` labeled epochs, continuing from its newest checkpoint; returns its scores."""
+    import torch.nn as nn
+    import torch.optim as optim
+    from torch.utils.data import Subset
+
+    from checkpointing import CheckpointWriter, latest_checkpoint, load_checkpoint, restore_rng_state
+    from data_loading import loader_options, make_loader
+    from dataset_cache import CachedImageDataset
+    from preprocessing import build_train_transform
+    from pseudo_labels import PseudoLabeledDataset
+    from telemetry import MetricsWriter
+    with contextlib.redirect_stdout(io.StringIO()):
+        import modelRN
+        from inference import load_model
+
+    start = time.perf_counter()
+    torch.manual_seed(seed)
+    # Starts from ecg_classifier_model.pth in the sweep's working directory, like modelRN
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = load_model()
+    optimizer = optim.Adam(model.parameters(), lr=config['lr'])
+    checkpoint_dir = os.path.join(trial_dir, 'checkpoints')
+    resume_path = latest_checkpoint(checkpoint_dir)
+    resume = load_checkpoint(resume_path) if resume_path else None
+    if resume:
+        model.load_state_dict(resume['model'])
+        optimizer.load_state_dict(resume['optimizer'])
+        restore_rng_state(resume['rng'])
+    checkpoints = CheckpointWriter(checkpoint_dir, keep_last=1)
+    metrics = MetricsWriter(os.path.join(trial_dir, 'metrics.jsonl'), run_id=os.path.basename(trial_dir), **config)
+    options = loader_options(num_workers=workers)
+    transform = build_train_transform(resize=False)
+    full_dataset = CachedImageDataset(labeled_cache, transform=transform)
+    train_loader = make_loader(Subset(full_dataset, split['train']), batch_size=config['batch_size'], shuffle=True,
+                               options=options)
+    # Validation gets the eval transform: without a transform the cache returns normalized tensors
+    val_loader = make_loader(Subset(CachedImageDataset(labeled_cache), split['val']), batch_size=config['batch_size'], shuffle=False,
+                             options=options)
+
+    # The training loops write their loss plots to ./GRAPH; pool processes run several trials, so change back after
+    previous_dir = os.getcwd()
+    os.chdir(trial_dir)
+    try:
+        if resume is None and config.get('unlabeled_epochs', 0) > 0 and pseudo_selection:
+            unlabeled_dataset = CachedImageDataset(unlabeled_cache, transform=transform)
+            unlabeled_loader = make_loader(PseudoLabeledDataset(unlabeled_dataset, pseudo_selection),
+                                           batch_size=config['batch_size'], shuffle=True, options=options)
+            model = modelRN.train_on_unlabeled_ecg(model, unlabeled_loader, optimizer, nn.CrossEntropyLoss(),
+                                                   num_epochs=config['unlabeled_epochs'],
+                                                   max_images=config['max_unlabeled_images'], metrics=metrics)
+        labeled_resume = resume if resume is not None and resume['stage'] == 'labeled' else None
+        modelRN.train_model(model, optimizer, num_epochs=epochs, train_loader=train_loader, val_loader=val_loader,
+                            metrics=metrics, checkpoints=checkpoints, split=split, resume=labeled_resume)
+    finally:
+        os.chdir(previous_dir)
+        checkpoints.close()
+        metrics.close()
+
+    final = load_checkpoint(latest_checkpoint(checkpoint_dir))
+    return {
+        'epochs': final['epoch'],
+        'best_val_accuracy': final['best_acc'],
+        'best_val_loss': min(final['val_loss_history']),
+        'final_train_loss': final['train_loss_history'][-1],
+        'time_s': time.perf_counter() - start,
+    }
+
+
+def run_sweep(configs, sweep_dir, labeled_cache, unlabeled_cache=None, pseudo_selection=None, split=None, parallel=2,
+              threads_per_trial=1, min_epochs=1, max_epochs=20, reduction_factor=3, seed=0, workers=0):
+    """Successive halving over `configs`; returns the leaderboard, best trial first."""
+    # Names show only the hyperparameters that differ between trials
+    varied = {name for name in SEARCH_SPACE if len({config.get(name) for config in configs}) > 1}
+    trials = [{'trial': trial_name(i, config, varied), 'config': config, 'status': 'running', 'epochs': 0,
+               'best_val_accuracy': None, 'best_val_loss': None, 'time_s': 0.0} for i, config in enumerate(configs)]
+    survivors = list(trials)
+    rungs = rung_epochs(min_epochs, max_epochs, reduction_factor)
+    # Spawned, not forked: a fork of a process whose OpenMP pool already ran can hang in torch
+    with ProcessPoolExecutor(max_workers=parallel, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(threads_per_trial,)) as pool:
+        for rung, epochs in enumerate(rungs):
+            logger.info(f"Round {rung + 1}/{len(rungs)}: {len(survivors)} trials to {epochs} epochs")
+            futures = {pool.submit(run_trial, os.path.join(sweep_dir, trial['trial']), trial['config'], epochs,
+                                   labeled_cache, unlabeled_cache, pseudo_selection, split, seed, workers): trial
+                       for trial in survivors}
+            for future, trial in futures.items():
+                try:
+                    result = future.result()
+                except Exception as error:  # One broken configuration should not end the sweep
+                    logger.warning(f"{trial['trial']} failed: {error!r}")
+                    trial.update(status='failed', error=repr(error))
+                    continue
+                trial['time_s'] += result.pop('time_s')
+                trial.update(result)
+                logger.info(f"{trial['trial']}: {trial['epochs']} epochs, best val acc "
+                            f"{trial['best_val_accuracy']:.4f}, best val loss {trial['best_val_loss']:.4f}")
+
+            survivors = sorted((trial for trial in survivors if trial['status'] != 'failed'), key=_score)
+            if rung + 1 < len(rungs):
+                keep = max(1, len(survivors) // reduction_factor)
+                for trial in survivors[keep:]:
+                    trial['status'] = f'stopped after round {rung + 1}'
+                survivors = survivors[:keep]
+    for trial in survivors:
+        trial['status'] = 'finished'
+
+    leaderboard = sorted(trials, key=lambda trial: (trial['status'] == 'failed', -trial['epochs'], _score(trial)))
+    for rank, trial in enumerate(leaderboard, 1):
+        trial['rank'] = rank
+        trial['best_model'] = os.path.join(sweep_dir, trial['trial'], 'checkpoints', 'best_model.pth')
+    return leaderboard
+
+
+def _score(trial):
+    # Best validation accuracy first, lower validation loss breaks ties (small validation sets tie often)
+    return -(trial['best_val_accuracy'] or 0.0), trial['best_val_loss'] if trial['best_val_loss'] is not None else 0.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel hyperparameter sweep with successive halving')
+    parser.add_argument('--data-dir', default='callsifi_images')
+    parser.add_argument('--unlabeled-dir', default='unlabeled_images')
+    parser.add_argument('--dataset-cache', default='dataset_cache', help='Shared pre-decoded dataset cache')
+    parser.add_argument('--split-path', default=DEFAULT_SPLIT_PATH, help='Persisted train/val/test split')
+    parser.add_argument('--sweep-dir', default=None, help='Trial outputs (default sweeps/<timestamp>)')
+    parser.add_argument('--lr', type=float, nargs='+', default=[0.001])
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[16])
+    parser.add_argument('--unlabeled-epochs', type=int, nargs='+', default=[0])
+    parser.add_argument('--max-unlabeled-images', type=int, nargs='+', default=[100])
+    parser.add_argument('--pseudo-label-threshold', type=float, default=0.9)
+    parser.add_argument('--pseudo-label-balance', type=float, default=2.0)
+    parser.add_argument('--trials', type=int, default=None, help='Sample this many combinations instead of all')
+    parser.add_argument('--min-epochs', type=int, default=2, help='Labeled epochs of the first round')
+    parser.add_argument('--max-epochs', type=int, default=20, help='Labeled epochs of the finalists')
+    parser.add_argument('--reduction-factor', type=int, default=3, help='Keep 1/N of the trials after each round')
+    parser.add_argument('--parallel', type=int, default=2, help='Trials running at once')
+    parser.add_argument('--threads-per-trial', type=int, default=None,
+                        help='Intra-op threads per trial (default: cores / --parallel)')
+    parser.add_argument('--workers', type=int, default=0, help='DataLoader workers per trial')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.reduction_factor < 2:
+        parser.error('--reduction-factor must be at least 2')
+
+    configure_logging()
+    from dataset_cache import build_cache
+
+    labeled_cache = os.path.abspath(os.path.join(args.dataset_cache, os.path.basename(os.path.normpath(args.data_dir))))
+    index = build_cache(args.data_dir, labeled_cache, labeled=True)
+    unlabeled_cache = None
+    pseudo_selection = None
+    if any(epochs > 0 for epochs in args.unlabeled_epochs):
+        from inference import device, load_model
+        from pseudo_labels import pseudo_label_selection
+
+        unlabeled_cache = os.path.abspath(os.path.join(args.dataset_cache,
+                                                       os.path.basename(os.path.normpath(args.unlabeled_dir))))
+        unlabeled_index = build_cache(args.unlabeled_dir, unlabeled_cache, labeled=False)
+        # Every trial starts from the same weights, so they all get the same pseudo-labels
+        with contextlib.redirect_stdout(io.StringIO()):
+            model = load_model()
+        pseudo_selection, summary = pseudo_label_selection(
+            model, [os.path.join(args.unlabeled_dir, entry['path']) for entry in unlabeled_index['entries']],
+            threshold=args.pseudo_label_threshold, balance_ratio=args.pseudo_label_balance, device=device)
+        del model
+        logger.info(f"Pseudo-labels: {summary['selected']} of {summary['images']} unlabeled images selected")
+
+    # The persisted split of modelRN (see data_split.py): every trial is ranked on the same validation images,
+    # and the test images stay held out from the sweep
+    split = split_indices([entry['path'].replace(os.sep, '/') for entry in index['entries']], args.split_path)
+
+    space = {'lr': args.lr, 'batch_size': args.batch_size, 'unlabeled_epochs': args.unlabeled_epochs,
+             'max_unlabeled_images': args.max_unlabeled_images}
+    configs = trial_configs(space, args.trials, args.seed)
+    sweep_dir = os.path.abspath(args.sweep_dir or os.path.join('sweeps', time.strftime('%Y%m%d-%H%M%S')))
+    os.makedirs(sweep_dir, exist_ok=True)
+    threads = args.threads_per_trial or max(1, (os.cpu_count() or 1) // args.parallel)
+    logger.info(f"{len(configs)} trials, {args.parallel} at a time with {threads} threads each, in {sweep_dir}")
+
+    leaderboard = run_sweep(configs, sweep_dir, labeled_cache, unlabeled_cache, pseudo_selection, split,
+                            args.parallel, threads, args.min_epochs, args.max_epochs, args.reduction_factor,
+                            args.seed, args.workers)
+    with open(os.path.join(sweep_dir, 'leaderboard.json'), 'w') as f:
+        json.dump(leaderboard, f, indent=2)
+
+    print(f"{'rank':>4}  {'trial':<50}{'epochs':>7}{'val acc':>9}{'val loss':>10}{'time s':>8}  status")
+    for trial in leaderboard:
+        accuracy = f"{trial['best_val_accuracy']:.4f}" if trial['best_val_accuracy'] is not None else '-'
+        loss = f"{trial['best_val_loss']:.4f}" if trial['best_val_loss'] is not None else '-'
+        print(f"{trial['rank']:>4}  {trial['trial']:<50}{trial['epochs']:>7}{accuracy:>9}{loss:>10}"
+              f"{trial['time_s']:>8.1f}  {trial['status']}")
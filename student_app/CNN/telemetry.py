@@ -0,0 +1,118 @@
+"""Training telemetry: leveled, sampled console logging and per-epoch JSON-lines metrics.
+
+The training loops log through the 'ecg.training' logger instead of printing:
+per-batch progress is DEBUG and only every `log_every` batches (and only when
+DEBUG is enabled, so nothing is formatted or synced otherwise), epoch
+summaries are INFO, problems are WARNING. configure_logging sets the level
+(modelRN.py --log-level, or ECG_LOG_LEVEL).
+
+MetricsWriter appends one JSON object per epoch phase to a .jsonl file:
+
+    {"run": "20240101-120000", "phase": "train", "epoch": 3, "images": 1120,
+     "loss": 0.41, "accuracy": 0.87, "images_per_sec": 58.2, "step_time_ms": 262.1,
+     "data_wait_s": 1.9, "data_wait_fraction": 0.09, "epoch_time_s": 19.2,
+     "peak_rss_mb": 1830.4, ...}
+
+and, when a training stage ends, why it ended:
+
+    {"run": "20240101-120000", "phase": "labeled", "event": "stop", "epoch": 14,
+     "stop_reason": "early_stopping", ...}
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+
+logger = logging.getLogger('ecg.training')
+
+
+def configure_logging(level=None):
+    """Send training logs to stdout as 'LEVEL: message' at the given level (default ECG_LOG_LEVEL or info)."""
+    level = (level or os.environ.get('ECG_LOG_LEVEL', 'info')).upper()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def should_log_batch(batch_idx, num_batches, every):
+    """Sampling for per-batch DEBUG lines: every `every` batches and the last one."""
+    return logger.isEnabledFor(logging.DEBUG) and ((batch_idx + 1) % every == 0 or batch_idx + 1 == num_batches)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class MetricsWriter:
+    """Per-epoch metrics of one training run, appended as JSON lines to `path` (or only logged when None)."""
+
+    def __init__(self, path=None, run_id=None, **run_info):
+        self.path = path
+        self.run_id = run_id or time.strftime('%Y%m%d-%H%M%S')
+        self.run_info = run_info
+        self.records = []
+        self.file = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(path, 'a', buffering=1)
+
+    def epoch(self, phase, epoch, timing, images, loss, accuracy=None, **extra):
+        """Record one epoch phase; `timing` is a data_loading.LoaderTimer summary."""
+        record = {
+            'run': self.run_id,
+            'phase': phase,
+            'epoch': epoch,
+            'images': images,
+            'loss': loss,
+            'accuracy': accuracy,
+            'images_per_sec': images / timing['total_s'] if timing['total_s'] else 0.0,
+            'step_time_ms': timing['compute_s'] / timing['batches'] * 1000 if timing['batches'] else 0.0,
+            'data_wait_s': timing['data_wait_s'],
+            'data_wait_fraction': timing['data_wait_fraction'],
+            'epoch_time_s': timing['total_s'],
+            'peak_rss_mb': peak_rss_mb(),
+            'time': time.time(),
+        }
+        record.update(self.run_info)
+        record.update(extra)
+        self.records.append(record)
+        if self.file is not None:
+            self.file.write(json.dumps(record) + '\n')
+        accuracy_text = f" Acc: {accuracy:.4f}" if accuracy is not None else ''
+        logger.info(f"Epoch {epoch} {phase} - Loss: {loss:.4f}{accuracy_text}, {record['images_per_sec']:.1f} img/s, "
+                    f"step {record['step_time_ms']:.1f} ms, data wait {record['data_wait_fraction'] * 100:.1f}%, "
+                    f"peak RSS {record['peak_rss_mb']:.0f} MB")
+        return record
+
+    def stop(self, stage, epoch, reason, **extra):
+        """Record why a training stage ended after `epoch` (see training_control.py)."""
+        record = {'run': self.run_id, 'phase': stage, 'event': 'stop', 'epoch': epoch, 'stop_reason': reason,
+                  'time': time.time()}
+        record.update(self.run_info)
+        record.update(extra)
+        self.records.append(record)
+        if self.file is not None:
+            self.file.write(json.dumps(record) + '\n')
+        logger.info(f"Stopped {stage} training after epoch {epoch}: {reason}")
+        return record
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
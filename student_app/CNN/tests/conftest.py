@@ -0,0 +1,8 @@
+"""Tests import the CNN modules as siblings, the same way the scripts and benchmarks do."""
+import os
+import sys
+
+CNN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (CNN_DIR, os.path.join(CNN_DIR, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,57 @@
+"""custom_loss against a per-image, per-class reference loop of its definition."""
+import pytest
+import torch
+import torch.nn as nn
+
+from bench_loss import reference_custom_loss
+from modelRN import class_names, custom_loss, feature_names
+
+
+def random_batch(batch_size, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    outputs = torch.randn(batch_size, len(class_names), generator=generator)
+    labels = torch.randint(len(class_names), (batch_size,), generator=generator)
+    features = torch.rand(batch_size, len(feature_names), generator=generator) < 0.5
+    return outputs, labels, features
+
+
+def as_dicts(features):
+    return [{name: bool(flag) for name, flag in zip(feature_names, row)} for row in features]
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 64])
+def test_matches_reference_loop(batch_size):
+    outputs, labels, features = random_batch(batch_size, seed=batch_size)
+    expected = reference_custom_loss(outputs, labels, as_dicts(features))
+    assert torch.allclose(custom_loss(outputs, labels, features), expected, atol=1e-5)
+    # Feature dicts go through the same mask
+    assert torch.allclose(custom_loss(outputs, labels, as_dicts(features)), expected, atol=1e-5)
+
+
+def test_no_penalty_when_every_feature_is_present():
+    outputs, labels, _ = random_batch(8)
+    features = torch.ones(8, len(feature_names), dtype=torch.bool)
+    assert torch.allclose(custom_loss(outputs, labels, features), nn.CrossEntropyLoss()(outputs, labels))
+
+
+def test_penalty_has_a_gradient():
+    outputs, labels, features = random_batch(16)
+    outputs.requires_grad_(True)
+    custom_loss(outputs, labels, features).backward()
+    with_penalty = outputs.grad.clone()
+
+    outputs.grad = None
+    nn.CrossEntropyLoss()(outputs, labels).backward()
+    penalty_grad = with_penalty - outputs.grad
+    assert penalty_grad.abs().sum() > 1e-4
+
+
+def test_penalty_pushes_probability_away_from_unsupported_classes():
+    outputs, labels, _ = random_batch(4)
+    features = torch.zeros(4, len(feature_names), dtype=torch.bool)
+    outputs.requires_grad_(True)
+    (custom_loss(outputs, labels, features) - nn.CrossEntropyLoss()(outputs, labels)).backward()
+    # 'LOW RISK' requires a single feature while 'Inferior' requires two; with no feature present,
+    # gradient descent lowers the logit of the class with more missing features relative to the other
+    inferior, low_risk = class_names.index('Inferior'), class_names.index('LOW RISK')
+    assert (outputs.grad[:, inferior] > outputs.grad[:, low_risk]).all()
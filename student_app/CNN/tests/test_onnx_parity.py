@@ -0,0 +1,89 @@
+"""onnx_engine.classify_images against inference.classify_images on the same random-weight model and scans."""
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+import inference
+import onnx_engine
+from export_onnx import export_onnx
+from preprocessing import images_to_array, images_to_tensor, load_image
+
+
+@pytest.fixture(scope='module')
+def models(tmp_path_factory):
+    torch.manual_seed(0)
+    model = inference.build_model().eval()
+    onnx_path = export_onnx(model, str(tmp_path_factory.mktemp('onnx') / 'model.onnx'))
+    return model, onnx_engine.load_model(onnx_path)
+
+
+def write_scans(tmp_path, count):
+    uploads = tmp_path / 'uploads'
+    uploads.mkdir()
+    (tmp_path / 'graphs').mkdir()
+    generator = np.random.default_rng(count)
+    paths = []
+    for i in range(count):
+        # Varied sizes, so both engines go through the same resize
+        pixels = generator.integers(0, 256, (300 + 40 * i, 400, 3), dtype=np.uint8)
+        path = os.path.join(uploads, f'scan{i}.jpg')
+        Image.fromarray(pixels).save(path)
+        paths.append(path)
+    return paths
+
+
+def record_maps(monkeypatch, module):
+    maps = {}
+
+    def save_gradcam(image_path, activation_map):
+        maps[image_path] = np.asarray(activation_map.cpu() if torch.is_tensor(activation_map) else activation_map,
+                                      dtype=np.float32)
+        return image_path.replace('uploads', 'graphs').replace('.jpg', '_graph.png')
+
+    monkeypatch.setattr(module, 'save_gradcam', save_gradcam)
+    return maps
+
+
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_logits_match(models, tmp_path, batch_size):
+    model, session = models
+    images = [load_image(path) for path in write_scans(tmp_path, batch_size)]
+    with torch.no_grad():
+        expected = model(images_to_tensor(images)).numpy()
+    logits, cams = session.run(None, {'input': images_to_array(images)})
+    assert logits.shape == expected.shape
+    assert cams.shape[:2] == (batch_size, len(inference.class_names))
+    np.testing.assert_allclose(logits, expected, atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize('batch_size', [1, 3])
+@pytest.mark.parametrize('cam', [None, 'gradcam'])
+def test_results_and_gradcam_match(models, tmp_path, monkeypatch, batch_size, cam):
+    model, session = models
+    paths = write_scans(tmp_path, batch_size)
+    torch_maps = record_maps(monkeypatch, inference)
+    onnx_maps = record_maps(monkeypatch, onnx_engine)
+
+    expected = inference.classify_images(paths, model=model, cam=cam)
+    actual = onnx_engine.classify_images(paths, model=session, cam=cam)
+
+    assert [result['classification'] for result in actual] == [result['classification'] for result in expected]
+    for result, reference in zip(actual, expected):
+        assert float(result['confidence'].rstrip('%')) == pytest.approx(float(reference['confidence'].rstrip('%')),
+                                                                       abs=0.011)
+        assert result['graphUrl'] == reference['graphUrl']
+    if cam is None:
+        assert not torch_maps and not onnx_maps
+        return
+    assert sorted(onnx_maps) == sorted(torch_maps) == sorted(paths)
+    for path in paths:
+        assert onnx_maps[path].shape == torch_maps[path].shape
+        scale = float(np.abs(torch_maps[path]).max())
+        assert scale > 0, 'an all-zero map would make the comparison vacuous'
+        np.testing.assert_allclose(onnx_maps[path], torch_maps[path], atol=1e-4 * scale, rtol=1e-4)
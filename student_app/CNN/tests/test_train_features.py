@@ -0,0 +1,74 @@
+"""train_model takes the feature-penalty inputs from un-augmented pixels, never from the augmented batch."""
+import pytest
+import torch
+import torch.nn as nn
+from PIL import Image
+from torch.utils.data import DataLoader
+
+import modelRN
+from data_loading import BatchAugment, normalize_batch
+from preprocessing import PairedTransform, build_eval_transform, build_train_transform, build_uint8_transform
+
+
+class ImageDataset:
+    def __init__(self, images, transform):
+        self.images = images
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        return self.transform(self.images[index]), index % len(modelRN.class_names)
+
+
+def random_images(count, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return [Image.fromarray(torch.randint(256, (64, 64, 3), dtype=torch.uint8, generator=generator).numpy())
+            for _ in range(count)]
+
+
+def tiny_model():
+    return nn.Sequential(nn.AdaptiveAvgPool2d(4), nn.Flatten(), nn.Linear(48, len(modelRN.class_names)))
+
+
+def run_training(monkeypatch, tmp_path, train_dataset, val_dataset, **kwargs):
+    seen = []
+
+    def record(inputs):
+        seen.append(inputs.detach().clone())
+        return torch.zeros(inputs.size(0), len(modelRN.feature_names), dtype=torch.bool)
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(modelRN, 'extract_features', record)
+    model = tiny_model()
+    modelRN.train_model(model, torch.optim.SGD(model.parameters(), lr=0.01), num_epochs=1,
+                        train_loader=DataLoader(train_dataset, batch_size=4),
+                        val_loader=DataLoader(val_dataset, batch_size=4), **kwargs)
+    return seen
+
+
+def test_per_image_augmentation_uses_clean_view(monkeypatch, tmp_path):
+    images = random_images(6)
+    clean = build_eval_transform()
+    paired = ImageDataset(images, PairedTransform(build_train_transform(), clean))
+    seen = run_training(monkeypatch, tmp_path, paired, ImageDataset(images, clean))
+    expected = torch.stack([clean(image) for image in images])
+    # Two training batches, then the validation batches
+    assert torch.allclose(torch.cat(seen[:2]), expected, atol=1e-6)
+
+
+def test_batch_augmentation_uses_batch_before_augmenting(monkeypatch, tmp_path):
+    images = random_images(6, seed=1)
+    decoded = ImageDataset(images, build_uint8_transform())
+    seen = run_training(monkeypatch, tmp_path, decoded, decoded, train_transform=BatchAugment(),
+                        val_transform=normalize_batch)
+    expected = normalize_batch(torch.stack([decoded[i][0] for i in range(len(images))]))
+    assert torch.allclose(torch.cat(seen[:2]), expected, atol=1e-6)
+    assert torch.allclose(torch.cat(seen[2:]), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('resize', [True, False])
+def test_eval_transform_without_resize_matches_on_model_sized_images(resize):
+    image = random_images(1, seed=2)[0].resize((224, 224))
+    assert torch.equal(build_eval_transform(resize=resize)(image), build_eval_transform()(image))
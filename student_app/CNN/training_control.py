@@ -0,0 +1,137 @@
+"""Learning-rate schedules, early stopping and a wall-clock budget for the training loops.
+
+A TrainingController is told when every epoch starts and ends (with that
+epoch's metrics). After each epoch it steps the learning-rate schedule and
+decides whether training should stop:
+
+    schedule 'plateau'  ReduceLROnPlateau on the monitored metric (factor, patience)
+             'cosine'   cosine annealing from the configured rate to min_lr over num_epochs
+             'none'     constant rate (the previous behaviour)
+    patience            stop after this many epochs without improving the monitored metric
+                        ('val_loss' or 'val_accuracy'; the unlabeled stage has no validation
+                        set and monitors its training 'loss')
+    deadline            time.time() by which the run must end; training stops when the next
+                        epoch (estimated from the mean epoch time so far) would overrun it
+
+stop_reason tells why a stage ended: 'completed', 'early_stopping',
+'time_budget' or 'converged' (the unlabeled stage's low-loss rule). The loops
+write it to the metrics file, and the controller state goes into every
+checkpoint, so a resumed run keeps its schedule and patience counters.
+
+    python modelRN.py --schedule plateau --patience 5 --monitor val_loss --time-budget 120
+"""
+import time
+
+from torch.optim.lr_scheduler import CosineAnnealingLR, ReduceLROnPlateau
+
+SCHEDULES = ('none', 'plateau', 'cosine')
+MONITORS = ('val_loss', 'val_accuracy', 'loss')
+
+
+class TrainingController:
+    def __init__(self, optimizer, num_epochs, schedule='none', monitor='val_loss', patience=None, min_delta=0.0,
+                 deadline=None, plateau_factor=0.1, plateau_patience=2, min_lr=1e-6):
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule '{schedule}', expected one of {SCHEDULES}")
+        if monitor not in MONITORS:
+            raise ValueError(f"Unknown monitor '{monitor}', expected one of {MONITORS}")
+        self.optimizer = optimizer
+        self.monitor = monitor
+        self.mode = 'max' if monitor.endswith('accuracy') else 'min'
+        self.patience = patience
+        self.min_delta = min_delta
+        self.deadline = deadline
+        # Every stage starts from the configured learning rate, not where the previous stage's schedule left it
+        for group in optimizer.param_groups:
+            group.setdefault('initial_lr', group['lr'])
+            group['lr'] = group['initial_lr']
+        if schedule == 'plateau':
+            self.scheduler = ReduceLROnPlateau(optimizer, mode=self.mode, factor=plateau_factor,
+                                               patience=plateau_patience, min_lr=min_lr)
+        elif schedule == 'cosine':
+            self.scheduler = CosineAnnealingLR(optimizer, T_max=num_epochs, eta_min=min_lr)
+        else:
+            self.scheduler = None
+        self.best = None
+        self.epochs_without_improvement = 0
+        self.epoch_times = []
+        self.stop_reason = None
+        self.epoch_start = None
+
+    def lr(self):
+        return self.optimizer.param_groups[0]['lr']
+
+    def begin_epoch(self):
+        """False when training should not start another epoch (stop already decided, or the budget is spent)."""
+        self.epoch_start = time.perf_counter()
+        if self.stop_reason is None and self.deadline is not None and time.time() >= self.deadline:
+            self.stop_reason = 'time_budget'
+        return self.stop_reason is None
+
+    def _improved(self, value):
+        if self.best is None:
+            return True
+        if self.mode == 'min':
+            return value < self.best - self.min_delta
+        return value > self.best + self.min_delta
+
+    def end_epoch(self, metrics):
+        """Step the schedule with this epoch's {name: value} metrics; True if training should stop now."""
+        if self.epoch_start is not None:
+            self.epoch_times.append(time.perf_counter() - self.epoch_start)
+        value = metrics[self.monitor]
+        if isinstance(self.scheduler, ReduceLROnPlateau):
+            self.scheduler.step(value)
+        elif self.scheduler is not None:
+            self.scheduler.step()
+
+        if self._improved(value):
+            self.best = value
+            self.epochs_without_improvement = 0
+        else:
+            self.epochs_without_improvement += 1
+        if self.patience is not None and self.epochs_without_improvement >= self.patience:
+            self.stop_reason = 'early_stopping'
+        elif self.deadline is not None and self.epoch_times:
+            mean_epoch = sum(self.epoch_times) / len(self.epoch_times)
+            if time.time() + mean_epoch > self.deadline:
+                self.stop_reason = 'time_budget'
+        return self.stop_reason is not None
+
+    def stop(self, reason):
+        """Stop for a reason decided by the training loop itself, e.g. 'converged'."""
+        self.stop_reason = reason
+
+    def finish(self):
+        """The stop reason of the stage; 'completed' when it ran all its epochs."""
+        if self.stop_reason is None:
+            self.stop_reason = 'completed'
+        return self.stop_reason
+
+    def state_dict(self):
+        return {
+            'scheduler': self.scheduler.state_dict() if self.scheduler is not None else None,
+            'lrs': [group['lr'] for group in self.optimizer.param_groups],
+            'best': self.best,
+            'epochs_without_improvement': self.epochs_without_improvement,
+            'epoch_times': list(self.epoch_times),
+            'stop_reason': self.stop_reason,
+        }
+
+    def load_state_dict(self, state):
+        if self.scheduler is not None and state['scheduler'] is not None:
+            self.scheduler.load_state_dict(state['scheduler'])
+        for group, lr in zip(self.optimizer.param_groups, state['lrs']):
+            group['lr'] = lr
+        self.best = state['best']
+        self.epochs_without_improvement = state['epochs_without_improvement']
+        self.epoch_times = list(state['epoch_times'])
+        # A time budget belongs to one invocation; a resumed run gets a new one
+        self.stop_reason = state['stop_reason'] if state['stop_reason'] != 'time_budget' else None
+
+
+def deadline_from_minutes(minutes, start=None):
+    """time.time() deadline `minutes` from `start` (now), or None without a budget."""
+    if minutes is None:
+        return None
+    return (start if start is not None else time.time()) + minutes * 60
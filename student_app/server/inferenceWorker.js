@@ -0,0 +1,83 @@
+const { spawn } = require('child_process');
+const path = require('path');
+const readline = require('readline');
+
+// Client for CNN/inference_worker.py: one Python process that keeps the model loaded
+// and answers JSON-lines requests, instead of one process per upload.
+class InferenceWorker {
+    constructor(scriptPath) {
+        this.scriptPath = scriptPath;
+        this.process = null;
+        this.nextId = 1;
+        this.pending = new Map();
+    }
+
+    start() {
+        // Run in the CNN directory, where the worker's relative model and cache paths live
+        const child = spawn('python', [this.scriptPath], {
+            cwd: path.dirname(this.scriptPath),
+            stdio: ['pipe', 'pipe', 'inherit']
+        });
+        this.process = child;
+
+        readline.createInterface({ input: child.stdout }).on('line', (line) => {
+            let response;
+            try {
+                response = JSON.parse(line);
+            } catch (err) {
+                console.error('Invalid response from inference worker:', line);
+                return;
+            }
+            const callback = this.pending.get(response.id);
+            if (!callback) {
+                return;
+            }
+            this.pending.delete(response.id);
+            if (response.error) {
+                callback(new Error(response.error));
+            } else {
+                callback(null, response);
+            }
+        });
+
+        // A failed spawn (e.g. no python on PATH) emits 'error' instead of 'exit'; unhandled, it would crash the server
+        child.on('error', (err) => {
+            console.error('Inference worker failed:', err);
+            this.fail(child, new Error(`Inference worker failed: ${err.message}`));
+        });
+        // Writes to a worker that never started or already died fail with EPIPE on stdin
+        child.stdin.on('error', (err) => {
+            console.error('Could not write to inference worker:', err);
+            this.fail(child, new Error('Inference worker is not running'));
+        });
+
+        child.on('exit', (code) => {
+            console.error(`Inference worker exited with code ${code}`);
+            this.fail(child, new Error('Inference worker exited'));
+        });
+    }
+
+    // Fail every pending request of `child` and forget the process, so the next request starts a new one
+    fail(child, error) {
+        if (this.process !== child) {
+            return;
+        }
+        this.process = null;
+        for (const callback of this.pending.values()) {
+            callback(error);
+        }
+        this.pending.clear();
+    }
+
+    classify(imagePath, callback) {
+        // Restart lazily if the worker died
+        if (!this.process) {
+            this.start();
+        }
+        const id = this.nextId++;
+        this.pending.set(id, callback);
+        this.process.stdin.write(JSON.stringify({ id: id, image: imagePath }) + '\n');
+    }
+}
+
+module.exports = new InferenceWorker(path.join(__dirname, '..', 'CNN', 'inference_worker.py'));
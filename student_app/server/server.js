@@ -1683,7 +1683,8 @@ app.get('/api/progressOverTime', verifyToken, (req, res) => {
 
 const multer = require('multer');
 const upload = multer({ dest: 'uploads/' });
-const { execFile } = require('child_process');
+const inferenceWorker = require('./inferenceWorker');
+inferenceWorker.start();
 
 // POST route to handle image uploads
 app.post('/upload-image', upload.single('image'), (req, res) => {
@@ -1701,18 +1702,13 @@ app.post('/upload-image', upload.single('image'), (req, res) => {
             return res.status(500).json({ success: false, message: 'Error processing image' });
         }
 
-        const pythonScriptPath = path.resolve('../CNN/modelRN.py');
-
-        execFile('python', [pythonScriptPath, imageWithExtension], (error, stdout, stderr) => {
+        inferenceWorker.classify(imageWithExtension, (error, jsonResponse) => {
             if (error) {
-                console.error('Error executing Python script:', error);
+                console.error('Error from inference worker:', error);
                 return res.status(500).json({ success: false, message: 'Error processing image' });
             }
 
             try {
-                const outputLines = stdout.trim().split('\n');
-                const jsonResponse = JSON.parse(outputLines[outputLines.length - 1]);
-
                 console.log('Classification result:', jsonResponse.classification);
                 console.log('Confidence:', jsonResponse.confidence);
                 console.log('Graph URL:', jsonResponse.graphUrl);